@@ -191,7 +191,7 @@ export default function LogsScreen() {
                         <View style={{ borderRadius: 8, overflow: "hidden", borderWidth: 2, borderColor: "#2196F3", marginTop: 4 }}>
                           <TouchableOpacity onPress={() => setSelectedImage(ApiService.getFaceImageUrl(log.face_image_url) ?? null)}>
                             <Image
-                              source={{ uri: ApiService.getFaceImageUrl(log.face_image_url) ?? undefined }}
+                              source={{ uri: ApiService.getFaceImageUrl(log.face_image_url, 256) ?? undefined }}
                               style={{ width: 80, height: 80, resizeMode: "cover" }}
                             />
                           </TouchableOpacity>
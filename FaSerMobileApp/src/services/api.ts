@@ -38,6 +38,20 @@ export interface AccessLog {
   timestamp: string
 }
 
+export interface LogPage {
+  logs: AccessLog[]
+  nextCursor: string | null
+}
+
+export interface LogStats {
+  since: string
+  until: string
+  granularity: "hour" | "day"
+  totals: Record<string, number>
+  series: { period: string; counts: Record<string, number> }[]
+  top_users: { user_id: number; user_name?: string | null; count: number }[]
+}
+
 export interface CameraStatus {
   status: string
   camera_index: number
@@ -144,10 +158,84 @@ class ApiService {
     }
   }
 
+  // Cursor paging: pass the previous page's nextCursor to load older logs
+  async getLogsPage(cursor?: string | null, limit = 100, status?: string): Promise<LogPage> {
+    try {
+      let url = `/logs/?limit=${limit}`
+      if (cursor) {
+        url += `&cursor=${encodeURIComponent(cursor)}`
+      }
+      if (status) {
+        url += `&status=${status}`
+      }
+      const response = await api.get(url)
+      return { logs: response.data, nextCursor: response.headers["x-next-cursor"] ?? null }
+    } catch (error) {
+      console.error("Get logs page failed:", error)
+      return { logs: [], nextCursor: null }
+    }
+  }
+
+  // Dashboard counts; cost does not grow with the number of logs
+  async getLogStats(granularity: "hour" | "day" = "day", since?: string, until?: string): Promise<LogStats | null> {
+    try {
+      let url = `/logs/stats?granularity=${granularity}`
+      if (since) {
+        url += `&since=${encodeURIComponent(since)}`
+      }
+      if (until) {
+        url += `&until=${encodeURIComponent(until)}`
+      }
+      const response = await api.get(url)
+      return response.data
+    } catch (error) {
+      console.error("Get log stats failed:", error)
+      return null
+    }
+  }
+
+  // Live door events over a WebSocket; reconnects and resumes from the last
+  // id seen. Returns a function that closes the subscription.
+  subscribeLogs(onLog: (log: AccessLog) => void, statuses: string[] = []): () => void {
+    let socket: WebSocket | null = null
+    let lastId: number | null = null
+    let closed = false
+    let retryTimer: ReturnType<typeof setTimeout> | null = null
+
+    const connect = () => {
+      const params = statuses.map((status) => `status=${encodeURIComponent(status)}`)
+      if (lastId !== null) {
+        params.push(`last_id=${lastId}`)
+      }
+      const query = params.length ? `?${params.join("&")}` : ""
+      socket = new WebSocket(`${BASE_URL.replace(/^http/, "ws")}/logs/ws${query}`)
+      socket.onmessage = (message) => {
+        const log: AccessLog = JSON.parse(message.data)
+        lastId = log.id
+        onLog(log)
+      }
+      socket.onclose = () => {
+        if (!closed) {
+          retryTimer = setTimeout(connect, 2000)
+        }
+      }
+    }
+
+    connect()
+    return () => {
+      closed = true
+      if (retryTimer) {
+        clearTimeout(retryTimer)
+      }
+      socket?.close()
+    }
+  }
+
   // Utility to get full image URL
-  getFaceImageUrl(relativeUrl: string | undefined | null): string | undefined {
+  // size asks the server for a thumbnail (64 or 256 px on the longest side)
+  getFaceImageUrl(relativeUrl: string | undefined | null, size?: number): string | undefined {
     if (!relativeUrl) return undefined
-    return `${BASE_URL}${relativeUrl}`
+    return size ? `${BASE_URL}${relativeUrl}?size=${size}` : `${BASE_URL}${relativeUrl}`
   }
 }
 
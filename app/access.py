@@ -0,0 +1,62 @@
+import numpy as np
+
+from .encoding import unpack
+from .gallery import gallery
+
+
+def validate_encoding(encoding_data, expected_dim=128):
+    """Validate and potentially fix face encoding dimensions"""
+    try:
+        if isinstance(encoding_data, (str, bytes)):
+            encoding = unpack(encoding_data).astype(np.float64)
+        else:
+            encoding = np.array(encoding_data, dtype=np.float64)
+        
+        print(f"[DEBUG] Encoding shape: {encoding.shape}")
+        
+        if encoding.shape[0] == expected_dim:
+            return encoding
+        elif encoding.shape[0] > expected_dim:
+            print(f"[WARNING] Truncating encoding from {encoding.shape[0]} to {expected_dim}")
+            return encoding[:expected_dim]
+        else:
+            # Pad if too short
+            print(f"[WARNING] Padding encoding from {encoding.shape[0]} to {expected_dim}")
+            padded = np.zeros(expected_dim)
+            padded[:encoding.shape[0]] = encoding
+            return padded
+            
+    except Exception as e:
+        print(f"[ERROR] Failed to validate encoding: {e}")
+        return None
+
+
+def probe_encoding(encodings):
+    """Validated encoding of the first detected face, if any"""
+    return validate_encoding(encodings[0]) if len(encodings) else None
+
+
+def decide_access(locations, encodings, current_encoding, match):
+    """Turn detection and match results into a log entry, door command and message"""
+    if not locations:
+        return {"user_id": None, "status": "no_face"}, 'X', None, "No face detected"
+    if not len(encodings):
+        return {"user_id": None, "status": "no_encoding"}, 'X', None, "Could not encode face"
+    if current_encoding is None:
+        return {"user_id": None, "status": "invalid_encoding"}, 'X', None, "Invalid face encoding"
+    if not len(gallery):
+        return ({"user_id": None, "status": "no_valid_users"}, 'X', None,
+                "No valid user encodings available")
+    if match is None:
+        print("❌ Access denied - no matching face")
+        return ({"user_id": None, "status": "denied", "face_encoding": current_encoding}, 'X', None,
+                "Access denied - face not recognized")
+    print(f"[DEBUG] Best match user {match.user_id} at distance {match.distance:.3f}")
+    if match.active:
+        print(f"✅ Access granted for user {match.user_id}")
+        return ({"user_id": match.user_id, "status": "granted"}, 'O', match.name,
+                f"Access granted to {match.name}")
+    print(f"❌ Access denied - user {match.user_id} is inactive")
+    return ({"user_id": match.user_id, "status": "denied", "face_encoding": current_encoding}, 'X',
+            match.name, f"Access denied - user {match.name} is inactive")
+
@@ -0,0 +1,337 @@
+"""Retention for access logs: old rows move to monthly gzip'd NDJSON files.
+
+Each month is one file, ``access_logs-YYYY-MM.ndjson.gz``, next to a
+``manifest.json`` that records the partitions and the cutoff below which
+rows live in the archive instead of the database. Runs append a new gzip
+member to a month's file, so re-archiving never rewrites existing data;
+only a run resuming after a crash rewrites the months it had touched.
+
+Usage: python -m app.archive [--days N]
+"""
+import argparse
+import base64
+import gzip
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Iterator, List, Optional, Tuple
+
+from sqlalchemy import delete
+from sqlalchemy.orm import Session
+
+from . import models
+from .encoding import pack, unpack
+
+# Rows older than this many days are archived; 0 disables retention
+LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", "90"))
+LOG_ARCHIVE_DIR = os.getenv(
+    "LOG_ARCHIVE_DIR", os.path.abspath(os.path.join(os.path.dirname(__file__), "../log_archive")))
+# Keep denied faces' encodings in the archive (about 0.5 KB per row)
+LOG_ARCHIVE_ENCODINGS = os.getenv("LOG_ARCHIVE_ENCODINGS", "1") == "1"
+# Archive automatically every N hours while the API runs; 0 leaves it to cron
+LOG_ARCHIVE_INTERVAL_HOURS = float(os.getenv("LOG_ARCHIVE_INTERVAL_HOURS", "0"))
+# Decoded month partitions kept in memory for GET /logs
+LOG_ARCHIVE_CACHE = int(os.getenv("LOG_ARCHIVE_CACHE", "2"))
+
+MANIFEST = "manifest.json"
+BATCH_SIZE = 5000
+
+Row = Tuple[models.AccessLog, Optional[str]]
+
+
+def _month(timestamp: datetime) -> str:
+    return timestamp.strftime("%Y-%m")
+
+
+def _to_record(log: models.AccessLog, user_name: Optional[str]) -> dict:
+    encoding = None
+    if LOG_ARCHIVE_ENCODINGS and log.face_encoding is not None:
+        encoding = base64.b64encode(pack(log.face_encoding)).decode()
+    return {
+        "id": log.id,
+        "user_id": log.user_id,
+        "user_name": user_name,
+        "status": log.status,
+        "timestamp": log.timestamp.isoformat(),
+        "face_image_url": log.face_image_url,
+        "face_encoding": encoding,
+    }
+
+
+def _from_record(record: dict) -> Row:
+    encoding = record.get("face_encoding")
+    log = models.AccessLog(
+        id=record["id"],
+        user_id=record["user_id"],
+        status=record["status"],
+        timestamp=datetime.fromisoformat(record["timestamp"]),
+        face_image_url=record.get("face_image_url"),
+        face_encoding=unpack(base64.b64decode(encoding)) if encoding else None,
+    )
+    return log, record.get("user_name")
+
+
+class LogArchive:
+    def __init__(self, directory: str = LOG_ARCHIVE_DIR, cache_size: int = LOG_ARCHIVE_CACHE):
+        self.directory = directory
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    # Manifest
+
+    def manifest(self) -> dict:
+        path = os.path.join(self.directory, MANIFEST)
+        if not os.path.exists(path):
+            return {"archived_before": None, "pending_cutoff": None, "partitions": {}}
+        with open(path) as f:
+            return json.load(f)
+
+    def _save_manifest(self, manifest: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, MANIFEST)
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def archived_before(self) -> Optional[datetime]:
+        value = self.manifest().get("archived_before")
+        return datetime.fromisoformat(value) if value else None
+
+    # Writing
+
+    def archive(self, db: Session, cutoff: datetime) -> int:
+        """Move logs older than cutoff into the archive; returns rows moved.
+
+        pending_cutoff is saved before anything is written and cleared once
+        the rows are deleted. A run interrupted in between is resumed by the
+        next one: months it touched are recovered from their files and rows
+        already there are skipped, so nothing is archived twice.
+        """
+        manifest = self.manifest()
+        moved = 0
+        pending = manifest.get("pending_cutoff")
+        if pending:
+            pending = datetime.fromisoformat(pending)
+            moved += self._write_before(db, manifest, pending, resume=True)
+            self._save_manifest(manifest)
+            self._delete_before(db, pending)
+            self._finish(manifest, pending)
+
+        manifest["pending_cutoff"] = cutoff.isoformat()
+        self._save_manifest(manifest)
+        moved += self._write_before(db, manifest, cutoff, resume=False)
+        self._save_manifest(manifest)
+        self._delete_before(db, cutoff)
+        self._finish(manifest, cutoff)
+        with self._lock:
+            self._cache.clear()
+        print(f"[INFO] Archived {moved} access logs older than {cutoff.isoformat()}")
+        return moved
+
+    def _write_before(self, db: Session, manifest: dict, cutoff: datetime, resume: bool) -> int:
+        """Append rows older than cutoff to their month files"""
+        query = (
+            db.query(models.AccessLog, models.User.name)
+            .outerjoin(models.User, models.User.id == models.AccessLog.user_id)
+            .filter(models.AccessLog.timestamp < cutoff)
+            .order_by(models.AccessLog.timestamp, models.AccessLog.id)
+            .yield_per(BATCH_SIZE)
+        )
+        os.makedirs(self.directory, exist_ok=True)
+        partitions = manifest.setdefault("partitions", {})
+        written = set()
+        moved = 0
+        out = None
+        out_month = None
+        try:
+            for log, user_name in query:
+                month = _month(log.timestamp)
+                if month != out_month:
+                    if out is not None:
+                        out.close()
+                    out_month = month
+                    written = self._recover(month, partitions) if resume else set()
+                    out = gzip.open(self._path(month), "at", encoding="utf-8")
+                if log.id in written:
+                    continue
+                out.write(json.dumps(_to_record(log, user_name)) + "\n")
+                self._count(partitions, month, log.timestamp)
+                moved += 1
+        finally:
+            if out is not None:
+                out.close()
+        db.rollback()
+        return moved
+
+    def _count(self, partitions: dict, month: str, timestamp: datetime):
+        info = partitions.setdefault(month, {
+            "file": os.path.basename(self._path(month)), "rows": 0,
+            "min_timestamp": timestamp.isoformat(), "max_timestamp": timestamp.isoformat(),
+        })
+        info["rows"] += 1
+        info["min_timestamp"] = min(info["min_timestamp"], timestamp.isoformat())
+        info["max_timestamp"] = max(info["max_timestamp"], timestamp.isoformat())
+
+    def _recover(self, month: str, partitions: dict) -> set:
+        """Rewrite a month file an interrupted run appended to; returns its ids.
+
+        Complete records are kept and a torn tail is dropped, then the file
+        is swapped in with a rename and its manifest entry recounted.
+        """
+        partitions.pop(month, None)
+        path = self._path(month)
+        if not os.path.exists(path):
+            return set()
+        records = []
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        records.append(json.loads(line))
+        except (EOFError, gzip.BadGzipFile, json.JSONDecodeError):
+            print(f"[WARNING] Dropped a partial write at the end of {os.path.basename(path)}")
+        tmp = path + ".tmp"
+        with gzip.open(tmp, "wt", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+        os.replace(tmp, path)
+        for record in records:
+            self._count(partitions, month, datetime.fromisoformat(record["timestamp"]))
+        return {record["id"] for record in records}
+
+    def _delete_before(self, db: Session, cutoff: datetime):
+        db.execute(delete(models.AccessLog).where(models.AccessLog.timestamp < cutoff))
+        db.commit()
+
+    def _finish(self, manifest: dict, cutoff: datetime):
+        previous = manifest.get("archived_before")
+        if not previous or cutoff > datetime.fromisoformat(previous):
+            manifest["archived_before"] = cutoff.isoformat()
+        manifest["pending_cutoff"] = None
+        self._save_manifest(manifest)
+
+    def _path(self, month: str) -> str:
+        return os.path.join(self.directory, f"access_logs-{month}.ndjson.gz")
+
+    # Reading
+
+    def _partition(self, month: str) -> List[Row]:
+        """All rows of one month, newest first"""
+        with self._lock:
+            if month in self._cache:
+                self._cache.move_to_end(month)
+                return self._cache[month]
+        rows = []
+        with gzip.open(self._path(month), "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    rows.append(_from_record(json.loads(line)))
+        rows.sort(key=lambda row: (row[0].timestamp, row[0].id), reverse=True)
+        with self._lock:
+            self._cache[month] = rows
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return rows
+
+    def read(self, limit: int, status: Optional[str] = None,
+             before: Optional[Tuple[datetime, int]] = None) -> List[Row]:
+        """Newest-first archived rows, filtered like crud.get_logs.
+
+        before is a decoded (timestamp, id) cursor; months that start after
+        it are skipped without being opened.
+        """
+        partitions = self.manifest().get("partitions", {})
+        result = []
+        for month in sorted(partitions, reverse=True):
+            if len(result) >= limit:
+                break
+            if before is not None and datetime.fromisoformat(partitions[month]["min_timestamp"]) > before[0]:
+                continue
+            for log, user_name in self._partition(month):
+                if status and log.status != status:
+                    continue
+                if before is not None and (log.timestamp, log.id) >= before:
+                    continue
+                result.append((log, user_name))
+                if len(result) >= limit:
+                    break
+        return result
+
+    def iter_rows(self, since: Optional[datetime] = None, until: Optional[datetime] = None) -> Iterator[Row]:
+        """Stream archived rows month by month, oldest month first, without
+        holding more than one line in memory"""
+        partitions = self.manifest().get("partitions", {})
+        for month in sorted(partitions):
+            info = partitions[month]
+            if since is not None and datetime.fromisoformat(info["max_timestamp"]) < since:
+                continue
+            if until is not None and datetime.fromisoformat(info["min_timestamp"]) >= until:
+                continue
+            with gzip.open(self._path(month), "rt", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    log, user_name = _from_record(json.loads(line))
+                    if since is not None and log.timestamp < since:
+                        continue
+                    if until is not None and log.timestamp >= until:
+                        continue
+                    yield log, user_name
+
+    def has_data(self) -> bool:
+        return bool(self.manifest().get("partitions"))
+
+    # Background retention
+
+    def start(self, session_factory, days: int = LOG_RETENTION_DAYS,
+              interval_hours: float = LOG_ARCHIVE_INTERVAL_HOURS):
+        if days <= 0 or interval_hours <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._stop.clear()
+
+        def run():
+            while not self._stop.is_set():
+                db = session_factory()
+                try:
+                    self.archive(db, datetime.utcnow() - timedelta(days=days))
+                except Exception as e:
+                    print(f"[ERROR] Log archiving failed: {e}")
+                finally:
+                    db.close()
+                self._stop.wait(interval_hours * 3600)
+
+        self._thread = threading.Thread(target=run, name="log-archiver", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+            self._thread = None
+
+
+log_archive = LogArchive()
+
+
+if __name__ == "__main__":
+    from .database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Archive old access logs")
+    parser.add_argument("--days", type=int, default=LOG_RETENTION_DAYS,
+                        help="archive logs older than this many days")
+    args = parser.parse_args()
+    if args.days <= 0:
+        raise SystemExit("Retention is disabled (--days must be positive)")
+    session = SessionLocal()
+    try:
+        log_archive.archive(session, datetime.utcnow() - timedelta(days=args.days))
+    finally:
+        session.close()
@@ -0,0 +1,200 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import NamedTuple, Optional
+
+import cv2
+import numpy as np
+
+CAMERA_JPEG_QUALITY = int(os.getenv("CAMERA_JPEG_QUALITY", "80"))
+# Recent frames kept for consumers; older frames are dropped, never queued
+FRAME_BUFFER_SIZE = int(os.getenv("FRAME_BUFFER_SIZE", "4"))
+# Seconds between attempts to (re)open the camera
+CAMERA_RETRY_SECONDS = float(os.getenv("CAMERA_RETRY_SECONDS", "2"))
+# Release the camera once nobody has used a frame for this long
+CAMERA_IDLE_SECONDS = float(os.getenv("CAMERA_IDLE_SECONDS", "10"))
+
+
+class Frame(NamedTuple):
+    seq: int
+    timestamp: float
+    image: np.ndarray         # BGR, as read from the camera
+    jpeg: Optional[bytes]     # only encoded while someone is streaming
+
+
+def find_available_camera():
+    """Find the first available camera index"""
+    for i in range(10):
+        cap = cv2.VideoCapture(i)
+        if cap.isOpened():
+            ret, frame = cap.read()
+            if ret:
+                print(f"Found working camera at index {i}")
+                return cap, i
+            cap.release()
+    return None, -1
+
+
+class FrameHub:
+    """Owns the camera on a single producer thread and fans frames out.
+
+    Consumers never touch the VideoCapture; they read the latest frame from
+    a small ring buffer, so a slow consumer simply skips frames. The thread
+    starts on demand and releases the camera once no consumer is registered
+    and no frame has been asked for in idle_seconds.
+    """
+
+    def __init__(self, buffer_size: int = FRAME_BUFFER_SIZE, idle_seconds: float = CAMERA_IDLE_SECONDS,
+                 open_camera=find_available_camera):
+        self._cond = threading.Condition()
+        self._frames = deque(maxlen=buffer_size)
+        self._seq = 0
+        self._thread = None
+        self._stop = threading.Event()
+        self._viewers = 0
+        self._consumers = 0
+        self._last_used = time.monotonic()
+        self.idle_seconds = idle_seconds
+        self._open_camera = open_camera
+        self.camera_index = -1
+        self.error = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._cond:
+            if self.running:
+                return
+            self._stop.clear()
+            self.error = None
+            self._thread = threading.Thread(target=self._run, name="camera-capture", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout=5)
+        with self._cond:
+            self._thread = None
+            self._frames.clear()
+            self._cond.notify_all()
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+    @contextmanager
+    def consumer(self):
+        """Keep the camera open while the block runs"""
+        with self._cond:
+            self._consumers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._consumers -= 1
+                self._last_used = time.monotonic()
+
+    @contextmanager
+    def viewer(self):
+        """Register a stream client so frames get JPEG-encoded"""
+        with self.consumer():
+            with self._cond:
+                self._viewers += 1
+            try:
+                yield
+            finally:
+                with self._cond:
+                    self._viewers -= 1
+
+    def latest(self) -> Optional[Frame]:
+        with self._cond:
+            return self._frames[-1] if self._frames else None
+
+    def wait_for(self, after_seq: int = 0, timeout: float = CAMERA_RETRY_SECONDS * 2) -> Optional[Frame]:
+        """Block until a frame newer than after_seq exists.
+
+        Returns None on timeout or when the camera is unavailable.
+        """
+        with self._cond:
+            self._last_used = time.monotonic()
+        self.start()
+        with self._cond:
+            # The buffer is emptied when capture stops, so a restart waits for a fresh frame
+            ready = self._cond.wait_for(
+                lambda: (self._frames and self._seq > after_seq) or self.error is not None or self._stop.is_set(),
+                timeout=timeout,
+            )
+            if not ready or not self._frames or self._seq <= after_seq:
+                return None
+            return self._frames[-1]
+
+    def _publish(self, image: np.ndarray):
+        with self._cond:
+            encode = self._viewers > 0
+        jpeg = None
+        if encode:
+            ok, buf = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, CAMERA_JPEG_QUALITY])
+            if ok:
+                jpeg = buf.tobytes()
+            else:
+                print("Failed to encode frame")
+        with self._cond:
+            self._seq += 1
+            self._frames.append(Frame(self._seq, time.time(), image, jpeg))
+            self.error = None
+            self._cond.notify_all()
+
+    def _fail(self, message: str):
+        with self._cond:
+            self.error = message
+            self._cond.notify_all()
+        self._stop.wait(CAMERA_RETRY_SECONDS)
+
+    def _idle(self) -> bool:
+        return self._consumers == 0 and time.monotonic() - self._last_used > self.idle_seconds
+
+    def _run(self):
+        cap = None
+        try:
+            while not self._stop.is_set():
+                if self._idle():
+                    # Release first so a restart racing with this exit can open it
+                    if cap is not None:
+                        cap.release()
+                        cap = None
+                    with self._cond:
+                        if self._idle():
+                            self._thread = None
+                            self._frames.clear()
+                            self._cond.notify_all()
+                            print("Camera idle, released")
+                            return
+                if cap is None:
+                    print("Initializing camera...")
+                    cap, self.camera_index = self._open_camera()
+                    if cap is None:
+                        print("No working cameras found")
+                        self._fail("No camera available. Please check camera connection and permissions.")
+                        continue
+                    print(f"Camera initialized at index {self.camera_index}")
+                ret, image = cap.read()
+                if not ret:
+                    print("Failed to read frame from camera")
+                    cap.release()
+                    cap = None
+                    self._fail("Cannot read from camera")
+                    continue
+                self._publish(image)
+        finally:
+            if cap is not None:
+                cap.release()
+                print("Camera resources cleaned up")
+
+
+frame_hub = FrameHub()
@@ -1,6 +1,17 @@
-from . import models, schemas
+from . import models, rollup, schemas
+from .events import log_bus
+from .gallery import aggregate, gallery, to_vector, written_versions
+from sqlalchemy import tuple_
 from sqlalchemy.orm import Session
-from typing import Optional, List
+from typing import Iterator, Optional, List, Tuple
+from datetime import datetime
+import base64
+import binascii
+import os
+import numpy as np
+
+# Samples kept per user; enrolling more drops the oldest
+FACE_MAX_SAMPLES = int(os.getenv("FACE_MAX_SAMPLES", "10"))
 
 
 def get_user(db: Session, user_id: int) -> Optional[models.User]:
@@ -38,43 +49,177 @@ def update_user(db: Session, db_user: models.User, user_update: schemas.UserUpda
         db_user.active = user_update.active
     db.commit()
     db.refresh(db_user)
+    gallery.update_user(db_user.id, db_user.name, db_user.active, written_versions(db))
     return db_user
 
 
 def delete_user(db: Session, db_user: models.User):
+    user_id = db_user.id
     db.delete(db_user)
     db.commit()
+    gallery.remove(user_id, written_versions(db))
 
 # Face CRUD
 
-def create_face(db: Session, user_id: int, encoding: str) -> models.Face:
+def _refresh_template(db: Session, user: models.User) -> List[np.ndarray]:
+    """Recompute the user's stored aggregate from their samples and return
+    the sample vectors"""
+    db.flush()
+    db.refresh(user, ["faces", "template"])
+    vectors = [v for v in (to_vector(face.encoding) for face in user.faces) if v is not None]
+    if not vectors:
+        user.template = None
+        return vectors
+    centroid, spread = aggregate(np.stack(vectors))
+    if user.template is None:
+        user.template = models.FaceTemplate(user_id=user.id)
+    user.template.centroid = centroid
+    user.template.spread = spread
+    user.template.samples = len(vectors)
+    return vectors
+
+
+def _commit_faces(db: Session, user: models.User):
+    vectors = _refresh_template(db, user)
+    db.commit()
+    if vectors:
+        gallery.upsert(user.id, user.name, user.active, vectors, written_versions(db))
+    else:
+        gallery.remove(user.id, written_versions(db))
+
+
+def create_face(db: Session, user_id: int, encoding: np.ndarray, replace: bool = False) -> models.Face:
+    """Enroll another sample for a user. The oldest samples are dropped past
+    FACE_MAX_SAMPLES; replace drops all previous ones."""
+    user = get_user(db, user_id)
     face = models.Face(encoding=encoding, user_id=user_id)
     db.add(face)
-    db.commit()
+    db.flush()
+    db.refresh(user, ["faces"])
+    keep = 1 if replace else FACE_MAX_SAMPLES
+    for old in user.faces[:-keep]:
+        db.delete(old)
+    _commit_faces(db, user)
+    db.refresh(face)
+    return face
+
+
+def update_face(db: Session, face: models.Face, encoding: np.ndarray) -> models.Face:
+    face.encoding = encoding
+    _commit_faces(db, face.user)
     db.refresh(face)
     return face
 
 
-def get_face_by_user(db: Session, user_id: int) -> Optional[models.Face]:
-    return db.query(models.Face).filter(models.Face.user_id == user_id).first()
+def delete_face(db: Session, face: models.Face):
+    user = face.user
+    db.delete(face)
+    _commit_faces(db, user)
+
+
+def get_face(db: Session, user_id: int, face_id: int) -> Optional[models.Face]:
+    return (
+        db.query(models.Face)
+        .filter(models.Face.user_id == user_id, models.Face.id == face_id)
+        .first()
+    )
+
+
+def get_faces(db: Session, user_id: int) -> List[models.Face]:
+    return db.query(models.Face).filter(models.Face.user_id == user_id).order_by(models.Face.id).all()
 
 # Logs CRUD
 
-def log_access(db: Session, user_id: Optional[int], status: str, face_encoding: Optional[str] = None) -> models.AccessLog:
-    log = models.AccessLog(user_id=user_id, status=status, face_encoding=face_encoding)
+def log_access(db: Session, user_id: Optional[int], status: str, face_encoding: Optional[np.ndarray] = None,
+               face_image_url: Optional[str] = None) -> models.AccessLog:
+    log = models.AccessLog(user_id=user_id, status=status, face_encoding=face_encoding,
+                           face_image_url=face_image_url)
     db.add(log)
+    db.flush()
+    rollup.apply(db, rollup.count([log]))
     db.commit()
     db.refresh(log)
+    log_bus.publish([log])
     return log
 
 
-def get_logs(db: Session, skip: int = 0, limit: int = 100, status: Optional[str] = None):
-    query = db.query(models.AccessLog)
+def log_access_many(db: Session, entries: List[dict]) -> List[models.AccessLog]:
+    """Insert several access logs in a single transaction.
+
+    Logs are detached after the flush so their ids and timestamps stay
+    readable without a refresh query per row.
+    """
+    logs = [models.AccessLog(**entry) for entry in entries]
+    db.add_all(logs)
+    db.flush()
+    rollup.apply(db, rollup.count(logs))
+    for log in logs:
+        db.expunge(log)
+    db.commit()
+    log_bus.publish(logs)
+    return logs
+
+
+def encode_log_cursor(log: models.AccessLog) -> str:
+    """Opaque cursor pointing just past this log in newest-first order"""
+    raw = f"{log.timestamp.isoformat()}|{log.id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_log_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Inverse of encode_log_cursor; raises ValueError for a malformed cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, log_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(timestamp), int(log_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+def get_logs(db: Session, skip: int = 0, limit: int = 100, status: Optional[str] = None,
+             cursor: Optional[str] = None) -> List[Tuple[models.AccessLog, Optional[str]]]:
+    """Newest-first (log, user_name) pairs in a single joined query.
+
+    With a cursor, paging is keyset-based on (timestamp, id) and skip is
+    ignored, so deep pages cost the same as the first one.
+    """
+    query = (
+        db.query(models.AccessLog, models.User.name)
+        .outerjoin(models.User, models.User.id == models.AccessLog.user_id)
+    )
     if status:
         query = query.filter(models.AccessLog.status == status)
-    # Order by latest first
-    query = query.order_by(models.AccessLog.timestamp.desc())
-    return query.offset(skip).limit(limit).all()
+    if cursor:
+        timestamp, log_id = decode_log_cursor(cursor)
+        query = query.filter(tuple_(models.AccessLog.timestamp, models.AccessLog.id) < (timestamp, log_id))
+    # Order by latest first; id breaks ties between identical timestamps
+    query = query.order_by(models.AccessLog.timestamp.desc(), models.AccessLog.id.desc())
+    if not cursor:
+        query = query.offset(skip)
+    return query.limit(limit).all()
+
+
+def iter_logs(db: Session, since: Optional[datetime] = None, until: Optional[datetime] = None,
+              status: Optional[str] = None, user_id: Optional[int] = None,
+              batch_size: int = 1000) -> Iterator[Tuple[models.AccessLog, Optional[str]]]:
+    """Oldest-first (log, user_name) pairs streamed with a server-side cursor"""
+    query = (
+        db.query(models.AccessLog, models.User.name)
+        .outerjoin(models.User, models.User.id == models.AccessLog.user_id)
+    )
+    if since is not None:
+        query = query.filter(models.AccessLog.timestamp >= since)
+    if until is not None:
+        query = query.filter(models.AccessLog.timestamp < until)
+    if status:
+        query = query.filter(models.AccessLog.status == status)
+    if user_id is not None:
+        query = query.filter(models.AccessLog.user_id == user_id)
+    query = query.order_by(models.AccessLog.timestamp, models.AccessLog.id)
+    # The identity map only holds weak references, so rows already yielded
+    # are released as the caller moves on
+    yield from query.yield_per(batch_size)
+
 
 # Notification Tokens CRUD
 
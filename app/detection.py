@@ -0,0 +1,96 @@
+import os
+from typing import List, NamedTuple, Tuple
+
+import cv2
+import numpy as np
+
+Location = Tuple[int, int, int, int]  # (top, right, bottom, left)
+
+
+class DetectorSettings(NamedTuple):
+    model: str = "hog"        # hog (CPU) or cnn
+    upsample: int = 1         # number_of_times_to_upsample
+    max_edge: int = 1024      # longest side detection runs at, 0 for no limit
+    scale: float = 1.0        # extra downscale factor applied before max_edge
+
+
+def _setting(endpoint: str, key: str, default: str) -> str:
+    specific = os.getenv(f"FACE_DETECT_{endpoint.upper()}_{key}")
+    return specific if specific is not None else os.getenv(f"FACE_DETECT_{key}", default)
+
+
+def detector_settings(endpoint: str) -> DetectorSettings:
+    """Settings for one caller, e.g. "recognize", "upload", "batch" or "live".
+
+    FACE_DETECT_<ENDPOINT>_<KEY> overrides FACE_DETECT_<KEY>, where KEY is
+    MODEL, UPSAMPLE, MAX_EDGE or SCALE.
+    """
+    defaults = DetectorSettings()
+    return DetectorSettings(
+        model=_setting(endpoint, "MODEL", defaults.model),
+        upsample=int(_setting(endpoint, "UPSAMPLE", str(defaults.upsample))),
+        max_edge=int(_setting(endpoint, "MAX_EDGE", str(defaults.max_edge))),
+        scale=float(_setting(endpoint, "SCALE", str(defaults.scale))),
+    )
+
+
+def detection_factor(shape, settings: DetectorSettings) -> float:
+    """Resize factor (<= 1) applied to an image of this shape before detection"""
+    factor = min(settings.scale, 1.0)
+    if settings.max_edge > 0:
+        factor = min(factor, settings.max_edge / float(max(shape[:2])))
+    return factor
+
+
+def downscale(image: np.ndarray, factor: float) -> np.ndarray:
+    if factor >= 1.0:
+        return image
+    height, width = image.shape[:2]
+    size = (max(1, int(round(width * factor))), max(1, int(round(height * factor))))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+def rescale_locations(locations, factor: float, shape) -> List[Location]:
+    """Map boxes found on a downscaled image back to full-resolution pixels"""
+    if factor >= 1.0:
+        return [tuple(int(v) for v in loc) for loc in locations]
+    height, width = shape[:2]
+    rescaled = []
+    for top, right, bottom, left in locations:
+        rescaled.append((
+            max(0, int(round(top / factor))),
+            min(width, int(round(right / factor))),
+            min(height, int(round(bottom / factor))),
+            max(0, int(round(left / factor))),
+        ))
+    return rescaled
+
+
+def detect_faces(image: np.ndarray, settings: DetectorSettings = DetectorSettings()) -> List[Location]:
+    """face_locations on a bounded-size copy, returned in full-resolution coordinates"""
+    import face_recognition
+    factor = detection_factor(image.shape, settings)
+    locations = face_recognition.face_locations(
+        downscale(image, factor),
+        number_of_times_to_upsample=settings.upsample,
+        model=settings.model,
+    )
+    return rescale_locations(locations, factor, image.shape)
+
+
+def detect_faces_batch(images: List[np.ndarray], settings: DetectorSettings,
+                       batch_size: int = 8) -> List[List[Location]]:
+    """detect_faces for several images; uses dlib's batched CNN detector when
+    the cnn model is configured and the downscaled images share a size"""
+    import face_recognition
+    factors = [detection_factor(image.shape, settings) for image in images]
+    small = [downscale(image, factor) for image, factor in zip(images, factors)]
+    if settings.model == "cnn" and len({image.shape for image in small}) == 1:
+        found = face_recognition.batch_face_locations(
+            small, number_of_times_to_upsample=settings.upsample, batch_size=batch_size)
+    else:
+        found = [face_recognition.face_locations(image, number_of_times_to_upsample=settings.upsample,
+                                                 model=settings.model)
+                 for image in small]
+    return [rescale_locations(locations, factor, image.shape)
+            for locations, factor, image in zip(found, factors, images)]
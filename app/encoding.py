@@ -0,0 +1,80 @@
+import base64
+import binascii
+
+import numpy as np
+from sqlalchemy.types import LargeBinary, TypeDecorator
+
+# Stored layout: b"FE" magic, 1 byte format version, 1 byte dtype code,
+# followed by the raw little-endian vector.
+MAGIC = b"FE"
+VERSION = 1
+HEADER_SIZE = 4
+_DTYPE_CODES = {b"f": np.dtype("<f4"), b"d": np.dtype("<f8")}
+_CODES_BY_DTYPE = {v: k for k, v in _DTYPE_CODES.items()}
+DEFAULT_DTYPE = np.dtype("<f4")
+
+
+def is_packed(blob) -> bool:
+    return isinstance(blob, (bytes, bytearray, memoryview)) and bytes(blob[:2]) == MAGIC
+
+
+def pack(vector, dtype=DEFAULT_DTYPE) -> bytes:
+    """Serialize an encoding vector into a tagged binary blob"""
+    dtype = np.dtype(dtype).newbyteorder("<")
+    header = MAGIC + bytes([VERSION]) + _CODES_BY_DTYPE[dtype]
+    return header + np.asarray(vector, dtype=dtype).ravel().tobytes()
+
+
+def unpack(blob) -> np.ndarray:
+    """Decode a stored encoding without copying the payload.
+
+    Also accepts the legacy formats (hex or base64 string of float64 values)
+    so that databases that have not been migrated yet keep working.
+    """
+    if isinstance(blob, str):
+        return np.frombuffer(_decode_legacy_text(blob), dtype=np.float64)
+    if is_packed(blob):
+        version = blob[2]
+        if version != VERSION:
+            raise ValueError(f"Unsupported encoding format version {version}")
+        dtype = _DTYPE_CODES[bytes(blob[3:4])]
+        return np.frombuffer(blob, dtype=dtype, offset=HEADER_SIZE)
+    # Legacy text that was stored as bytes, or untagged raw float64
+    try:
+        return np.frombuffer(_decode_legacy_text(bytes(blob).decode("ascii")), dtype=np.float64)
+    except (UnicodeDecodeError, ValueError):
+        return np.frombuffer(blob, dtype=np.float64)
+
+
+def _decode_legacy_text(value: str) -> bytes:
+    try:
+        return bytes.fromhex(value)
+    except ValueError:
+        try:
+            return base64.b64decode(value, validate=True)
+        except binascii.Error:
+            raise ValueError("Encoding is neither hex nor base64") from None
+
+
+class EncodingBlob(TypeDecorator):
+    """Column type storing a face encoding as a tagged binary blob"""
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or is_packed(value):
+            return value
+        if isinstance(value, (str, bytes, bytearray, memoryview)):
+            value = unpack(value)
+        return pack(value)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return unpack(value)
+
+    def compare_values(self, x, y):
+        if x is None or y is None:
+            return x is y
+        return np.array_equal(x, y)
@@ -0,0 +1,254 @@
+"""Cache of detect_and_encode results keyed by image content.
+
+Retried uploads reach /camera/recognize and /users/{id}/photo with the
+same bytes; the key is a SHA-256 of the bytes and the detector settings,
+so a hit skips dlib entirely. Entries live in an in-memory LRU and, when
+ENCODING_CACHE_DIR is set, in .npz files that survive restarts. The async
+methods read and write those files on the threadpool, and the least
+recently used files are removed once they exceed ENCODING_CACHE_DISK_BYTES.
+"""
+import asyncio
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+
+from .detection import DetectorSettings
+from .workers import detect_and_encode, detect_and_encode_batch, recognition_pool
+
+# Results kept in memory; 0 disables the cache
+ENCODING_CACHE_SIZE = int(os.getenv("ENCODING_CACHE_SIZE", "1024"))
+# Directory for the on-disk tier; empty keeps the cache in memory only
+ENCODING_CACHE_DIR = os.getenv("ENCODING_CACHE_DIR", "")
+# Size budget of the on-disk tier; 0 lets it grow without bound
+ENCODING_CACHE_DISK_BYTES = int(os.getenv("ENCODING_CACHE_DISK_BYTES", str(256 * 1024 * 1024)))
+
+Result = Tuple[list, list]  # (locations, encodings), as detect_and_encode returns
+
+
+def cache_key(contents: bytes, settings: DetectorSettings) -> str:
+    digest = hashlib.sha256(repr(tuple(settings)).encode())
+    digest.update(contents)
+    return digest.hexdigest()
+
+
+class EncodingCache:
+    def __init__(self, size: int = ENCODING_CACHE_SIZE, directory: str = ENCODING_CACHE_DIR,
+                 disk_bytes: int = ENCODING_CACHE_DISK_BYTES):
+        self.size = size
+        self.directory = directory
+        self.disk_bytes = disk_bytes
+        # Bytes on disk, counted on the first write; other processes sharing
+        # the directory make it an estimate, corrected whenever files are pruned
+        self._disk_used = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Jobs already running, so concurrent retries share one result
+        self._pending = {}
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.size > 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".npz")
+
+    def _read_disk(self, key: str) -> Optional[Result]:
+        path = self._path(key)
+        if not self.directory or not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                locations = [tuple(int(v) for v in loc) for loc in data["locations"]]
+                result = locations, list(data["encodings"])
+            # The modification time orders files for pruning, so a hit renews it
+            os.utime(path)
+            return result
+        except Exception as e:
+            print(f"[WARNING] Ignoring unreadable encoding cache file {path}: {e}")
+            return None
+
+    def _write_disk(self, key: str, result: Result):
+        if not self.directory:
+            return
+        locations, encodings = result
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                np.savez(f, locations=np.asarray(locations, dtype=np.int64).reshape(-1, 4),
+                         encodings=np.asarray(encodings, dtype=np.float64).reshape(-1, 128))
+            os.replace(tmp, path)
+            self._account(os.path.getsize(path))
+        except OSError as e:
+            print(f"[WARNING] Could not write encoding cache file {path}: {e}")
+
+    def _files(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(".npz"):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue  # removed by another process
+                    yield stat.st_mtime, stat.st_size, path
+
+    def _account(self, written: int):
+        """Count a written file and prune the oldest ones once over budget"""
+        if self.disk_bytes <= 0:
+            return
+        with self._lock:
+            if self._disk_used is not None:
+                self._disk_used += written
+                if self._disk_used <= self.disk_bytes:
+                    return
+        files = sorted(self._files())
+        used = sum(size for _, size, _ in files)
+        # Down to 90% of the budget, so a full cache doesn't prune on every write
+        target = self.disk_bytes * 0.9 if used > self.disk_bytes else used
+        removed = 0
+        for _, size, path in files:
+            if used <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            used -= size
+            removed += 1
+        with self._lock:
+            self._disk_used = used
+            self.disk_evictions += removed
+
+    def _memory(self, key: str) -> Optional[Result]:
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            return result
+
+    def _disk(self, key: str) -> Optional[Result]:
+        """Second tier of get; does file I/O when a directory is set"""
+        result = self._read_disk(key)
+        if result is not None:
+            with self._lock:
+                self.disk_hits += 1
+            self._remember(key, result)
+            return result
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def get(self, key: str) -> Optional[Result]:
+        if not self.enabled:
+            return None
+        result = self._memory(key)
+        return result if result is not None else self._disk(key)
+
+    def _remember(self, key: str, result: Result):
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def put(self, key: str, result: Result):
+        if not self.enabled:
+            return
+        self._remember(key, result)
+        self._write_disk(key, result)
+
+    def _disk_many(self, keys: Sequence[str]) -> List[Optional[Result]]:
+        return [self._disk(key) for key in keys]
+
+    def _write_many(self, items: Sequence[Tuple[str, Result]]):
+        for key, result in items:
+            self._write_disk(key, result)
+
+    async def _get_many_async(self, keys: Sequence[str]) -> List[Optional[Result]]:
+        """get for several keys, reading any files off the event loop"""
+        results = [self._memory(key) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if not missing:
+            return results
+        missing_keys = [keys[i] for i in missing]
+        if self.directory:
+            found = await run_in_threadpool(self._disk_many, missing_keys)
+        else:
+            found = self._disk_many(missing_keys)  # only counts the misses
+        for i, result in zip(missing, found):
+            results[i] = result
+        return results
+
+    async def _put_many_async(self, items: Sequence[Tuple[str, Result]]):
+        """put for several results, writing any files off the event loop"""
+        for key, result in items:
+            self._remember(key, result)
+        if self.directory and items:
+            await run_in_threadpool(self._write_many, items)
+
+    async def detect_and_encode(self, contents: bytes, settings: DetectorSettings, pool=recognition_pool) -> Result:
+        """detect_and_encode on the pool, unless these bytes were seen with
+        these settings before"""
+        if not self.enabled:
+            return await pool.run(detect_and_encode, contents, settings)
+        key = cache_key(contents, settings)
+        result, = await self._get_many_async([key])
+        if result is not None:
+            return result
+        pending = self._pending.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        future = asyncio.ensure_future(pool.run(detect_and_encode, contents, settings))
+        self._pending[key] = future
+        try:
+            result = await asyncio.shield(future)
+        finally:
+            self._pending.pop(key, None)
+        await self._put_many_async([(key, result)])
+        return result
+
+    async def detect_and_encode_batch(self, images: Sequence[bytes], settings: DetectorSettings,
+                                      pool=recognition_pool) -> List[Result]:
+        """detect_and_encode_batch on the pool for the images not cached yet"""
+        if not self.enabled:
+            return await pool.run(detect_and_encode_batch, list(images), settings)
+        keys = [cache_key(contents, settings) for contents in images]
+        results = await self._get_many_async(keys)
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            computed = await pool.run(detect_and_encode_batch, [images[i] for i in missing], settings)
+            for i, result in zip(missing, computed):
+                results[i] = result
+            await self._put_many_async([(keys[i], results[i]) for i in missing])
+        return results
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "capacity": self.size,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "disk_evictions": self.disk_evictions,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else None,
+            }
+
+
+encoding_cache = EncodingCache()
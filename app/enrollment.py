@@ -0,0 +1,262 @@
+"""Bulk enrollment: photos of many people encoded in parallel and stored in
+a few transactions.
+
+Photos come from a zip or a directory laid out as ``name/*.jpg``; the
+folder name is the user's name. Images are encoded in chunks on the
+recognition pool, users and faces are written ENROLL_COMMIT_SIZE users per
+transaction, and the gallery is updated once at the end.
+
+Usage: python -m app.enrollment DIRECTORY [--replace]
+"""
+import argparse
+import os
+import time
+import zipfile
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+import numpy as np
+from sqlalchemy import delete
+from sqlalchemy.orm import Session
+
+from . import models
+from .crud import FACE_MAX_SAMPLES
+from .detection import detector_settings
+from .gallery import aggregate, gallery, to_vector, written_versions
+from .workers import PoolBusy, encode_for_enrollment, recognition_pool
+
+# Images per pool job
+ENROLL_CHUNK_SIZE = int(os.getenv("ENROLL_CHUNK_SIZE", "16"))
+# Users written per transaction
+ENROLL_COMMIT_SIZE = int(os.getenv("ENROLL_COMMIT_SIZE", "500"))
+# Most photos one zip may hold
+ENROLL_ZIP_MAX_FILES = int(os.getenv("ENROLL_ZIP_MAX_FILES", "10000"))
+# Largest decompressed size of one photo inside a zip
+ENROLL_IMAGE_MAX_BYTES = int(os.getenv("ENROLL_IMAGE_MAX_BYTES", str(10 * 1024 * 1024)))
+ENROLL_DETECTOR = detector_settings("enroll")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+class Photo(NamedTuple):
+    name: str       # user the photo enrolls
+    path: str       # as given in the zip or directory, for the report
+    contents: bytes
+
+
+def _person(path: str) -> Optional[str]:
+    """Name for name/photo.jpg, None for files that don't follow the layout"""
+    parts = [p for p in path.replace("\\", "/").split("/") if p]
+    if len(parts) < 2 or any(p.startswith(".") or p == "__MACOSX" for p in parts):
+        return None
+    return parts[-2].strip() or None
+
+
+def _is_image(path: str) -> bool:
+    return path.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def zip_photos(file, skipped: List[dict]) -> Iterator[Photo]:
+    """Photos in a zip (a path or file object), read one at a time.
+
+    Members are counted and sized from the archive's directory before
+    anything is decompressed: a zip with more than ENROLL_ZIP_MAX_FILES
+    photos raises ValueError here, and oversized photos are skipped unread.
+    """
+    archive = zipfile.ZipFile(file)
+    members = [info for info in archive.infolist() if not info.is_dir() and _is_image(info.filename)]
+    if len(members) > ENROLL_ZIP_MAX_FILES:
+        archive.close()
+        raise ValueError(f"The zip holds more than {ENROLL_ZIP_MAX_FILES} photos")
+    return _zip_members(archive, members, skipped)
+
+
+def _zip_members(archive: zipfile.ZipFile, members: List[zipfile.ZipInfo], skipped: List[dict]) -> Iterator[Photo]:
+    with archive:
+        for info in members:
+            name = _person(info.filename)
+            if name is None:
+                skipped.append({"file": info.filename, "reason": "not in a name/ folder"})
+                continue
+            if info.file_size > ENROLL_IMAGE_MAX_BYTES:
+                skipped.append({"file": info.filename, "reason": f"larger than {ENROLL_IMAGE_MAX_BYTES} bytes"})
+                continue
+            # Reads stop at the declared size, so the check above bounds memory
+            yield Photo(name, info.filename, archive.read(info))
+
+
+def directory_photos(root: str, skipped: List[dict]) -> Iterator[Photo]:
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if not _is_image(filename):
+                continue
+            path = os.path.relpath(os.path.join(dirpath, filename), root)
+            name = _person(path)
+            if name is None:
+                skipped.append({"file": path, "reason": "not in a name/ folder"})
+                continue
+            with open(os.path.join(root, path), "rb") as f:
+                yield Photo(name, path, f.read())
+
+
+def _chunks(photos: Iterable[Photo], size: int) -> Iterator[List[Photo]]:
+    chunk = []
+    for photo in photos:
+        chunk.append(photo)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _submit(pool, chunk: List[Photo], settings):
+    # Live recognition shares the pool; wait for room instead of failing
+    while True:
+        try:
+            return pool.submit(encode_for_enrollment, [photo.contents for photo in chunk], settings)
+        except PoolBusy:
+            time.sleep(0.1)
+
+
+def encode_photos(photos: Iterable[Photo], skipped: List[dict], chunk_size: int = ENROLL_CHUNK_SIZE,
+                  pool=recognition_pool, settings=ENROLL_DETECTOR) -> Iterator[tuple]:
+    """(name, encoding) for every photo with exactly one face. At most one
+    chunk per worker is in flight, so memory stays bounded for any input."""
+    window = max(pool.workers, 1)
+    pending = deque()
+
+    def finish(chunk, future):
+        for photo, (faces, encoding) in zip(chunk, future.result()):
+            if faces == 1:
+                yield photo.name, encoding
+            else:
+                reason = "unreadable" if faces < 0 else "no face" if faces == 0 else f"{faces} faces"
+                skipped.append({"file": photo.path, "reason": reason})
+
+    for chunk in _chunks(photos, chunk_size):
+        if len(pending) >= window:
+            yield from finish(*pending.popleft())
+        pending.append((chunk, _submit(pool, chunk, settings)))
+    while pending:
+        yield from finish(*pending.popleft())
+
+
+def _store(db: Session, batch: Dict[str, List[np.ndarray]], replace: Iterable[str], report: dict) -> list:
+    """Write one batch of users and their new samples in a single
+    transaction, first dropping the old samples of the users named in
+    replace; returns the gallery rows for them"""
+    users = {u.name: u for u in db.query(models.User).filter(models.User.name.in_(list(batch)))}
+    new_users = [models.User(name=name, active=True) for name in batch if name not in users]
+    db.add_all(new_users)
+    db.flush()
+    users.update((user.name, user) for user in new_users)
+    report["users_created"] += len(new_users)
+    report["users_updated"] += len(batch) - len(new_users)
+    user_ids = [user.id for user in users.values()]
+
+    replace_ids = [users[name].id for name in replace]
+    if replace_ids:
+        db.execute(delete(models.Face).where(models.Face.user_id.in_(replace_ids)))
+    db.add_all([models.Face(user_id=users[name].id, encoding=encoding)
+                for name, encodings in batch.items() for encoding in encodings])
+    db.flush()
+    report["faces_added"] += sum(len(encodings) for encodings in batch.values())
+
+    samples: Dict[int, list] = {}
+    for face_id, user_id, encoding in (
+        db.query(models.Face.id, models.Face.user_id, models.Face.encoding)
+        .filter(models.Face.user_id.in_(user_ids))
+        .order_by(models.Face.id)
+    ):
+        samples.setdefault(user_id, []).append((face_id, encoding))
+    dropped = []
+    for user_id, faces in samples.items():
+        dropped += [face_id for face_id, _ in faces[:-FACE_MAX_SAMPLES]]
+        samples[user_id] = faces[-FACE_MAX_SAMPLES:]
+    if dropped:
+        db.execute(delete(models.Face).where(models.Face.id.in_(dropped)))
+
+    templates = {t.user_id: t for t in
+                 db.query(models.FaceTemplate).filter(models.FaceTemplate.user_id.in_(user_ids))}
+    rows = []
+    for user in users.values():
+        vectors = [v for v in (to_vector(e) for _, e in samples.get(user.id, [])) if v is not None]
+        if not vectors:
+            continue
+        centroid, spread = aggregate(np.stack(vectors))
+        template = templates.get(user.id)
+        if template is None:
+            template = models.FaceTemplate(user_id=user.id)
+            db.add(template)
+        template.centroid = centroid
+        template.spread = spread
+        template.samples = len(vectors)
+        rows.append((user.id, user.name, user.active, vectors))
+    db.commit()
+    return rows
+
+
+def enroll(db: Session, photos: Iterable[Photo], skipped: Optional[List[dict]] = None, replace: bool = False,
+           commit_size: int = ENROLL_COMMIT_SIZE, **encode_options) -> dict:
+    """Encode and store photos; returns a report of what was enrolled and
+    which files were skipped and why.
+
+    replace drops the samples a user had before this import.
+    """
+    skipped = [] if skipped is None else skipped
+    report = {"users_created": 0, "users_updated": 0, "faces_added": 0, "skipped": skipped}
+    gallery_rows = []
+    versions = []
+    batch: Dict[str, List[np.ndarray]] = {}
+    stored = set()
+
+    def flush():
+        # A name met again in a later batch keeps what this import added
+        rows = _store(db, batch, [name for name in batch if replace and name not in stored], report)
+        stored.update(batch)
+        versions.append(written_versions(db))
+        return rows
+
+    started = time.monotonic()
+    try:
+        for name, encoding in encode_photos(photos, skipped, **encode_options):
+            if name not in batch and len(batch) >= commit_size:
+                gallery_rows += flush()
+                batch = {}
+            batch.setdefault(name, []).append(encoding)
+        if batch:
+            gallery_rows += flush()
+    finally:
+        # Batches committed before a failure are in the database, so the
+        # gallery gets them too; a user stored twice keeps the last row.
+        # The version span only counts if no other writer got in between.
+        chained = all(a is not None and b is not None and a[1] == b[0] for a, b in zip(versions, versions[1:]))
+        span = (versions[0][0], versions[-1][1]) if versions and versions[0] and chained else None
+        gallery.upsert_many(gallery_rows, span)
+        gallery.flush()
+    print(f"[INFO] Enrolled {report['faces_added']} faces for {len(stored)} users "
+          f"in {time.monotonic() - started:.1f}s, skipped {len(skipped)} files")
+    return report
+
+
+if __name__ == "__main__":
+    from .database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Enroll users from a directory of name/*.jpg photos")
+    parser.add_argument("directory")
+    parser.add_argument("--replace", action="store_true", help="discard samples users already have")
+    args = parser.parse_args()
+    recognition_pool.start()
+    session = SessionLocal()
+    try:
+        # Start from the current gallery so the snapshot written at the end is complete
+        gallery.load(session)
+        skipped_files = []
+        result = enroll(session, directory_photos(args.directory, skipped_files), skipped_files,
+                        replace=args.replace)
+    finally:
+        session.close()
+        recognition_pool.shutdown()
+    for item in result["skipped"]:
+        print(f"[WARNING] Skipped {item['file']}: {item['reason']}")
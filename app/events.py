@@ -0,0 +1,161 @@
+import asyncio
+import os
+import threading
+from collections import deque
+from typing import Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import models
+from .gallery import gallery
+
+# Recent events kept in memory so reconnecting clients can resume
+LOG_STREAM_REPLAY = int(os.getenv("LOG_STREAM_REPLAY", "500"))
+# Events buffered per client before a slow client is disconnected
+LOG_STREAM_QUEUE = int(os.getenv("LOG_STREAM_QUEUE", "256"))
+# Seconds between keep-alives on an idle stream
+LOG_STREAM_HEARTBEAT = float(os.getenv("LOG_STREAM_HEARTBEAT", "15"))
+
+
+def log_event(log: models.AccessLog, user_name: Optional[str] = None) -> dict:
+    """JSON-ready event with the same fields as schemas.LogOut"""
+    if user_name is None and log.user_id is not None:
+        user_name = gallery.name_of(log.user_id)
+    return {
+        "id": log.id,
+        "user_id": log.user_id,
+        "user_name": user_name,
+        "status": log.status,
+        "timestamp": log.timestamp.isoformat() if log.timestamp else None,
+        "face_image_url": log.face_image_url,
+    }
+
+
+class Subscription:
+    """One streaming client; lives on the event loop that created it"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, statuses: Optional[Set[str]], queue_size: int):
+        self.loop = loop
+        self.statuses = statuses
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.overflowed = False
+        # Highest id sent during the replay; live events up to it are duplicates
+        self.replayed_through = 0
+
+    def wants(self, event: dict) -> bool:
+        return not self.statuses or event["status"] in self.statuses
+
+    def _offer(self, event: dict):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # The client resumes from its last id after reconnecting
+            self.overflowed = True
+            self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+    async def next(self, timeout: float) -> Optional[dict]:
+        """Next event, {} on timeout, None once the subscription is closed"""
+        while True:
+            try:
+                event = await asyncio.wait_for(self.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                return {}
+            if event is None:
+                return None
+            if event["id"] <= self.replayed_through:
+                continue  # already sent during the replay
+            # Later events may arrive out of id order (a direct write can
+            # commit a lower id after a batch): pass them all on
+            return event
+
+
+class LogBus:
+    """In-process publish/subscribe for new access logs.
+
+    Publishers are any thread that writes logs; subscribers are SSE and
+    WebSocket handlers, each fed through an asyncio queue on its own loop.
+    """
+
+    def __init__(self, replay: int = LOG_STREAM_REPLAY, queue_size: int = LOG_STREAM_QUEUE):
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=replay)
+        self._subscribers: Set[Subscription] = set()
+        self.queue_size = queue_size
+        self.published = 0
+
+    def publish(self, logs: Iterable[models.AccessLog]):
+        events = [log_event(log) for log in logs]
+        if not events:
+            return
+        with self._lock:
+            self._recent.extend(events)
+            self.published += len(events)
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            for event in events:
+                if sub.wants(event):
+                    try:
+                        sub.loop.call_soon_threadsafe(sub._offer, event)
+                    except RuntimeError:
+                        # Loop already closed; the handler's finally unsubscribes
+                        pass
+
+    def subscribe(self, statuses: Optional[Iterable[str]] = None) -> Subscription:
+        sub = Subscription(asyncio.get_running_loop(), set(statuses) if statuses else None, self.queue_size)
+        with self._lock:
+            self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def clear(self):
+        """Forget the recent events, e.g. after the log table was emptied"""
+        with self._lock:
+            self._recent.clear()
+
+    def replay(self, sub: Subscription, after_id: int, db_factory) -> Tuple[List[dict], Optional[int]]:
+        """One page of events after after_id for a resuming client, oldest first.
+
+        Served from memory when the buffer reaches back far enough,
+        otherwise the gap is read from the database a page at a time.
+        Returns the events and the id to ask for the next page after, or
+        None once the client has caught up with the buffer.
+        """
+        with self._lock:
+            recent = list(self._recent)
+        events = []
+        last = after_id
+        if not recent or recent[0]["id"] > after_id + 1:
+            db: Session = db_factory()
+            try:
+                query = (
+                    db.query(models.AccessLog, models.User.name)
+                    .outerjoin(models.User, models.User.id == models.AccessLog.user_id)
+                    .filter(models.AccessLog.id > after_id)
+                )
+                if sub.statuses:
+                    query = query.filter(models.AccessLog.status.in_(sub.statuses))
+                rows = query.order_by(models.AccessLog.id).limit(LOG_STREAM_REPLAY).all()
+                events = [log_event(log, user_name) for log, user_name in rows]
+            finally:
+                db.close()
+            if events:
+                last = events[-1]["id"]
+            if len(rows) == LOG_STREAM_REPLAY and (not recent or last + 1 < recent[0]["id"]):
+                sub.replayed_through = last
+                return events, last
+        events += [event for event in recent if event["id"] > last and sub.wants(event)]
+        sub.replayed_through = max([after_id] + [event["id"] for event in events])
+        return events, None
+
+    def stats(self):
+        with self._lock:
+            return {"subscribers": len(self._subscribers), "published": self.published}
+
+
+log_bus = LogBus()
@@ -0,0 +1,562 @@
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from itertools import chain
+from typing import List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import event, insert, select, update
+from sqlalchemy.orm import Session
+
+from . import models
+from .encoding import unpack
+from .matching import Matcher, build_matcher
+
+try:
+    import fcntl
+except ImportError:  # Windows: changes from several processes may race
+    fcntl = None
+
+MATCH_THRESHOLD = float(os.getenv("FACE_MATCH_THRESHOLD", "0.4"))
+# Nearest user centroids considered per probe
+MATCH_CANDIDATES = int(os.getenv("FACE_MATCH_CANDIDATES", "3"))
+ENCODING_DIM = 128
+# Shared gallery files, memory-mapped by every process; empty disables them
+GALLERY_SNAPSHOT_DIR = os.getenv(
+    "GALLERY_SNAPSHOT_DIR", os.path.abspath(os.path.join(os.path.dirname(__file__), "../gallery_snapshot")))
+# Seconds changes are gathered before the snapshot is rewritten; 0 writes every change
+GALLERY_SNAPSHOT_SECONDS = float(os.getenv("GALLERY_SNAPSHOT_SECONDS", "1"))
+CURRENT = "CURRENT"
+
+
+class Match(NamedTuple):
+    user_id: int
+    name: str
+    active: bool
+    distance: float
+
+
+class _Snapshot(NamedTuple):
+    matcher: Matcher        # search index over the (U, 128) float32 user centroids
+    user_ids: np.ndarray    # (U,) int64
+    names: np.ndarray       # (U,) object
+    active: np.ndarray      # (U,) bool
+    spreads: np.ndarray     # (U,) float32, farthest sample from the centroid
+    samples: np.ndarray     # (S, 128) float32, grouped by user
+    offsets: np.ndarray     # (U + 1,) user i's samples are samples[offsets[i]:offsets[i + 1]]
+    db_version: Optional[int] = None  # gallery_state.version it matches; None if unknown
+
+
+# Database version
+#
+# Every transaction that changes the gallery's tables bumps gallery_state's
+# version once. A snapshot records the version it matches, so load() can
+# tell whether a name, active flag or sample changed since it was written.
+
+# A user without faces is not in the gallery, so creating one is no change
+_GALLERY_MODELS = (models.User, models.Face, models.FaceTemplate)
+_CHANGED_BY_INSERT = (models.Face, models.FaceTemplate)
+
+
+def stored_version(db: Session) -> int:
+    """The database's gallery version; 0 until the first write creates the row"""
+    return db.execute(select(models.GalleryState.version).where(models.GalleryState.id == 1)).scalar() or 0
+
+
+def written_versions(db: Session) -> Optional[Tuple[int, int]]:
+    """(before, after) gallery versions of the last transaction on db that
+    changed the gallery, for the Gallery methods applying that change"""
+    version = db.info.get("gallery_version")
+    return (version - 1, version) if version is not None else None
+
+
+def _bump(session: Session):
+    transaction = session.get_transaction()
+    if session.info.get("gallery_transaction") is transaction:
+        return
+    conn = session.connection()
+    table = models.GalleryState.__table__
+    version = conn.execute(
+        update(table).where(table.c.id == 1).values(version=table.c.version + 1).returning(table.c.version)
+    ).scalar()
+    if version is None:
+        version = 1
+        conn.execute(insert(table).values(id=1, version=version))
+    session.info["gallery_transaction"] = transaction
+    session.info["gallery_version"] = version
+
+
+@event.listens_for(Session, "after_flush")
+def _bump_after_flush(session, flush_context):
+    if (any(isinstance(obj, _CHANGED_BY_INSERT) for obj in session.new)
+            or any(isinstance(obj, _GALLERY_MODELS) for obj in chain(session.dirty, session.deleted))):
+        _bump(session)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _bump_on_bulk_write(state):
+    if ((state.is_update or state.is_delete) and state.bind_mapper is not None
+            and state.bind_mapper.class_ in _GALLERY_MODELS):
+        _bump(state.session)
+
+
+def aggregate(samples: np.ndarray) -> Tuple[np.ndarray, float]:
+    """Centroid of a user's (n, 128) samples and the largest distance of a
+    sample from it"""
+    samples = np.asarray(samples, dtype=np.float32).reshape(-1, ENCODING_DIM)
+    centroid = samples.mean(axis=0)
+    return centroid, float(np.linalg.norm(samples - centroid, axis=1).max())
+
+
+def _empty_snapshot() -> _Snapshot:
+    return _Snapshot(
+        matcher=build_matcher(np.empty((0, ENCODING_DIM), dtype=np.float32)),
+        user_ids=np.empty(0, dtype=np.int64),
+        names=np.empty(0, dtype=object),
+        active=np.empty(0, dtype=bool),
+        spreads=np.empty(0, dtype=np.float32),
+        samples=np.empty((0, ENCODING_DIM), dtype=np.float32),
+        offsets=np.zeros(1, dtype=np.int64),
+    )
+
+
+def _build_snapshot(rows, previous: Optional[_Snapshot] = None) -> _Snapshot:
+    """rows: iterable of (user_id, name, active, (n, 128) float32 samples,
+    centroid, spread)"""
+    rows = list(rows)
+    if not rows:
+        return _empty_snapshot()
+    centroids = np.ascontiguousarray(np.stack([r[4] for r in rows]), dtype=np.float32)
+    offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(r[3]) for r in rows])
+    return _Snapshot(
+        matcher=build_matcher(centroids, previous.matcher if previous else None),
+        user_ids=np.array([r[0] for r in rows], dtype=np.int64),
+        names=np.array([r[1] for r in rows], dtype=object),
+        active=np.array([bool(r[2]) for r in rows], dtype=bool),
+        spreads=np.array([r[5] for r in rows], dtype=np.float32),
+        samples=np.ascontiguousarray(np.concatenate([r[3] for r in rows]), dtype=np.float32),
+        offsets=offsets,
+    )
+
+
+def _snapshot_files(directory: str, generation: int) -> Tuple[str, str, str]:
+    base = os.path.join(directory, f"gallery-{generation}")
+    return base + ".centroids.npy", base + ".samples.npy", base + ".json"
+
+
+def current_generation(directory: str) -> Optional[int]:
+    try:
+        with open(os.path.join(directory, CURRENT)) as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def write_snapshot(snapshot: _Snapshot, directory: str) -> int:
+    """Write the snapshot as a new generation and point CURRENT at it.
+
+    Files of a generation are never modified, so readers that mapped an
+    older one keep a consistent view; all but the previous generation are
+    removed.
+    """
+    os.makedirs(directory, exist_ok=True)
+    previous = current_generation(directory)
+    generation = max(time.time_ns(), (previous or 0) + 1)
+    centroids_path, samples_path, sidecar_path = _snapshot_files(directory, generation)
+    np.save(centroids_path, np.ascontiguousarray(snapshot.matcher.encodings, dtype=np.float32))
+    np.save(samples_path, np.ascontiguousarray(snapshot.samples, dtype=np.float32))
+    with open(sidecar_path, "w") as f:
+        json.dump({
+            "generation": generation,
+            "user_ids": snapshot.user_ids.tolist(),
+            "names": snapshot.names.tolist(),
+            "active": snapshot.active.tolist(),
+            "spreads": snapshot.spreads.tolist(),
+            "offsets": snapshot.offsets.tolist(),
+            "db_version": snapshot.db_version,
+        }, f)
+    pointer = os.path.join(directory, CURRENT)
+    with open(pointer + ".tmp", "w") as f:
+        f.write(str(generation))
+    os.replace(pointer + ".tmp", pointer)
+
+    keep = {str(generation), str(previous)}
+    for path in glob.glob(os.path.join(directory, "gallery-*")):
+        if os.path.basename(path).split(".")[0][len("gallery-"):] not in keep:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    return generation
+
+
+def read_snapshot(directory: str, previous: Optional[_Snapshot] = None) -> Optional[Tuple[int, _Snapshot]]:
+    """(generation, snapshot) of the current files, with the encodings
+    memory-mapped rather than read; None if there is no usable snapshot"""
+    generation = current_generation(directory)
+    if generation is None:
+        return None
+    centroids_path, samples_path, sidecar_path = _snapshot_files(directory, generation)
+    try:
+        with open(sidecar_path) as f:
+            meta = json.load(f)
+        centroids = np.load(centroids_path, mmap_mode="r")
+        samples = np.load(samples_path, mmap_mode="r")
+    except (OSError, ValueError) as e:
+        print(f"[WARNING] Ignoring gallery snapshot {generation}: {e}")
+        return None
+    if not len(meta["user_ids"]):
+        return generation, _empty_snapshot()._replace(db_version=meta.get("db_version"))
+    return generation, _Snapshot(
+        matcher=build_matcher(centroids, previous.matcher if previous else None),
+        user_ids=np.array(meta["user_ids"], dtype=np.int64),
+        names=np.array(meta["names"], dtype=object),
+        active=np.array(meta["active"], dtype=bool),
+        spreads=np.array(meta["spreads"], dtype=np.float32),
+        samples=samples,
+        offsets=np.array(meta["offsets"], dtype=np.int64),
+        db_version=meta.get("db_version"),
+    )
+
+
+def to_vector(encoding_data) -> Optional[np.ndarray]:
+    """Coerce a stored or computed encoding into a float32 vector"""
+    try:
+        if isinstance(encoding_data, (str, bytes)):
+            vector = unpack(encoding_data)
+        else:
+            vector = np.asarray(encoding_data)
+        vector = vector.astype(np.float32).ravel()
+    except Exception as e:
+        print(f"[ERROR] Failed to decode encoding: {e}")
+        return None
+    if vector.shape[0] != ENCODING_DIM:
+        print(f"[WARNING] Ignoring encoding with {vector.shape[0]} dimensions")
+        return None
+    return vector
+
+
+def _as_samples(encodings) -> list:
+    """One encoding or a sequence of them, as a list"""
+    if isinstance(encodings, (list, tuple)):
+        return list(encodings)
+    if isinstance(encodings, (str, bytes)) or np.ndim(encodings) == 1:
+        return [encodings]
+    return list(encodings)
+
+
+def _user_row(user_id: int, name: str, active: bool, vectors: List[np.ndarray], centroid=None, spread=None):
+    samples = np.stack(vectors)
+    if centroid is None:
+        centroid, spread = aggregate(samples)
+    return user_id, name, active, samples, centroid, spread
+
+
+class Gallery:
+    """Process-wide set of enrolled users, one centroid each plus their
+    individual samples.
+
+    Readers grab the current snapshot without locking; writers build a new
+    snapshot and swap it in, so a match never sees a half-updated gallery.
+
+    With a snapshot directory, changes are also written there as a new
+    generation, at most once every snapshot_seconds. Other processes (API
+    workers, face_rec.py) map those files instead of querying the database
+    and pick up newer generations in ensure_loaded.
+    """
+
+    def __init__(self, snapshot_dir: Optional[str] = GALLERY_SNAPSHOT_DIR,
+                 snapshot_seconds: float = GALLERY_SNAPSHOT_SECONDS):
+        self._lock = threading.Lock()
+        self._snapshot = _empty_snapshot()
+        self.loaded = False
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_seconds = snapshot_seconds
+        self.generation = None
+        self._pointer_stat = None
+        self._dirty = False
+        self._timer = None
+        self._lock_file = None
+
+    def _swap(self, snapshot: _Snapshot):
+        """Install a locally built snapshot; call with the lock held.
+
+        The snapshot files are rewritten by a timer, so a burst of changes
+        costs one write instead of one each.
+        """
+        self._snapshot = snapshot
+        if not self.snapshot_dir:
+            return
+        self._dirty = True
+        if self.snapshot_seconds <= 0:
+            self._write_locked()
+        elif self._timer is None:
+            self._timer = threading.Timer(self.snapshot_seconds, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _write_locked(self):
+        """Write pending changes and release the file lock; call with the lock held"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._dirty:
+            self._dirty = False
+            try:
+                self.generation = write_snapshot(self._snapshot, self.snapshot_dir)
+            except OSError as e:
+                print(f"[ERROR] Failed to write gallery snapshot: {e}")
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def flush(self):
+        """Write pending changes to the snapshot directory now"""
+        with self._lock:
+            self._write_locked()
+
+    def __len__(self):
+        return len(self._snapshot.user_ids)
+
+    @property
+    def sample_count(self) -> int:
+        return len(self._snapshot.samples)
+
+    @staticmethod
+    def _next_version(current: _Snapshot, versions: Optional[Tuple[int, int]]) -> Optional[int]:
+        """Version a snapshot matches after applying the database writes that
+        took the gallery from versions[0] to versions[1]: known only if the
+        current snapshot matched versions[0]"""
+        if versions is None or current.db_version is None or current.db_version != versions[0]:
+            return None
+        return versions[1]
+
+    def _pointer(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(os.path.join(self.snapshot_dir, CURRENT))
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _refresh_locked(self, force: bool = False) -> bool:
+        pointer = self._pointer()
+        if pointer is None or (pointer == self._pointer_stat and not force):
+            return False
+        self._pointer_stat = pointer
+        if current_generation(self.snapshot_dir) == self.generation and not force:
+            return False
+        found = read_snapshot(self.snapshot_dir, self._snapshot)
+        if found is None:
+            return False
+        self.generation, self._snapshot = found
+        self.loaded = True
+        return True
+
+    @contextmanager
+    def _changing(self):
+        """Hold the lock, plus the file lock shared with other processes
+        when there is a snapshot directory, on top of the newest generation.
+
+        The file lock is kept until pending changes are written, so no other
+        process changes the gallery from a generation that misses them.
+        """
+        with self._lock:
+            if self.snapshot_dir and not self._dirty:
+                os.makedirs(self.snapshot_dir, exist_ok=True)
+                if fcntl is not None:
+                    self._lock_file = open(os.path.join(self.snapshot_dir, "LOCK"), "a")
+                    fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+                if self.loaded:
+                    self._refresh_locked()
+            try:
+                yield
+            finally:
+                if not self._dirty:
+                    self._write_locked()
+
+    def load(self, db: Session):
+        """Map the snapshot files if they match the database's gallery
+        version, otherwise (re)build the gallery from every user that has a
+        face enrolled"""
+        mapped = False
+        if self.snapshot_dir:
+            with self._lock:
+                self._write_locked()
+                mapped = self._refresh_locked(force=True)
+        # Read before the rows: a write landing in between makes the
+        # rebuilt snapshot look older than it is, never newer
+        version = stored_version(db)
+        if mapped:
+            snapshot = self._snapshot
+            if snapshot.db_version is not None and snapshot.db_version == version:
+                print(f"[INFO] Gallery mapped from snapshot {self.generation} with {len(snapshot.user_ids)} users "
+                      f"({len(snapshot.samples)} encodings)")
+                return
+            print("[INFO] Gallery snapshot is out of date, rebuilding from the database")
+        templates = {
+            user_id: (to_vector(centroid), spread, count)
+            for user_id, centroid, spread, count in db.query(
+                models.FaceTemplate.user_id, models.FaceTemplate.centroid,
+                models.FaceTemplate.spread, models.FaceTemplate.samples)
+        }
+        query = (
+            db.query(models.User.id, models.User.name, models.User.active, models.Face.encoding)
+            .join(models.Face, models.Face.user_id == models.User.id)
+            .order_by(models.User.id, models.Face.id)
+        )
+        users = {}
+        for user_id, name, active, encoding in query.yield_per(1000):
+            vector = to_vector(encoding)
+            if vector is not None:
+                users.setdefault(user_id, (name, active, []))[2].append(vector)
+        rows = []
+        for user_id, (name, active, vectors) in users.items():
+            centroid, spread, count = templates.get(user_id, (None, None, 0))
+            # The stored template is only trusted if it covers exactly these samples
+            if centroid is None or count != len(vectors):
+                centroid = spread = None
+            rows.append(_user_row(user_id, name, active, vectors, centroid, spread))
+        snapshot = _build_snapshot(rows)._replace(db_version=version)
+        with self._changing():
+            self._swap(snapshot)
+            self.loaded = True
+            # A full rebuild is written at once, for the other processes starting up
+            self._write_locked()
+        print(f"[INFO] Gallery loaded with {len(rows)} users ({len(snapshot.samples)} encodings)")
+
+    def ensure_loaded(self, db: Session):
+        if not self.loaded:
+            self.load(db)
+        else:
+            self.refresh()
+
+    def refresh(self) -> bool:
+        """Switch to a newer snapshot written by another process; one stat()
+        when nothing changed"""
+        if not self.snapshot_dir or self._pointer() == self._pointer_stat:
+            return False
+        with self._lock:
+            return self._refresh_locked()
+
+    def _rows(self, snapshot: _Snapshot, exclude_user_id: Optional[int] = None):
+        centroids = snapshot.matcher.encodings
+        for i in range(len(snapshot.user_ids)):
+            if snapshot.user_ids[i] != exclude_user_id:
+                yield (int(snapshot.user_ids[i]), snapshot.names[i], bool(snapshot.active[i]),
+                       snapshot.samples[snapshot.offsets[i]:snapshot.offsets[i + 1]],
+                       centroids[i], float(snapshot.spreads[i]))
+
+    def upsert(self, user_id: int, name: str, active: bool, encodings,
+               versions: Optional[Tuple[int, int]] = None):
+        """Set a user's samples (one encoding or several), replacing any
+        they had before. versions is written_versions() of the transaction
+        that stored them, if the caller has it."""
+        self.upsert_many([(user_id, name, active, encodings)], versions)
+
+    def upsert_many(self, users, versions: Optional[Tuple[int, int]] = None):
+        """upsert for several (user_id, name, active, encodings) at once,
+        rebuilding the snapshot a single time"""
+        rows = {}
+        for user_id, name, active, encodings in users:
+            vectors = [v for v in (to_vector(e) for e in _as_samples(encodings)) if v is not None]
+            rows[user_id] = _user_row(user_id, name, active, vectors) if vectors else None
+        if not rows:
+            return
+        with self._changing():
+            current = self._snapshot
+            kept = [row for row in self._rows(current) if row[0] not in rows]
+            snapshot = _build_snapshot(kept + [row for row in rows.values() if row is not None], previous=current)
+            self._swap(snapshot._replace(db_version=self._next_version(current, versions)))
+
+    def update_user(self, user_id: int, name: str, active: bool, versions: Optional[Tuple[int, int]] = None):
+        with self._changing():
+            current = self._snapshot
+            mask = current.user_ids == user_id
+            names = current.names.copy()
+            flags = current.active.copy()
+            names[mask] = name
+            flags[mask] = bool(active)
+            # Written even for a user without faces, to carry the version forward
+            self._swap(current._replace(names=names, active=flags,
+                                        db_version=self._next_version(current, versions)))
+
+    def remove(self, user_id: int, versions: Optional[Tuple[int, int]] = None):
+        with self._changing():
+            current = self._snapshot
+            snapshot = current
+            if (current.user_ids == user_id).any():
+                snapshot = _build_snapshot(self._rows(current, exclude_user_id=user_id), previous=current)
+            self._swap(snapshot._replace(db_version=self._next_version(current, versions)))
+
+    def name_of(self, user_id: int) -> Optional[str]:
+        """Name of an enrolled user, None if the user has no face in the gallery"""
+        snapshot = self._snapshot
+        found = np.flatnonzero(snapshot.user_ids == user_id)
+        return snapshot.names[found[0]] if len(found) else None
+
+    def match(self, encoding, threshold: float = MATCH_THRESHOLD) -> Optional[Match]:
+        """Return the closest enrolled user if within threshold, else None"""
+        return self.match_many([encoding], threshold)[0]
+
+    def match_many(self, encodings, threshold: float = MATCH_THRESHOLD) -> List[Optional[Match]]:
+        """Match several probes against the gallery in one search.
+
+        Probes are compared with each user's centroid. By the triangle
+        inequality every sample of a user lies within centroid distance
+        +/- spread, so a user is accepted or ruled out from the centroid
+        alone unless that interval straddles the threshold; only then are
+        the user's individual samples scanned.
+        """
+        snapshot = self._snapshot
+        if not len(snapshot.user_ids):
+            return [None] * len(encodings)
+        probes = np.asarray(encodings, dtype=np.float32).reshape(len(encodings), -1)
+        indices, distances = snapshot.matcher.search(probes, k=min(MATCH_CANDIDATES, len(snapshot.user_ids)))
+        matches = []
+        for probe, candidates, centroid_distances in zip(probes, indices, distances):
+            best, best_distance = -1, threshold
+            for i, distance in zip(candidates, centroid_distances):
+                if i < 0:
+                    continue
+                spread = snapshot.spreads[i]
+                if distance - spread >= best_distance:
+                    continue  # no sample of this user can do better
+                if distance + spread >= threshold:
+                    samples = snapshot.samples[snapshot.offsets[i]:snapshot.offsets[i + 1]]
+                    distance = float(np.sqrt(((samples - probe) ** 2).sum(axis=1).min()))
+                if distance < best_distance:
+                    best, best_distance = i, distance
+            if best < 0:
+                matches.append(None)
+                continue
+            matches.append(Match(
+                user_id=int(snapshot.user_ids[best]),
+                name=snapshot.names[best],
+                active=bool(snapshot.active[best]),
+                distance=float(best_distance),
+            ))
+        return matches
+
+
+gallery = Gallery()
+# Changes still waiting for the timer are written before the process exits
+atexit.register(gallery.flush)
+
+
+if __name__ == "__main__":
+    from .database import SessionLocal
+
+    # Rebuild the snapshot from the database, e.g. after editing faces by hand
+    session = SessionLocal()
+    try:
+        gallery.snapshot_dir = None
+        gallery.load(session)
+        generation = write_snapshot(gallery._snapshot, GALLERY_SNAPSHOT_DIR)
+        print(f"[INFO] Wrote gallery snapshot {generation} to {GALLERY_SNAPSHOT_DIR}")
+    finally:
+        session.close()
@@ -0,0 +1,460 @@
+import asyncio
+import base64
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from datetime import datetime
+from typing import List, NamedTuple, Optional
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import insert
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.orm import Session
+
+from . import crud, models, rollup
+from .database import SessionLocal, engine as default_engine
+from .encoding import pack, unpack
+from .events import log_bus
+
+# Write logs from a background thread instead of inside the request
+LOG_WRITE_BEHIND = os.getenv("LOG_WRITE_BEHIND", "1") == "1"
+# Rows per INSERT transaction
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "200"))
+# Longest a log waits in memory before it is written
+LOG_FLUSH_SECONDS = float(os.getenv("LOG_FLUSH_SECONDS", "0.5"))
+# Logs held in memory before the overflow policy applies
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# block: wait for room, drop_oldest / drop_newest: discard and count
+LOG_OVERFLOW = os.getenv("LOG_OVERFLOW", "block")
+# Longest a caller blocks under the "block" policy before falling back to a direct write
+LOG_BLOCK_SECONDS = float(os.getenv("LOG_BLOCK_SECONDS", "5"))
+# Longest a request waits for its logs to be committed (and get their ids)
+LOG_WAIT_SECONDS = float(os.getenv("LOG_WAIT_SECONDS", "5"))
+# Upper bound for the delay between attempts to write a failed batch
+LOG_RETRY_MAX_SECONDS = float(os.getenv("LOG_RETRY_MAX_SECONDS", "30"))
+# Logs still unwritten at shutdown are appended here and written on the next start;
+# rows the database refuses outright go to the same path plus ".rejected"
+LOG_SPILL_PATH = os.getenv(
+    "LOG_SPILL_PATH", os.path.abspath(os.path.join(os.path.dirname(__file__), "../log_spill.ndjson")))
+
+OVERFLOW_POLICIES = ("block", "drop_oldest", "drop_newest")
+
+
+class LogNotWritten(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=503,
+            detail="Access log could not be written yet, retry shortly",
+            headers={"Retry-After": "1"},
+        )
+
+
+class _Pending(NamedTuple):
+    logs: List[models.AccessLog]
+    future: Future  # resolves to logs once committed
+    wait: bool      # a caller is blocked on future
+
+
+def _to_record(log: models.AccessLog) -> dict:
+    return {
+        "user_id": log.user_id,
+        "status": log.status,
+        "timestamp": log.timestamp.isoformat(),
+        "face_image_url": log.face_image_url,
+        "face_encoding": base64.b64encode(pack(log.face_encoding)).decode()
+        if log.face_encoding is not None else None,
+    }
+
+
+def _from_record(record: dict) -> models.AccessLog:
+    encoding = record.get("face_encoding")
+    return models.AccessLog(
+        user_id=record["user_id"],
+        status=record["status"],
+        timestamp=datetime.fromisoformat(record["timestamp"]),
+        face_image_url=record.get("face_image_url"),
+        face_encoding=unpack(base64.b64decode(encoding)) if encoding else None,
+    )
+
+
+class LogWriter:
+    """Write-behind queue for access logs.
+
+    Timestamps are set when a log is submitted and a single thread inserts
+    queued rows in batched transactions. Ids come from the database: they
+    are filled in on the returned AccessLog objects when their batch
+    commits, and only then are the logs published to live streams. Callers
+    that need the ids wait for that commit (concurrent callers share one
+    transaction); the others return at once.
+
+    A batch that fails is retried with backoff; whatever is still unwritten
+    when the writer stops is spilled to disk and written on the next start.
+    When the writer is not running, logs are written synchronously.
+    """
+
+    def __init__(self, engine=default_engine, batch_size: int = LOG_BATCH_SIZE,
+                 flush_seconds: float = LOG_FLUSH_SECONDS, queue_size: int = LOG_QUEUE_SIZE,
+                 overflow: str = LOG_OVERFLOW, spill_path: str = LOG_SPILL_PATH):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"LOG_OVERFLOW must be one of {', '.join(OVERFLOW_POLICIES)}")
+        self.engine = engine
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.spill_path = spill_path
+        self._queue = deque()  # of _Pending
+        self._queued = 0       # logs in _queue
+        self._waiting = 0      # submissions in _queue whose caller waits for the commit
+        self._cond = threading.Condition()
+        self._spill_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._in_flight = 0
+        self._flush_requested = False
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.retries = 0
+        self.spilled = 0
+        self.rejected = 0
+        self.last_error = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._cond:
+            if self.running:
+                return
+            self._stop.clear()
+            self._queue_spilled()
+            self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+            self._thread.start()
+        print(f"[INFO] Log writer started (batch {self.batch_size}, every {self.flush_seconds}s, "
+              f"overflow {self.overflow})")
+
+    def stop(self):
+        """Flush everything queued, then stop the thread"""
+        thread = self._thread
+        if thread is None:
+            return
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        thread.join()
+        self._thread = None
+        print(f"[INFO] Log writer stopped after writing {self.written} logs")
+
+    def log(self, db: Optional[Session] = None, wait: bool = False, **entry) -> models.AccessLog:
+        return self.log_many([entry], db, wait)[0]
+
+    def log_many(self, entries: List[dict], db: Optional[Session] = None, wait: bool = False) -> List[models.AccessLog]:
+        """Queue logs and return them with their timestamps set.
+
+        Their ids are filled in once written; with wait, this blocks until
+        then (raising LogNotWritten after LOG_WAIT_SECONDS). Falls back to
+        writing through `db` (or a new session) when the writer is not
+        running.
+        """
+        if not self.running:
+            return self._write_now(entries, db)
+        logs, future = self._submit(entries, wait)
+        if wait:
+            try:
+                future.result(timeout=LOG_WAIT_SECONDS)
+            except FutureTimeout:
+                raise LogNotWritten()
+        return logs
+
+    async def log_async(self, db: Optional[Session] = None, **entry) -> models.AccessLog:
+        return (await self.log_many_async([entry], db))[0]
+
+    async def log_many_async(self, entries: List[dict], db: Optional[Session] = None) -> List[models.AccessLog]:
+        """log_many(wait=True) for coroutines: waits for the commit without
+        blocking the event loop"""
+        if not self.running:
+            return await run_in_threadpool(self._write_now, entries, db)
+        # Queue on the loop when there is room; waiting for room (or writing
+        # directly once that times out) happens on the threadpool
+        submitted = self._submit(entries, wait=True, block=False)
+        if submitted is None:
+            submitted = await run_in_threadpool(self._submit, entries, True)
+        logs, future = submitted
+        try:
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), LOG_WAIT_SECONDS)
+        except asyncio.TimeoutError:
+            raise LogNotWritten()
+        return logs
+
+    def _write_now(self, entries: List[dict], db: Optional[Session]) -> List[models.AccessLog]:
+        session = db if db is not None else SessionLocal()
+        try:
+            return crud.log_access_many(session, entries)
+        finally:
+            if db is None:
+                session.close()
+
+    def _submit(self, entries: List[dict], wait: bool, block: bool = True):
+        """Apply the overflow policy to new logs; without block, returns None
+        instead of waiting when the "block" policy would have to wait"""
+        now = datetime.utcnow()
+        pending = _Pending([models.AccessLog(timestamp=now, **entry) for entry in entries], Future(), wait)
+        with self._cond:
+            action = self._make_room(len(pending.logs), block)
+            if action == "full":
+                return None
+            if action == "queue":
+                self._enqueue(pending)
+        if action == "direct":
+            self._write([pending])
+        elif action == "drop":
+            pending.future.set_exception(LogNotWritten())
+        return pending.logs, pending.future
+
+    def _enqueue(self, pending: _Pending):
+        """Call with the lock held"""
+        self._queue.append(pending)
+        self._queued += len(pending.logs)
+        self._waiting += pending.wait
+        # A waiting caller is written at once (with whatever else is queued)
+        if pending.wait or self._queued >= self.batch_size:
+            self._cond.notify_all()
+
+    def _make_room(self, count: int, block: bool = True) -> str:
+        """Apply the overflow policy; called with the lock held.
+
+        Returns "queue", "drop" (callers still get their logs back, never
+        written), "direct" when a blocked caller timed out and writes its
+        own logs, or "full" when it would have to wait and block is False.
+        """
+        if self._queued + count <= self.queue_size:
+            return "queue"
+        if self.overflow == "drop_oldest":
+            while self._queue and self._queued + count > self.queue_size:
+                oldest = self._queue.popleft()
+                self._queued -= len(oldest.logs)
+                self._waiting -= oldest.wait
+                self.dropped += len(oldest.logs)
+                oldest.future.set_exception(LogNotWritten())
+            print(f"[WARNING] Log queue full, dropped oldest logs ({self.dropped} so far)")
+            return "queue"
+        if self.overflow == "drop_newest":
+            self.dropped += count
+            print(f"[WARNING] Log queue full, dropped {count} new logs ({self.dropped} so far)")
+            return "drop"
+        self._cond.notify_all()
+        if not block:
+            return "full"
+        if self._cond.wait_for(lambda: self._queued + count <= self.queue_size, timeout=LOG_BLOCK_SECONDS):
+            return "queue"
+        print("[WARNING] Log queue still full, writing directly")
+        return "direct"
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until everything queued so far has been written"""
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: (not self._queue and not self._in_flight) or not self.running,
+                                       timeout=timeout)
+
+    def pending(self) -> int:
+        with self._cond:
+            return self._queued + self._in_flight
+
+    def stats(self):
+        return {
+            "running": self.running,
+            "pending": self.pending(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "retries": self.retries,
+            "spilled": self.spilled,
+            "rejected": self.rejected,
+            "overflow": self.overflow,
+            "last_error": self.last_error,
+        }
+
+    def _take(self) -> List[_Pending]:
+        """Up to batch_size logs (whole submissions) off the queue; call with the lock held"""
+        batch, count = [], 0
+        while self._queue and (not batch or count + len(self._queue[0].logs) <= self.batch_size):
+            pending = self._queue.popleft()
+            batch.append(pending)
+            count += len(pending.logs)
+            self._waiting -= pending.wait
+        self._queued -= count
+        self._in_flight = count
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._queued >= self.batch_size or self._waiting or self._flush_requested
+                                    or self._stop.is_set(), timeout=self.flush_seconds)
+                batch = self._take()
+                if not self._queue:
+                    self._flush_requested = False
+                stopping = self._stop.is_set() and not self._queue
+            if batch:
+                self._write(batch, retry=True)
+            with self._cond:
+                self._in_flight = 0
+                self._cond.notify_all()
+            if stopping and not batch:
+                return
+
+    def _rows(self, logs):
+        return [{
+            "user_id": log.user_id,
+            "status": log.status,
+            "face_encoding": log.face_encoding,
+            "timestamp": log.timestamp,
+            "face_image_url": log.face_image_url,
+        } for log in logs]
+
+    def _insert(self, logs: List[models.AccessLog]):
+        """Insert logs and their rollup counts in one transaction, then set their ids"""
+        with self.engine.begin() as conn:
+            ids = conn.execute(
+                insert(models.AccessLog).returning(models.AccessLog.id, sort_by_parameter_order=True),
+                self._rows(logs),
+            ).scalars().all()
+            rollup.apply(conn, rollup.count(logs))
+        for log, log_id in zip(logs, ids):
+            log.id = log_id
+
+    def _committed(self, batch: List[_Pending]):
+        logs = [log for pending in batch for log in pending.logs]
+        self.written += len(logs)
+        self.batches += 1
+        self.last_error = None
+        log_bus.publish(logs)
+        for pending in batch:
+            pending.future.set_result(pending.logs)
+
+    def _write(self, batch: List[_Pending], retry: bool = False):
+        """Write a batch; with retry, keep trying with backoff until it
+        succeeds or the writer stops, then spill what is left"""
+        logs = [log for pending in batch for log in pending.logs]
+        delay = 1.0
+        while True:
+            started = time.monotonic()
+            try:
+                self._insert(logs)
+            except (IntegrityError, DataError) as e:
+                # Retrying won't help: write the rows one by one and set aside those refused
+                print(f"[WARNING] Batch of {len(logs)} access logs refused ({e}), writing them one at a time")
+                self._write_each(batch)
+                return
+            except Exception as e:
+                self.last_error = str(e)
+                if not retry or self._stop.is_set():
+                    print(f"[ERROR] Failed to write {len(logs)} access logs: {e}")
+                    self._spill(batch)
+                    return
+                self.retries += 1
+                print(f"[ERROR] Failed to write {len(logs)} access logs, retrying in {delay:.0f}s: {e}")
+                self._stop.wait(delay)
+                delay = min(delay * 2, LOG_RETRY_MAX_SECONDS)
+                continue
+            print(f"[DEBUG] Wrote {len(logs)} access logs in {(time.monotonic() - started) * 1000:.1f} ms")
+            self._committed(batch)
+            return
+
+    def _write_each(self, batch: List[_Pending]):
+        written = []
+        for pending in batch:
+            for log in pending.logs:
+                try:
+                    self._insert([log])
+                    written.append(log)
+                except (IntegrityError, DataError) as e:
+                    self._append(self.spill_path + ".rejected", [log], error=str(e))
+                    self.rejected += 1
+                    print(f"[ERROR] Access log refused by the database, kept in {self.spill_path}.rejected: {e}")
+                except Exception as e:
+                    self.last_error = str(e)
+                    self._append(self.spill_path, [log])
+                    self.spilled += 1
+            if all(log.id is not None for log in pending.logs):
+                pending.future.set_result(pending.logs)
+            else:
+                pending.future.set_exception(LogNotWritten())
+        if written:
+            self.written += len(written)
+            self.batches += 1
+            log_bus.publish(written)
+
+    # Spill file
+
+    def _append(self, path: str, logs: List[models.AccessLog], error: Optional[str] = None):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._spill_lock, open(path, "a", encoding="utf-8") as f:
+            for log in logs:
+                record = _to_record(log)
+                if error is not None:
+                    record["error"] = error
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _spill(self, batch: List[_Pending]):
+        logs = [log for pending in batch for log in pending.logs]
+        try:
+            self._append(self.spill_path, logs)
+            self.spilled += len(logs)
+            print(f"[WARNING] Spilled {len(logs)} access logs to {self.spill_path}, written on the next start")
+        except OSError as e:
+            self.dropped += len(logs)
+            print(f"[ERROR] Could not spill {len(logs)} access logs to {self.spill_path}: {e}")
+        for pending in batch:
+            pending.future.set_exception(LogNotWritten())
+
+    def _queue_spilled(self):
+        """Queue logs spilled by an earlier run; call with the lock held.
+
+        They are moved to a ".replaying" file that is removed once every one
+        of them is written or spilled again, so a crash meanwhile replays
+        them next time instead of losing them.
+        """
+        if not self.spill_path:
+            return
+        replaying = self.spill_path + ".replaying"
+        if os.path.exists(self.spill_path):
+            with self._spill_lock, open(self.spill_path, encoding="utf-8") as src, \
+                    open(replaying, "a", encoding="utf-8") as dst:
+                dst.write(src.read())
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.remove(self.spill_path)
+        if not os.path.exists(replaying):
+            return
+        with open(replaying, encoding="utf-8") as f:
+            logs = [_from_record(json.loads(line)) for line in f if line.strip()]
+        batches = [_Pending(logs[start:start + self.batch_size], Future(), False)
+                   for start in range(0, len(logs), self.batch_size)]
+        remaining = [len(batches)]
+
+        def done(_future):
+            with self._spill_lock:
+                remaining[0] -= 1
+                if remaining[0] == 0:
+                    os.remove(replaying)
+
+        for pending in batches:
+            pending.future.add_done_callback(done)
+            self._enqueue(pending)
+        if not batches:
+            os.remove(replaying)
+        print(f"[INFO] Queued {len(logs)} access logs spilled by an earlier run")
+
+
+log_writer = LogWriter()
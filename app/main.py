@@ -1,11 +1,17 @@
 from fastapi import FastAPI
-from .database import engine, Base
-from .routers import users, camera, logs
+from .database import engine, Base, SessionLocal
+from .archive import log_archive
+from .gallery import gallery
+from .log_writer import LOG_WRITE_BEHIND, log_writer
+from .media import FACES_URL
+from .recognition_service import RECOGNITION_AUTOSTART, recognition_service
+from .serial_bridge import door
+from .workers import recognition_pool
+from .routers import users, camera, logs, faces
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
 from fastapi.responses import PlainTextResponse
 import logging
-from fastapi.staticfiles import StaticFiles
 
 
 
@@ -17,9 +23,74 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 
+@app.on_event("startup")
+def load_gallery():
+    db = SessionLocal()
+    try:
+        gallery.load(db)
+    finally:
+        db.close()
+
+
+@app.on_event("startup")
+def start_log_writer():
+    if LOG_WRITE_BEHIND:
+        log_writer.start()
+
+
+@app.on_event("startup")
+def start_log_archiver():
+    log_archive.start(SessionLocal)
+
+
+@app.on_event("startup")
+def start_door_controller():
+    # Connects in the background, so the first grant doesn't wait for the board to reset
+    door.start()
+
+
+@app.on_event("startup")
+def start_recognition_pool():
+    recognition_pool.start()
+    if RECOGNITION_AUTOSTART:
+        recognition_service.start()
+
+
+@app.on_event("shutdown")
+def stop_recognition_pool():
+    recognition_pool.shutdown()
+
+
+@app.on_event("shutdown")
+def stop_camera():
+    camera.cleanup_camera()
+
+
+@app.on_event("shutdown")
+def stop_door_controller():
+    door.stop()
+
+
+@app.on_event("shutdown")
+def stop_log_archiver():
+    log_archive.stop()
+
+
+@app.on_event("shutdown")
+def flush_gallery():
+    gallery.flush()
+
+
+@app.on_event("shutdown")
+def stop_log_writer():
+    # Last, so logs from the recognition loop are flushed too
+    log_writer.stop()
+
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
@@ -28,13 +99,9 @@ def health():
 app.include_router(users.router, prefix="/users", tags=["users"])
 app.include_router(camera.router, prefix="/camera", tags=["camera"])
 app.include_router(logs.router, prefix="/logs", tags=["logs"])
+app.include_router(faces.router, prefix=FACES_URL, tags=["media"])
 
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request, exc):
     logging.error(f"Request validation error: {exc!s}")
     return PlainTextResponse(str(exc), status_code=400)
-
-
-
-
-app.mount("/media/faces", StaticFiles(directory="/home/adeny/Documents/codes/Project-FaSer/app/media/faces"), name="faces")
\ No newline at end of file
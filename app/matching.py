@@ -0,0 +1,172 @@
+import os
+from abc import ABC, abstractmethod
+from typing import Optional, Tuple
+
+import numpy as np
+
+# exact: brute-force scan (today's behaviour); ivf: k-means inverted file
+FACE_MATCHER = os.getenv("FACE_MATCHER", "exact")
+# 0 means sqrt(N) lists
+IVF_LISTS = int(os.getenv("FACE_IVF_LISTS", "0"))
+# Lists scanned per probe: higher is slower but closer to the exact result
+IVF_PROBE = int(os.getenv("FACE_IVF_PROBE", "8"))
+# Below this gallery size the exact scan is already fast enough
+IVF_MIN_SIZE = int(os.getenv("FACE_IVF_MIN_SIZE", "5000"))
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLES_PER_LIST = 64
+
+
+def _squared_distances(vectors: np.ndarray, sq_norms: np.ndarray, probe: np.ndarray) -> np.ndarray:
+    # ||a - b||^2 = ||a||^2 - 2 a.b + ||b||^2, one GEMV over all vectors
+    sq = sq_norms - 2.0 * (vectors @ probe) + probe.dot(probe)
+    return np.maximum(sq, 0.0, out=sq)
+
+
+def _top_k(sq: np.ndarray, k: int) -> np.ndarray:
+    k = min(k, len(sq))
+    if k == len(sq):
+        return np.argsort(sq)
+    part = np.argpartition(sq, k - 1)[:k]
+    return part[np.argsort(sq[part])]
+
+
+class Matcher(ABC):
+    """Nearest-neighbour search over a fixed (N, D) float32 gallery matrix"""
+
+    def __init__(self, encodings: np.ndarray):
+        self.encodings = np.ascontiguousarray(encodings, dtype=np.float32)
+        self.sq_norms = np.einsum("ij,ij->i", self.encodings, self.encodings)
+
+    def __len__(self):
+        return len(self.encodings)
+
+    @abstractmethod
+    def search_one(self, probe: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """(indices, distances) of the k nearest rows to one probe, nearest first"""
+
+    def search(self, probes: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (indices, distances), each (Q, k), padded with -1 / inf"""
+        probes = np.atleast_2d(np.asarray(probes, dtype=np.float32))
+        indices = np.full((len(probes), k), -1, dtype=np.int64)
+        distances = np.full((len(probes), k), np.inf, dtype=np.float32)
+        if not len(self):
+            return indices, distances
+        for q, probe in enumerate(probes):
+            idx, dist = self.search_one(probe, k)
+            indices[q, :len(idx)] = idx
+            distances[q, :len(idx)] = dist
+        return indices, distances
+
+
+class ExactMatcher(Matcher):
+    """Brute-force scan of the whole gallery"""
+
+    def search_one(self, probe, k=1):
+        sq = _squared_distances(self.encodings, self.sq_norms, probe)
+        idx = _top_k(sq, k)
+        return idx, np.sqrt(sq[idx])
+
+    def search(self, probes, k=1):
+        probes = np.atleast_2d(np.asarray(probes, dtype=np.float32))
+        if len(probes) == 1 or not len(self):
+            return super().search(probes, k)
+        # All probes against the whole gallery in one GEMM
+        sq = self.sq_norms[None, :] - 2.0 * (probes @ self.encodings.T)
+        sq += np.einsum("ij,ij->i", probes, probes)[:, None]
+        np.maximum(sq, 0.0, out=sq)
+        k = min(k, len(self))
+        if k < len(self):
+            part = np.argpartition(sq, k - 1, axis=1)[:, :k]
+        else:
+            part = np.tile(np.arange(len(self)), (len(probes), 1))
+        part_sq = np.take_along_axis(sq, part, axis=1)
+        order = np.argsort(part_sq, axis=1)
+        indices = np.take_along_axis(part, order, axis=1)
+        distances = np.sqrt(np.take_along_axis(part_sq, order, axis=1))
+        return indices.astype(np.int64), distances.astype(np.float32)
+
+
+def kmeans(vectors: np.ndarray, n_clusters: int, iterations: int = KMEANS_ITERATIONS,
+           seed: int = 0) -> np.ndarray:
+    """Plain Lloyd's k-means, trained on a sample of the input"""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), n_clusters * KMEANS_SAMPLES_PER_LIST)
+    sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    centroids = sample[rng.choice(len(sample), n_clusters, replace=False)].copy()
+    sample_norms = np.einsum("ij,ij->i", sample, sample)
+    for _ in range(iterations):
+        assign = _assign(sample, sample_norms, centroids)
+        counts = np.bincount(assign, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        nonempty = counts > 0
+        centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+        # Re-seed empty clusters from random sample points
+        empty = np.flatnonzero(~nonempty)
+        if len(empty):
+            centroids[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+    return centroids
+
+
+def _assign(vectors: np.ndarray, sq_norms: np.ndarray, centroids: np.ndarray,
+            chunk: int = 8192) -> np.ndarray:
+    centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+    out = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk):
+        block = vectors[start:start + chunk]
+        sq = sq_norms[start:start + chunk, None] - 2.0 * (block @ centroids.T) + centroid_norms
+        out[start:start + chunk] = np.argmin(sq, axis=1)
+    return out
+
+
+class IVFMatcher(Matcher):
+    """Inverted-file index: k-means coarse quantizer plus exact re-ranking.
+
+    A probe is compared with every centroid, then only the vectors of the
+    ``n_probe`` closest lists are scanned exactly.
+    """
+
+    def __init__(self, encodings: np.ndarray, n_lists: int = 0, n_probe: int = IVF_PROBE,
+                 centroids: Optional[np.ndarray] = None):
+        super().__init__(encodings)
+        n = len(self.encodings)
+        if centroids is None:
+            n_lists = n_lists or max(1, int(np.sqrt(n)))
+            centroids = kmeans(self.encodings, min(n_lists, n))
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.centroid_norms = np.einsum("ij,ij->i", self.centroids, self.centroids)
+        self.n_probe = max(1, min(n_probe, len(self.centroids)))
+        self.trained_size = n
+
+        # Store the vectors grouped by list so a list scan is one slice
+        assign = _assign(self.encodings, self.sq_norms, self.centroids)
+        self.order = np.argsort(assign, kind="stable")
+        self.offsets = np.searchsorted(assign[self.order], np.arange(len(self.centroids) + 1))
+        self.list_vectors = self.encodings[self.order]
+        self.list_norms = self.sq_norms[self.order]
+
+    def search_one(self, probe, k=1):
+        coarse = self.centroid_norms - 2.0 * (self.centroids @ probe)
+        lists = _top_k(coarse, self.n_probe)
+        ranges = [np.arange(self.offsets[c], self.offsets[c + 1]) for c in lists]
+        positions = np.concatenate(ranges)
+        if not len(positions):
+            return positions, np.empty(0, dtype=np.float32)
+        sq = _squared_distances(self.list_vectors[positions], self.list_norms[positions], probe)
+        best = _top_k(sq, k)
+        return self.order[positions[best]], np.sqrt(sq[best])
+
+
+def build_matcher(encodings: np.ndarray, previous: Optional[Matcher] = None,
+                  kind: str = FACE_MATCHER) -> Matcher:
+    """Build the configured matcher, reusing trained centroids when possible"""
+    if kind == "ivf" and len(encodings) >= IVF_MIN_SIZE:
+        # Re-train only once the gallery has grown well past the trained size
+        if isinstance(previous, IVFMatcher) and len(encodings) < 2 * previous.trained_size:
+            matcher = IVFMatcher(encodings, n_probe=IVF_PROBE, centroids=previous.centroids)
+            matcher.trained_size = previous.trained_size
+            return matcher
+        return IVFMatcher(encodings, n_lists=IVF_LISTS, n_probe=IVF_PROBE)
+    if kind not in ("exact", "ivf"):
+        print(f"[WARNING] Unknown FACE_MATCHER '{kind}', using exact matching")
+    return ExactMatcher(encodings)
@@ -0,0 +1,165 @@
+"""Content-addressed store for captured face images.
+
+A capture is keyed by the SHA-256 of the original image. The whole picture
+(downscaled and recompressed) is stored as ``<key>.full.jpg`` and each face
+crop, which is what logs link to, under a key derived from the capture key
+and the face box. Files live in ``faces/<k[0:2]>/<k[2:4]>/`` so no directory
+grows past a few hundred entries, and saving the same capture twice writes
+nothing new.
+"""
+import hashlib
+import os
+import re
+import threading
+from typing import Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+
+MEDIA_ROOT = os.path.abspath(os.getenv("MEDIA_ROOT", os.path.join(os.path.dirname(__file__), "media")))
+# Captured face images, served under /media/faces
+FACES_DIR = os.path.join(MEDIA_ROOT, "faces")
+FACES_URL = "/media/faces"
+MEDIA_JPEG_QUALITY = int(os.getenv("MEDIA_JPEG_QUALITY", "85"))
+# Extra context around the detected box, as a fraction of its size
+MEDIA_CROP_MARGIN = float(os.getenv("MEDIA_CROP_MARGIN", "0.3"))
+# Keep the whole picture too (longest side capped), or only the crop
+MEDIA_KEEP_ORIGINAL = os.getenv("MEDIA_KEEP_ORIGINAL", "1") == "1"
+MEDIA_ORIGINAL_MAX_EDGE = int(os.getenv("MEDIA_ORIGINAL_MAX_EDGE", "1280"))
+# Thumbnail edge lengths served through ?size=, and those made at capture time
+THUMBS_DIR = os.path.join(MEDIA_ROOT, "thumbs")
+MEDIA_THUMB_SIZES = [int(v) for v in os.getenv("MEDIA_THUMB_SIZES", "64,256").split(",") if v.strip()]
+MEDIA_PREGENERATE_SIZES = [int(v) for v in os.getenv("MEDIA_PREGENERATE_SIZES", "256").split(",") if v.strip()]
+MEDIA_THUMB_QUALITY = int(os.getenv("MEDIA_THUMB_QUALITY", "80"))
+
+_CONTENT_ADDRESSED = re.compile(r"^([0-9a-f]{2})/([0-9a-f]{2})/(\1\2[0-9a-f]{60})(\.full)?\.jpg$")
+
+Location = Tuple[int, int, int, int]  # (top, right, bottom, left)
+
+
+def shard_path(key: str, suffix: str = ".jpg") -> str:
+    """Path of a stored file relative to FACES_DIR"""
+    return os.path.join(key[:2], key[2:4], key + suffix)
+
+
+def url_for(relative_path: str) -> str:
+    return f"{FACES_URL}/{relative_path.replace(os.sep, '/')}"
+
+
+def content_key(relative_path: str) -> Optional[str]:
+    """Hash-derived name of a stored file, None for legacy face_*.jpg captures"""
+    found = _CONTENT_ADDRESSED.match(relative_path.replace(os.sep, "/"))
+    return found.group(3) + (found.group(4) or "") if found else None
+
+
+def decode_image(contents: bytes) -> Optional[np.ndarray]:
+    # Ignore EXIF rotation, as face_recognition.load_image_file does, so the
+    # detector's boxes line up with these pixels
+    buffer = np.frombuffer(contents, dtype=np.uint8)
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+
+
+def crop_face(image: np.ndarray, location: Location, margin: float = MEDIA_CROP_MARGIN) -> np.ndarray:
+    top, right, bottom, left = location
+    pad_y = int((bottom - top) * margin)
+    pad_x = int((right - left) * margin)
+    height, width = image.shape[:2]
+    return image[max(0, top - pad_y):min(height, bottom + pad_y), max(0, left - pad_x):min(width, right + pad_x)]
+
+
+def _encode_jpeg(image: np.ndarray, quality: int = MEDIA_JPEG_QUALITY) -> bytes:
+    ok, buf = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("Failed to encode JPEG")
+    return buf.tobytes()
+
+
+def _write_once(relative_path: str, data: bytes, root: Optional[str] = None):
+    path = os.path.join(root or FACES_DIR, relative_path)
+    if os.path.exists(path):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def save_capture(contents: Optional[bytes] = None, image: Optional[np.ndarray] = None,
+                 location: Optional[Location] = None) -> Optional[str]:
+    """Store a capture given as encoded bytes or a BGR array and return the
+    public URL of its face crop (or of the picture when no box is given).
+
+    Blocking; use save_capture_async from request handlers.
+    """
+    try:
+        if image is None:
+            image = decode_image(contents)
+            if image is None:
+                print("[WARNING] Could not decode captured image")
+                return None
+        key = hashlib.sha256(contents if contents is not None else image.tobytes()).hexdigest()
+        full_path = shard_path(key, ".full.jpg") if location is not None else shard_path(key)
+        crop_path = full_path
+        if location is not None:
+            # Several faces can come from one picture; each crop gets its own key
+            crop_key = hashlib.sha256(f"{key}:{tuple(location)}".encode()).hexdigest()
+            crop_path = shard_path(crop_key)
+            crop = crop_face(image, location)
+            _write_once(crop_path, _encode_jpeg(crop))
+            for size in MEDIA_PREGENERATE_SIZES:
+                _write_once(thumbnail_path(crop_path, size), _encode_jpeg(make_thumbnail(crop, size), MEDIA_THUMB_QUALITY),
+                            root=THUMBS_DIR)
+        if MEDIA_KEEP_ORIGINAL or location is None:
+            height, width = image.shape[:2]
+            full = image
+            if MEDIA_ORIGINAL_MAX_EDGE and max(height, width) > MEDIA_ORIGINAL_MAX_EDGE:
+                factor = MEDIA_ORIGINAL_MAX_EDGE / float(max(height, width))
+                full = cv2.resize(image, (int(width * factor), int(height * factor)), interpolation=cv2.INTER_AREA)
+            _write_once(full_path, _encode_jpeg(full))
+        return url_for(crop_path)
+    except Exception as e:
+        print(f"[ERROR] Failed to save captured image: {e}")
+        return None
+
+
+async def save_capture_async(contents: Optional[bytes] = None, image: Optional[np.ndarray] = None,
+                             location: Optional[Location] = None) -> Optional[str]:
+    """save_capture on the threadpool, keeping disk I/O off the event loop"""
+    return await run_in_threadpool(save_capture, contents, image, location)
+
+
+def thumbnail_path(relative_path: str, size: int) -> str:
+    """Path of a thumbnail relative to THUMBS_DIR"""
+    return os.path.join(str(size), relative_path)
+
+
+def make_thumbnail(image: np.ndarray, size: int) -> np.ndarray:
+    """Shrink so the longest side is at most size pixels"""
+    height, width = image.shape[:2]
+    if max(height, width) <= size:
+        return image
+    factor = size / float(max(height, width))
+    return cv2.resize(image, (max(1, int(width * factor)), max(1, int(height * factor))),
+                      interpolation=cv2.INTER_AREA)
+
+
+def ensure_thumbnail(relative_path: str, size: int) -> Optional[str]:
+    """Absolute path of a cached thumbnail, made from the stored image on
+    first use; None if the source image doesn't exist"""
+    path = os.path.join(THUMBS_DIR, thumbnail_path(relative_path, size))
+    if os.path.exists(path):
+        return path
+    image = cv2.imread(os.path.join(FACES_DIR, relative_path), cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+    if image is None:
+        return None
+    _write_once(thumbnail_path(relative_path, size), _encode_jpeg(make_thumbnail(image, size), MEDIA_THUMB_QUALITY),
+                root=THUMBS_DIR)
+    return path
+
+
+def largest_face(locations: Sequence[Location]) -> Optional[Location]:
+    if not locations:
+        return None
+    return max(locations, key=lambda loc: (loc[2] - loc[0]) * (loc[1] - loc[3]))
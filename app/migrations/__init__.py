@@ -0,0 +1,24 @@
+"""Data and schema migrations for databases created by older versions.
+
+Every migration is idempotent, so ``python -m app.migrations`` can be run
+against any existing database to bring it up to date.
+"""
+from sqlalchemy.engine import Engine
+
+from . import encoding_blobs, face_samples, gallery_state, log_images, log_indexes, log_rollups
+
+MIGRATIONS = [
+    encoding_blobs,
+    log_images,
+    log_indexes,
+    log_rollups,
+    # Before face_samples: template writes bump the gallery version
+    gallery_state,
+    face_samples,
+]
+
+
+def run_all(engine: Engine):
+    for migration in MIGRATIONS:
+        print(f"[INFO] Running migration {migration.__name__.rsplit('.', 1)[-1]}")
+        migration.upgrade(engine)
@@ -0,0 +1,8 @@
+import sys
+
+from ..database import create_db_engine, engine
+from . import run_all
+
+if __name__ == "__main__":
+    # Optional DATABASE_URL argument, e.g. sqlite:///./face_access.db
+    run_all(create_db_engine(sys.argv[1]) if len(sys.argv) > 1 else engine)
@@ -0,0 +1,69 @@
+"""Convert hex-string face encodings to tagged binary blobs.
+
+SQLite stores BLOB values as-is regardless of the declared column type, so
+rows are rewritten in place and the file is vacuumed afterwards to give the
+space back. On other databases the column is first altered to a binary type.
+"""
+from sqlalchemy import LargeBinary, inspect, text
+from sqlalchemy.engine import Engine
+
+from ..encoding import is_packed, pack, unpack
+
+COLUMNS = [
+    ("faces", "encoding"),
+    ("access_logs", "face_encoding"),
+]
+BATCH_SIZE = 1000
+
+
+def _convert_column(conn, table: str, column: str) -> int:
+    rows = conn.execute(
+        text(f"SELECT id, {column} FROM {table} WHERE {column} IS NOT NULL")
+    )
+    converted = 0
+    batch = []
+    for row_id, value in rows.fetchall():
+        if is_packed(value):
+            continue
+        try:
+            vector = unpack(value)
+        except ValueError as e:
+            print(f"[WARNING] Leaving {table}.{column} id={row_id} as is: {e}")
+            continue
+        batch.append({"id": row_id, "value": pack(vector)})
+        if len(batch) >= BATCH_SIZE:
+            conn.execute(text(f"UPDATE {table} SET {column} = :value WHERE id = :id"), batch)
+            converted += len(batch)
+            batch = []
+    if batch:
+        conn.execute(text(f"UPDATE {table} SET {column} = :value WHERE id = :id"), batch)
+        converted += len(batch)
+    return converted
+
+
+def _is_binary(inspector, table: str, column: str) -> bool:
+    for col in inspector.get_columns(table):
+        if col["name"] == column:
+            return isinstance(col["type"], LargeBinary)
+    return False
+
+
+def upgrade(engine: Engine):
+    inspector = inspect(engine)
+    existing = set(inspector.get_table_names())
+    total = 0
+    with engine.begin() as conn:
+        for table, column in COLUMNS:
+            if table not in existing:
+                continue
+            if engine.dialect.name == "postgresql" and not _is_binary(inspector, table, column):
+                conn.execute(text(
+                    f"ALTER TABLE {table} ALTER COLUMN {column} TYPE BYTEA "
+                    f"USING convert_to({column}::text, 'UTF8')"
+                ))
+            count = _convert_column(conn, table, column)
+            print(f"[INFO] Converted {count} encodings in {table}.{column}")
+            total += count
+    if total and engine.dialect.name == "sqlite":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("VACUUM"))
@@ -0,0 +1,71 @@
+"""Allow several face samples per user and store their aggregates.
+
+faces.user_id used to be UNIQUE. SQLite cannot drop a constraint, so there
+the table is rebuilt; other databases drop it in place. face_templates is
+then filled for every user with samples but no template yet.
+"""
+from collections import defaultdict
+
+import numpy as np
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from .. import models
+from ..gallery import aggregate, to_vector
+
+
+def _unique_on_user(inspector):
+    """("constraint" | "index", name) of the old uniqueness rule, or None"""
+    for constraint in inspector.get_unique_constraints("faces"):
+        if constraint["column_names"] == ["user_id"]:
+            return "constraint", constraint.get("name")
+    for index in inspector.get_indexes("faces"):
+        if index["unique"] and index["column_names"] == ["user_id"]:
+            return "index", index["name"]
+    return None
+
+
+def _rebuild_sqlite(conn, inspector):
+    # The new table reuses the index names, so they go first
+    for index in inspector.get_indexes("faces"):
+        conn.execute(text(f'DROP INDEX "{index["name"]}"'))
+    conn.execute(text("ALTER TABLE faces RENAME TO faces_old"))
+    models.Face.__table__.create(conn)
+    conn.execute(text("INSERT INTO faces (id, encoding, user_id) SELECT id, encoding, user_id FROM faces_old"))
+    conn.execute(text("DROP TABLE faces_old"))
+
+
+def _fill_templates(engine: Engine) -> int:
+    with Session(engine) as db:
+        have = {user_id for user_id, in db.query(models.FaceTemplate.user_id)}
+        samples = defaultdict(list)
+        for user_id, encoding in db.query(models.Face.user_id, models.Face.encoding).order_by(models.Face.id):
+            vector = to_vector(encoding)
+            if user_id is not None and user_id not in have and vector is not None:
+                samples[user_id].append(vector)
+        for user_id, vectors in samples.items():
+            centroid, spread = aggregate(np.stack(vectors))
+            db.add(models.FaceTemplate(user_id=user_id, centroid=centroid, spread=spread, samples=len(vectors)))
+        db.commit()
+    return len(samples)
+
+
+def upgrade(engine: Engine):
+    inspector = inspect(engine)
+    if "faces" not in inspector.get_table_names():
+        return
+    unique = _unique_on_user(inspector)
+    with engine.begin() as conn:
+        if unique and engine.dialect.name == "sqlite":
+            _rebuild_sqlite(conn, inspector)
+            print("[INFO] Rebuilt faces without the one-face-per-user constraint")
+        elif unique:
+            kind, name = unique
+            conn.execute(text(f'ALTER TABLE faces DROP CONSTRAINT "{name}"' if kind == "constraint"
+                              else f'DROP INDEX "{name}"'))
+            print(f"[INFO] Dropped {kind} {name} on faces.user_id")
+        for index in models.Face.__table__.indexes:
+            index.create(conn, checkfirst=True)
+    models.FaceTemplate.__table__.create(engine, checkfirst=True)
+    print(f"[INFO] Computed face templates for {_fill_templates(engine)} users")
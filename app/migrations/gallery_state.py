@@ -0,0 +1,19 @@
+"""Create gallery_state, the version gallery snapshots are checked against.
+
+The row starts at 0, so a snapshot rebuilt after this migration can be
+trusted until the next write to users, faces or templates.
+"""
+from sqlalchemy import inspect
+from sqlalchemy.engine import Engine
+
+from .. import models
+
+
+def upgrade(engine: Engine):
+    if "users" not in inspect(engine).get_table_names():
+        return
+    table = models.GalleryState.__table__
+    table.create(engine, checkfirst=True)
+    with engine.begin() as conn:
+        if conn.execute(table.select().where(table.c.id == 1)).first() is None:
+            conn.execute(table.insert().values(id=1, version=0))
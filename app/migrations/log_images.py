@@ -0,0 +1,80 @@
+"""Add access_logs.face_image_url and backfill it for historical rows.
+
+Logs used to be matched to captured images at read time by picking the
+newest file in media/faces whose mtime is not after the log's timestamp.
+That guess is applied once here, only when the column is first added, so
+later logs that genuinely have no image are never given one.
+"""
+import bisect
+import glob
+import os
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from ..media import FACES_DIR, FACES_URL
+
+BATCH_SIZE = 1000
+
+
+def _face_files(faces_dir: str):
+    """(mtime, filename) pairs for captured images, oldest first"""
+    files = []
+    for path in glob.glob(os.path.join(faces_dir, "face_*.jpg")):
+        try:
+            files.append((datetime.fromtimestamp(os.path.getmtime(path)), os.path.basename(path)))
+        except OSError:
+            continue
+    files.sort()
+    return files
+
+
+def _parse_timestamp(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+
+def backfill(conn, faces_dir: Optional[str] = None) -> int:
+    files = _face_files(faces_dir or FACES_DIR)
+    if not files:
+        return 0
+    mtimes = [mtime for mtime, _ in files]
+    rows = conn.execute(text(
+        "SELECT id, timestamp FROM access_logs WHERE face_image_url IS NULL"
+    )).fetchall()
+    updated = 0
+    batch = []
+    for row_id, timestamp in rows:
+        timestamp = _parse_timestamp(timestamp)
+        if timestamp is None:
+            continue
+        index = bisect.bisect_right(mtimes, timestamp) - 1
+        if index < 0:
+            continue
+        batch.append({"id": row_id, "url": f"{FACES_URL}/{files[index][1]}"})
+        if len(batch) >= BATCH_SIZE:
+            conn.execute(text("UPDATE access_logs SET face_image_url = :url WHERE id = :id"), batch)
+            updated += len(batch)
+            batch = []
+    if batch:
+        conn.execute(text("UPDATE access_logs SET face_image_url = :url WHERE id = :id"), batch)
+        updated += len(batch)
+    return updated
+
+
+def upgrade(engine: Engine):
+    inspector = inspect(engine)
+    if "access_logs" not in inspector.get_table_names():
+        return
+    if any(col["name"] == "face_image_url" for col in inspector.get_columns("access_logs")):
+        return
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE access_logs ADD COLUMN face_image_url VARCHAR"))
+        count = backfill(conn)
+    print(f"[INFO] Backfilled face_image_url for {count} access logs")
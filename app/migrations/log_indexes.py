@@ -0,0 +1,22 @@
+"""Create the access_logs indexes declared on the model.
+
+create_all() only builds indexes together with a new table, so databases
+created before the indexes existed get them here.
+"""
+from sqlalchemy import inspect
+from sqlalchemy.engine import Engine
+
+from ..models import AccessLog
+
+
+def upgrade(engine: Engine):
+    inspector = inspect(engine)
+    if "access_logs" not in inspector.get_table_names():
+        return
+    existing = {index["name"] for index in inspector.get_indexes("access_logs")}
+    with engine.begin() as conn:
+        for index in AccessLog.__table__.indexes:
+            if index.name in existing:
+                continue
+            index.create(conn)
+            print(f"[INFO] Created index {index.name}")
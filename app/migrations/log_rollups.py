@@ -0,0 +1,27 @@
+"""Create access_log_rollups and fill it from the existing logs.
+
+create_all() and live logging can both put rows in the table before this
+runs, so the backfill is recorded in applied_migrations rather than
+inferred from the table being empty.
+"""
+from sqlalchemy import inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from .. import models, rollup
+
+NAME = "log_rollups_backfill"
+
+
+def upgrade(engine: Engine):
+    if "access_logs" not in inspect(engine).get_table_names():
+        return
+    models.LogRollup.__table__.create(engine, checkfirst=True)
+    models.AppliedMigration.__table__.create(engine, checkfirst=True)
+    with Session(engine) as db:
+        if db.get(models.AppliedMigration, NAME) is not None:
+            return
+        # A full rebuild replaces whatever live logging has counted so far
+        rollup.rebuild(db)
+        db.add(models.AppliedMigration(name=NAME))
+        db.commit()
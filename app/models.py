@@ -1,32 +1,76 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, Float, String, Boolean, DateTime, ForeignKey, Index, PrimaryKeyConstraint
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .database import Base
+from .encoding import EncodingBlob
 
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=True, index=True, nullable=False)
     active = Column(Boolean, default=True)
-    face = relationship("Face", uselist=False, back_populates="user")
+    faces = relationship("Face", back_populates="user", cascade="all, delete-orphan", order_by="Face.id")
+    template = relationship("FaceTemplate", uselist=False, cascade="all, delete-orphan")
     logs = relationship("AccessLog", back_populates="user")
 
 class Face(Base):
     __tablename__ = "faces"
     id = Column(Integer, primary_key=True, index=True)
-    encoding = Column(String, nullable=False)
-    user_id = Column(Integer, ForeignKey("users.id"), unique=True)
-    user = relationship("User", back_populates="face")
+    encoding = Column(EncodingBlob, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    user = relationship("User", back_populates="faces")
+
+class FaceTemplate(Base):
+    """Aggregate of a user's face samples, kept in step by crud; see app/gallery.py"""
+    __tablename__ = "face_templates"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    centroid = Column(EncodingBlob, nullable=False)
+    # Distance from the centroid to the farthest sample
+    spread = Column(Float, nullable=False, default=0.0)
+    samples = Column(Integer, nullable=False, default=0)
 
 class AccessLog(Base):
     __tablename__ = "access_logs"
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     status = Column(String, nullable=False)
-    face_encoding = Column(String, nullable=True)
+    face_encoding = Column(EncodingBlob, nullable=True)
     timestamp = Column(DateTime, default=datetime.utcnow)
+    face_image_url = Column(String, nullable=True)
     user = relationship("User", back_populates="logs")
+
+    # Match GET /logs: newest first (id breaks ties for the keyset cursor),
+    # optionally filtered by status or user
+    __table_args__ = (
+        Index("ix_access_logs_timestamp", timestamp.desc(), id.desc()),
+        Index("ix_access_logs_status_timestamp", status, timestamp.desc(), id.desc()),
+        Index("ix_access_logs_user_id_timestamp", user_id, timestamp),
+    )
  
+class LogRollup(Base):
+    """Access log counts per hour, status and user (0 for no user); see app/rollup.py"""
+    __tablename__ = "access_log_rollups"
+    hour = Column(DateTime, nullable=False)
+    status = Column(String, nullable=False)
+    user_id = Column(Integer, nullable=False, default=0)
+    count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        PrimaryKeyConstraint(hour, status, user_id),
+    )
+
+class GalleryState(Base):
+    """Single row whose version each transaction changing enrolled faces bumps; see app/gallery.py"""
+    __tablename__ = "gallery_state"
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+class AppliedMigration(Base):
+    """Data migrations that must run once, e.g. backfills; see app/migrations"""
+    __tablename__ = "applied_migrations"
+    name = Column(String, primary_key=True)
+    applied_at = Column(DateTime, default=datetime.utcnow)
+
 class NotificationToken(Base):
     __tablename__ = "notification_tokens"
     id = Column(Integer, primary_key=True, index=True)
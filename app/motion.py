@@ -0,0 +1,102 @@
+import os
+import time
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+# Fraction of ROI pixels that must change to count as motion
+MOTION_THRESHOLD = float(os.getenv("MOTION_THRESHOLD", "0.01"))
+# Per-pixel grey-level change that counts as "changed"
+MOTION_PIXEL_DELTA = int(os.getenv("MOTION_PIXEL_DELTA", "25"))
+# Door region as fractions of the frame: "x,y,w,h", empty for the whole frame
+MOTION_ROI = os.getenv("MOTION_ROI", "")
+# Keep detecting this long after the scene stops changing (someone standing still)
+MOTION_HOLD_SECONDS = float(os.getenv("MOTION_HOLD_SECONDS", "2"))
+# Width frames are shrunk to before differencing
+MOTION_FRAME_WIDTH = int(os.getenv("MOTION_FRAME_WIDTH", "160"))
+# How quickly the background model absorbs changes (lighting drift, moved objects)
+MOTION_BACKGROUND_ALPHA = float(os.getenv("MOTION_BACKGROUND_ALPHA", "0.05"))
+
+Roi = Tuple[float, float, float, float]
+
+
+def parse_roi(value: str) -> Optional[Roi]:
+    if not value.strip():
+        return None
+    x, y, w, h = (float(v) for v in value.split(","))
+    return x, y, w, h
+
+
+class MotionGate:
+    """Cheap change detector run before face detection.
+
+    Frames are shrunk, converted to blurred greyscale and compared against
+    a running-average background; face detection only runs while the door
+    region is changing (plus a short hold period).
+    """
+
+    def __init__(self, threshold: float = MOTION_THRESHOLD, pixel_delta: int = MOTION_PIXEL_DELTA,
+                 roi: Optional[Roi] = parse_roi(MOTION_ROI), hold_seconds: float = MOTION_HOLD_SECONDS,
+                 frame_width: int = MOTION_FRAME_WIDTH, alpha: float = MOTION_BACKGROUND_ALPHA):
+        self.threshold = threshold
+        self.pixel_delta = pixel_delta
+        self.roi = roi
+        self.hold_seconds = hold_seconds
+        self.frame_width = frame_width
+        self.alpha = alpha
+        self.reset()
+
+    def reset(self):
+        self._background = None
+        self._last_motion = None
+        self.frames_processed = 0
+        self.frames_skipped = 0
+        self.last_change = 0.0
+
+    def _prepare(self, image: np.ndarray) -> np.ndarray:
+        height, width = image.shape[:2]
+        if self.roi is not None:
+            x, y, w, h = self.roi
+            image = image[int(y * height):int((y + h) * height), int(x * width):int((x + w) * width)]
+            height, width = image.shape[:2]
+        if width > self.frame_width:
+            size = (self.frame_width, max(1, int(height * self.frame_width / width)))
+            image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        return cv2.GaussianBlur(gray, (5, 5), 0)
+
+    def changed_fraction(self, image: np.ndarray) -> float:
+        """Fraction of changed pixels versus the background; updates the background"""
+        gray = self._prepare(image)
+        if self._background is None or self._background.shape != gray.shape:
+            self._background = gray.astype(np.float32)
+            return 1.0
+        diff = cv2.absdiff(gray, cv2.convertScaleAbs(self._background))
+        changed = float(np.count_nonzero(diff > self.pixel_delta)) / diff.size
+        cv2.accumulateWeighted(gray, self._background, self.alpha)
+        return changed
+
+    def check(self, image: np.ndarray, now: Optional[float] = None) -> bool:
+        """True if the frame should go on to face detection"""
+        now = time.monotonic() if now is None else now
+        self.last_change = self.changed_fraction(image)
+        if self.last_change >= self.threshold:
+            self._last_motion = now
+        active = self._last_motion is not None and now - self._last_motion <= self.hold_seconds
+        if active:
+            self.frames_processed += 1
+        else:
+            self.frames_skipped += 1
+        return active
+
+    def stats(self):
+        total = self.frames_processed + self.frames_skipped
+        return {
+            "frames_processed": self.frames_processed,
+            "frames_skipped": self.frames_skipped,
+            "skip_ratio": self.frames_skipped / total if total else 0.0,
+            "last_change": self.last_change,
+            "threshold": self.threshold,
+            "roi": self.roi,
+        }
@@ -0,0 +1,203 @@
+import os
+import threading
+import time
+
+from .access import decide_access, probe_encoding
+from .capture import frame_hub
+from .database import SessionLocal
+from .detection import detector_settings
+from .gallery import gallery
+from .log_writer import log_writer
+from .media import save_capture
+from .motion import MotionGate
+from .serial_bridge import door
+from .tracking import FaceTracker
+from .workers import PoolBusy, detect_frame, encode_frame, recognition_pool
+
+# Frames per second sampled from the camera for recognition
+RECOGNITION_SAMPLE_FPS = float(os.getenv("RECOGNITION_SAMPLE_FPS", "2"))
+# Start the loop together with the API
+RECOGNITION_AUTOSTART = os.getenv("RECOGNITION_AUTOSTART", "0") == "1"
+# Seconds to ignore the camera after a decision (the door stays open ~6 s)
+GRANTED_COOLDOWN = float(os.getenv("RECOGNITION_GRANTED_COOLDOWN", "6"))
+DENIED_COOLDOWN = float(os.getenv("RECOGNITION_DENIED_COOLDOWN", "2"))
+# Consecutive denials before the buzzer alert
+MAX_FAILED_ATTEMPTS = int(os.getenv("RECOGNITION_MAX_FAILED_ATTEMPTS", "3"))
+# Skip face detection while the door region is static
+MOTION_GATE = os.getenv("MOTION_GATE", "1") == "1"
+
+LIVE_DETECTOR = detector_settings("live")
+
+
+class RecognitionService:
+    """Headless door loop: sample camera frames, recognize, drive the door.
+
+    Frames come from the shared capture thread and dlib runs in the
+    recognition pool, so the service owns neither the camera nor a worker.
+    """
+
+    def __init__(self, sample_fps: float = RECOGNITION_SAMPLE_FPS, motion_gate: bool = MOTION_GATE,
+                 frames=frame_hub, door=door, pool=recognition_pool):
+        self.sample_fps = sample_fps
+        self.frames = frames
+        self.door = door
+        self.pool = pool
+        self.motion = MotionGate() if motion_gate else None
+        self.tracker = FaceTracker()
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._reset_counters()
+
+    def _reset_counters(self):
+        self.failed_attempts = 0
+        self.frames_sampled = 0
+        self.frames_processed = 0
+        self.frames_dropped = 0
+        self.granted = 0
+        self.denied = 0
+        self.last_result = None
+        self.last_error = None
+        self.started_at = None
+        if self.motion is not None:
+            self.motion.reset()
+        self.tracker.reset()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return False
+            self._reset_counters()
+            self._stop.clear()
+            self.started_at = time.time()
+            self._thread = threading.Thread(target=self._run, name="recognition-service", daemon=True)
+            self._thread.start()
+            print(f"[INFO] Recognition service started at {self.sample_fps} fps")
+            return True
+
+    def stop(self):
+        with self._lock:
+            thread = self._thread
+            if thread is None:
+                return False
+            self._stop.set()
+        thread.join(timeout=10)
+        with self._lock:
+            self._thread = None
+        print("[INFO] Recognition service stopped")
+        return True
+
+    def status(self):
+        return {
+            "running": self.running,
+            "sample_fps": self.sample_fps,
+            "started_at": self.started_at,
+            "frames_sampled": self.frames_sampled,
+            "frames_processed": self.frames_processed,
+            "frames_dropped": self.frames_dropped,
+            "granted": self.granted,
+            "denied": self.denied,
+            "failed_attempts": self.failed_attempts,
+            "last_result": self.last_result,
+            "last_error": self.last_error,
+            "motion": self.motion.stats() if self.motion is not None else None,
+            "tracking": self.tracker.stats(),
+        }
+
+    def _run(self):
+        with self.frames.consumer():
+            self._loop()
+
+    def _loop(self):
+        interval = 1.0 / self.sample_fps if self.sample_fps > 0 else 0.0
+        seq = 0
+        while not self._stop.is_set():
+            started = time.monotonic()
+            frame = self.frames.wait_for(seq)
+            if frame is None:
+                self.last_error = self.frames.error or "No frame from camera"
+                self._stop.wait(1.0)
+                continue
+            seq = frame.seq
+            self.frames_sampled += 1
+            cooldown = 0.0
+            try:
+                if self.motion is None or self.motion.check(frame.image):
+                    cooldown = self._process(frame)
+            except PoolBusy:
+                self.frames_dropped += 1
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"[ERROR] Recognition service: {e}")
+            self._stop.wait(max(interval - (time.monotonic() - started), cooldown, 0.0))
+
+    def _identify(self, frame, tracks):
+        """Encode and match the given tracks, recording each decision on its track"""
+        encodings = self.pool.submit(encode_frame, frame.image, [t.box for t in tracks]).result()
+        self.tracker.encodes += len(tracks)
+        db = SessionLocal()
+        try:
+            gallery.ensure_loaded(db)
+        finally:
+            db.close()
+        probes = [probe_encoding([encoding]) for encoding in encodings]
+        valid = [i for i, probe in enumerate(probes) if probe is not None]
+        matches = dict(zip(valid, gallery.match_many([probes[i] for i in valid]))) if valid else {}
+        for i, track in enumerate(tracks):
+            encoding = [encodings[i]] if i < len(encodings) else []
+            probe = probes[i] if i < len(probes) else None
+            match = matches.get(i)
+            decision = decide_access([track.box], encoding, probe, match)
+            self.tracker.record(track, decision, match.distance if match else None)
+
+    def _process(self, frame) -> float:
+        """Recognize one frame; returns how long to pause sampling afterwards"""
+        locations = self.pool.submit(detect_frame, frame.image, LIVE_DETECTOR).result()
+        self.frames_processed += 1
+        tracks = self.tracker.update(locations)
+        if not tracks:
+            # An empty hallway is not an access attempt
+            return 0.0
+
+        stale = [t for t in tracks if self.tracker.needs_encoding(t)]
+        self.tracker.reuses += len(tracks) - len(stale)
+        if stale:
+            self._identify(frame, stale)
+        # Act only when a face's decision is new or has changed, not on every
+        # frame in which the same person is still standing at the door
+        changed = [t for t in stale if t.changed]
+        if not changed:
+            return 0.0
+
+        decisions = [t.decision for t in changed]
+        log_writer.log_many([dict(t.decision[0], face_image_url=save_capture(image=frame.image, location=t.box))
+                             for t in changed])
+
+        granted = [user_name for entry, _, user_name, _ in decisions if entry["status"] == "granted"]
+        self.last_result = {
+            "timestamp": frame.timestamp,
+            "faces": len(tracks),
+            "statuses": [entry["status"] for entry, _, _, _ in decisions],
+            "granted": granted,
+        }
+        if granted:
+            self.granted += 1
+            self.failed_attempts = 0
+            self.door.send('O')
+            return GRANTED_COOLDOWN
+
+        self.denied += 1
+        self.failed_attempts += 1
+        self.door.send('X')
+        if self.failed_attempts >= MAX_FAILED_ATTEMPTS:
+            print(f"{self.failed_attempts} consecutive failed attempts detected. Sending buzzer alert command.")
+            self.door.send('B')
+            self.failed_attempts = 0
+        return DENIED_COOLDOWN
+
+
+recognition_service = RecognitionService()
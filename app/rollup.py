@@ -0,0 +1,150 @@
+"""Hourly access-log counts per status and user, kept next to the raw logs.
+
+Every code path that inserts access logs adds its counts here in the same
+transaction, so GET /logs/stats reads a table whose size depends on time
+span rather than on log volume. Archiving raw logs leaves the rollup alone.
+
+Usage: python -m app.rollup [--since YYYY-MM-DD]   (rebuild from raw logs)
+"""
+import argparse
+from collections import Counter
+from datetime import datetime
+from typing import Iterable, Optional
+
+from sqlalchemy import delete, func, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from . import models
+from .archive import log_archive
+
+# user_id stored for logs without a user (NULLs never conflict in a primary key)
+NO_USER = 0
+
+
+def hour_of(timestamp: datetime) -> datetime:
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+def count(logs: Iterable) -> Counter:
+    """(hour, status, user_id) -> number of logs"""
+    counts = Counter()
+    for log in logs:
+        if log.timestamp is not None:
+            counts[(hour_of(log.timestamp), log.status, log.user_id or NO_USER)] += 1
+    return counts
+
+
+def apply(executor, counts: Counter):
+    """Add counts to the rollup through a Session or Connection (inside its transaction)"""
+    if not counts:
+        return
+    table = models.LogRollup.__table__
+    rows = [{"hour": hour, "status": status, "user_id": user_id, "count": n}
+            for (hour, status, user_id), n in counts.items()]
+    bind = executor.get_bind() if isinstance(executor, Session) else executor
+    dialect = bind.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        insert = sqlite.insert if dialect == "sqlite" else postgresql.insert
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.hour, table.c.status, table.c.user_id],
+            set_={"count": table.c.count + stmt.excluded["count"]},
+        )
+        executor.execute(stmt, rows)
+        return
+    for row in rows:
+        result = executor.execute(
+            update(table)
+            .where(table.c.hour == row["hour"], table.c.status == row["status"],
+                   table.c.user_id == row["user_id"])
+            .values(count=table.c.count + row["count"])
+        )
+        if result.rowcount == 0:
+            executor.execute(table.insert(), [row])
+
+
+def rebuild(db: Session, since: Optional[datetime] = None, batch_size: int = 10000) -> int:
+    """Recount the rollup from raw logs, from `since` (an hour) or entirely.
+
+    Logs below the archive cutoff are read back from the archive, so a
+    rebuild reaching into archived history keeps its counts. Returns the
+    number of logs counted.
+    """
+    table = models.LogRollup.__table__
+    start = hour_of(since) if since else None
+    query = db.query(models.AccessLog.timestamp, models.AccessLog.status, models.AccessLog.user_id)
+    if start is not None:
+        db.execute(delete(table).where(table.c.hour >= start))
+        query = query.filter(models.AccessLog.timestamp >= start)
+    else:
+        db.execute(delete(table))
+
+    counts = Counter()
+    total = 0
+    # Rows of an unfinished archive run are still in the database, so the
+    # archive is only read below its committed cutoff
+    archived_before = log_archive.archived_before()
+    if archived_before is not None and (start is None or start < archived_before):
+        for log, _ in log_archive.iter_rows(since=start, until=archived_before):
+            counts.update(count([log]))
+            total += 1
+    for row in query.yield_per(batch_size):
+        counts.update(count([row]))
+        total += 1
+    apply(db, counts)
+    db.commit()
+    print(f"[INFO] Rebuilt access log rollup from {total} logs")
+    return total
+
+
+def stats(db: Session, since: datetime, until: datetime, granularity: str = "day", top: int = 5):
+    """Counts for GET /logs/stats, bucketed by hour or day"""
+    table = models.LogRollup.__table__
+    in_range = (table.c.hour >= hour_of(since), table.c.hour < until)
+    by_hour = db.execute(
+        table.select().with_only_columns(table.c.hour, table.c.status, table.c.count)
+        .where(*in_range)
+    ).all()
+
+    totals = Counter()
+    series = {}
+    for hour, status, n in by_hour:
+        period = hour if granularity == "hour" else hour.replace(hour=0)
+        bucket = series.setdefault(period, Counter())
+        bucket[status] += n
+        totals[status] += n
+
+    top_rows = db.execute(
+        table.select()
+        .with_only_columns(table.c.user_id, models.User.name, func.sum(table.c.count).label("total"))
+        .select_from(table.outerjoin(models.User.__table__, models.User.id == table.c.user_id))
+        .where(*in_range, table.c.user_id != NO_USER)
+        .group_by(table.c.user_id, models.User.name)
+        .order_by(func.sum(table.c.count).desc())
+        .limit(top)
+    ).all()
+
+    return {
+        "since": since,
+        "until": until,
+        "granularity": granularity,
+        "totals": dict(totals),
+        "series": [{"period": period, "counts": dict(series[period])} for period in sorted(series)],
+        "top_users": [{"user_id": user_id, "user_name": name, "count": total}
+                      for user_id, name, total in top_rows],
+    }
+
+
+if __name__ == "__main__":
+    from .database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Rebuild the access log rollup from raw logs")
+    parser.add_argument("--since", type=datetime.fromisoformat, default=None,
+                        help="only recount from this time (default: everything, including the archive)")
+    args = parser.parse_args()
+    session = SessionLocal()
+    try:
+        rebuild(session, args.since)
+    finally:
+        session.close()
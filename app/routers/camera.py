@@ -1,77 +1,46 @@
 from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
 from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-import io, cv2, face_recognition, numpy as np, requests, os, shutil
+import asyncio, io, cv2, numpy as np, os, zipfile
+from typing import List
+from ..capture import frame_hub
 from ..database import get_db
-from .. import crud, schemas
-from ..serial_bridge import send_command
+from ..detection import detector_settings
+from ..encoding_cache import encoding_cache
+from .. import schemas
+from ..access import decide_access, probe_encoding
+from ..gallery import gallery
+from ..log_writer import log_writer
+from ..media import largest_face, save_capture_async
+from ..recognition_service import recognition_service
+from ..serial_bridge import door, send_command
+from ..workers import recognition_pool
 
 
 router = APIRouter()
 
-# Global camera object to avoid repeated initialization
-_camera = None
-_camera_index = -1
-
-def find_available_camera():
-    """Find the first available camera index"""
-    for i in range(10):
-        cap = cv2.VideoCapture(i)
-        if cap.isOpened():
-            ret, frame = cap.read()
-            if ret:
-                print(f"Found working camera at index {i}")
-                return cap, i
-            cap.release()
-    return None, -1
-
-def get_camera():
-    """Get or initialize the camera"""
-    global _camera, _camera_index
-    
-    if _camera is None or not _camera.isOpened():
-        print("Initializing camera...")
-        _camera, _camera_index = find_available_camera()
-        
-        if _camera is None:
-            print("No working cameras found")
-            raise HTTPException(
-                status_code=503, 
-                detail="No camera available. Please check camera connection and permissions."
-            )
-        
-        print(f"Camera initialized at index {_camera_index}")
-    
-    return _camera
+RECOGNIZE_BATCH_MAX = int(os.getenv("RECOGNIZE_BATCH_MAX", "32"))
+# Largest decompressed size of one image inside a batch zip
+RECOGNIZE_IMAGE_MAX_BYTES = int(os.getenv("RECOGNIZE_IMAGE_MAX_BYTES", str(10 * 1024 * 1024)))
+RECOGNIZE_DETECTOR = detector_settings("recognize")
+BATCH_DETECTOR = detector_settings("batch")
 
 def mjpeg_generator():
-    """MJPEG stream generator"""
+    """MJPEG stream generator reading the shared capture thread's latest frame"""
     try:
-        cap = get_camera()
-        
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                print("Failed to read frame from camera")
-                # Try to reinitialize camera
-                global _camera
-                _camera = None
-                try:
-                    cap = get_camera()
+        with frame_hub.viewer():
+            seq = 0
+            while True:
+                frame = frame_hub.wait_for(seq)
+                if frame is None:
+                    raise RuntimeError(frame_hub.error or "Timed out waiting for a frame")
+                seq = frame.seq
+                if frame.jpeg is None:
+                    # Frame was captured before this viewer registered
                     continue
-                except:
-                    break
-            
-            
-            ret2, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
-            if not ret2:
-                print("Failed to encode frame")
-                continue
-                
-            frame_bytes = jpeg.tobytes()
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-                   
+                yield (b'--frame\r\n'
+                       b'Content-Type: image/jpeg\r\n\r\n' + frame.jpeg + b'\r\n')
+
     except Exception as e:
         print(f"Error in MJPEG generator: {e}")
         error_frame = np.zeros((480, 640, 3), dtype=np.uint8)
@@ -99,243 +68,181 @@ def stream():
 
 
 
-def validate_encoding(encoding_data, expected_dim=128):
-    """Validate and potentially fix face encoding dimensions"""
-    try:
-        if isinstance(encoding_data, str):
-            encoding_bytes = bytes.fromhex(encoding_data)
-            encoding = np.frombuffer(encoding_bytes, dtype=np.float64)
-        else:
-            encoding = np.array(encoding_data, dtype=np.float64)
-        
-        print(f"[DEBUG] Encoding shape: {encoding.shape}")
-        
-        if encoding.shape[0] == expected_dim:
-            return encoding
-        elif encoding.shape[0] > expected_dim:
-            print(f"[WARNING] Truncating encoding from {encoding.shape[0]} to {expected_dim}")
-            return encoding[:expected_dim]
-        else:
-            # Pad if too short
-            print(f"[WARNING] Padding encoding from {encoding.shape[0]} to {expected_dim}")
-            padded = np.zeros(expected_dim)
-            padded[:encoding.shape[0]] = encoding
-            return padded
-            
-    except Exception as e:
-        print(f"[ERROR] Failed to validate encoding: {e}")
-        return None
+def recognition_result(log, user_name, message):
+    return {
+        "id": log.id,
+        "user_id": log.user_id,
+        "user_name": user_name,
+        "status": log.status,
+        "timestamp": log.timestamp,
+        "message": message,
+        "face_image_url": log.face_image_url
+    }
+
 
-@router.post("/recognize", response_model=schemas.LogOut)
+@router.post("/recognize", response_model=schemas.RecognitionOut)
 async def recognize(
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
 ):
     try:
         contents = await file.read()
-        image = face_recognition.load_image_file(io.BytesIO(contents))
-        locations = face_recognition.face_locations(image)
-
-        # Save the uploaded image for logging
-        face_image_url = None
-        if locations:
-            save_dir = os.path.join(os.path.dirname(__file__), "../media/faces")
-            os.makedirs(save_dir, exist_ok=True)
-            filename = f"face_{np.random.randint(0, 1_000_000)}_{np.random.randint(0, 1_000_000)}.jpg"
-            save_path = os.path.abspath(os.path.join(save_dir, filename))
-            with open(save_path, "wb") as f:
-                f.write(contents)
-
-            face_image_url = f"/media/faces/{filename}"
-
-        if not locations:
-            log = crud.log_access(db, user_id=None, status="no_face")
-            send_command('X')
-            return {
-                "id": log.id,
-                "user_id": None,
-                "user_name": None,
-                "status": "no_face",
-                "timestamp": log.timestamp,
-                "message": "No face detected",
-                "face_image_url": face_image_url
-            }
-        
-        encodings = face_recognition.face_encodings(image, locations)
-        if not encodings:
-            log = crud.log_access(db, user_id=None, status="no_encoding")
-            send_command('X')
-            return {
-                "id": log.id,
-                "user_id": None,
-                "user_name": None,
-                "status": "no_encoding",
-                "timestamp": log.timestamp,
-                "message": "Could not encode face",
-                "face_image_url": face_image_url
-            }
-        
-        # Get current face encoding
-        current_encoding = encodings[0]
-        print(f"[DEBUG] Current encoding shape: {current_encoding.shape}")
-        
-        # Validate current encoding
-        current_encoding = validate_encoding(current_encoding)
-        if current_encoding is None:
-            log = crud.log_access(db, user_id=None, status="invalid_encoding")
-            send_command('X')
-            return {
-                "id": log.id,
-                "user_id": None,
-                "user_name": None,
-                "status": "invalid_encoding",
-                "timestamp": log.timestamp,
-                "message": "Invalid face encoding",
-                "face_image_url": face_image_url
-            }
-        users = crud.get_users(db)
-        valid_users = []
-        try:
-            users = crud.get_users(db)
-            user_encodings = []
-            user_id_map = {}
-            for u in users:
-                if u.face:
-                    encoding = validate_encoding(u.face.encoding)
-                    if encoding is not None:
-                        user_encodings.append(encoding)
-                        user_id_map[len(user_encodings)-1] = u
-            if not user_encodings:
-                log = crud.log_access(db, user_id=None, status="no_valid_users")
-                send_command('X')
-                return {
-                    "id": log.id,
-                    "user_id": None,
-                    "user_name": None,
-                    "status": "no_valid_users",
-                    "timestamp": log.timestamp,
-                    "message": "No valid user encodings available",
-                    "face_image_url": face_image_url
-                }
-            # Calculate distances
-            distances = face_recognition.face_distance(user_encodings, current_encoding)
-            print(f"[DEBUG] Face distances: {distances}")
-            if len(distances) > 0 and min(distances) < 0.4:
-                best_match_index = int(np.argmin(distances))
-                matched_user = user_id_map[best_match_index]
-                user_id = matched_user.id
-                user_name = matched_user.name
-                if getattr(matched_user, 'active', True):
-                    status = "granted"
-                    send_command('O')
-                    print(f"✅ Access granted for user {user_id}")
-                    log = crud.log_access(db, user_id=user_id, status="granted")
-                    return {
-                        "id": log.id,
-                        "user_id": user_id,
-                        "user_name": user_name,
-                        "status": status,
-                        "timestamp": log.timestamp,
-                        "message": f"Access granted to {user_name}",
-                        "face_image_url": face_image_url
-                    }
-                else:
-                    status = "denied"
-                    send_command('X')
-                    print(f"❌ Access denied - user {user_id} is inactive")
-                    log = crud.log_access(db, user_id=user_id, status=status, face_encoding=current_encoding.tobytes().hex() if current_encoding is not None else None)
-                    return {
-                        "id": log.id,
-                        "user_id": user_id,
-                        "user_name": user_name,
-                        "status": status,
-                        "timestamp": log.timestamp,
-                        "message": f"Access denied - user {user_name} is inactive",
-                        "face_image_url": face_image_url
-                    }
-            else:
-                user_id = None
-                status = "denied"
-                send_command('X')
-                print("❌ Access denied - no matching face")
-                log = crud.log_access(db, user_id=user_id, status=status, face_encoding=current_encoding.tobytes().hex() if current_encoding is not None else None)
-                return {
-                    "id": log.id,
-                    "user_id": user_id,
-                    "user_name": None,
-                    "status": status,
-                    "timestamp": log.timestamp,
-                    "message": "Access denied - face not recognized",
-                    "face_image_url": face_image_url
-                }
-        except Exception as e:
-            print(f"[ERROR] Failed to load encoding for user: {e}")
-            return {
-                "id": log.id,
-                "user_id": user_id, 
-                "user_name": None,
-                "status": status,
-                "timestamp": log.timestamp,
-                "message": "Access denied - face not recognized",
-                "face_image_url": face_image_url
-            }
-        
+        locations, encodings = await encoding_cache.detect_and_encode(contents, RECOGNIZE_DETECTOR)
+
+        # Save the face crop and picture for the log, off the event loop
+        face_image_url = await save_capture_async(contents, location=largest_face(locations)) if locations else None
+
+        gallery.ensure_loaded(db)
+        current_encoding = probe_encoding(encodings)
+        match = gallery.match(current_encoding) if current_encoding is not None else None
+        entry, command, user_name, message = decide_access(locations, encodings, current_encoding, match)
+        send_command(command)
+        log = await log_writer.log_async(db, **entry, face_image_url=face_image_url)
+        return recognition_result(log, user_name, message)
+
     except HTTPException:
         raise
     except Exception as e:
         print(f"Recognition error: {e}")
-        log = crud.log_access(db, user_id=None, status="error")
+        log = await log_writer.log_async(db, user_id=None, status="error")
         send_command('X')
-        return {
-            "id": log.id,
-            "user_id": None,
-            "user_name": None,
-            "status": "error",
-            "timestamp": log.timestamp,
-            "message": f"Recognition failed: {str(e)}",
-            "face_image_url": None
-        }
+        return recognition_result(log, None, f"Recognition failed: {str(e)}")
+
+
+def _too_many():
+    return HTTPException(status_code=413, detail=f"At most {RECOGNIZE_BATCH_MAX} images per batch")
+
+
+async def _read_batch(files: List[UploadFile]) -> List[bytes]:
+    """Read uploaded images in order, expanding any zip archive in name order.
+
+    Zip members are counted and sized from the archive's directory before
+    anything is decompressed, so an oversized archive is rejected up front.
+    """
+    images = []
+    for upload in files:
+        contents = await upload.read()
+        if not zipfile.is_zipfile(io.BytesIO(contents)):
+            if len(images) >= RECOGNIZE_BATCH_MAX:
+                raise _too_many()
+            images.append(contents)
+            continue
+        with zipfile.ZipFile(io.BytesIO(contents)) as archive:
+            members = sorted((info for info in archive.infolist() if not info.is_dir()),
+                             key=lambda info: info.filename)
+            if len(images) + len(members) > RECOGNIZE_BATCH_MAX:
+                raise _too_many()
+            for info in members:
+                if info.file_size > RECOGNIZE_IMAGE_MAX_BYTES:
+                    raise HTTPException(status_code=413,
+                                        detail=f"{info.filename} is larger than {RECOGNIZE_IMAGE_MAX_BYTES} bytes")
+            # Reads stop at the declared size, so the check above bounds memory
+            images.extend(archive.read(info) for info in members)
+    return images
+
+
+@router.post("/recognize/batch", response_model=List[schemas.RecognitionOut])
+async def recognize_batch(
+    files: List[UploadFile] = File(...),
+    db: Session = Depends(get_db),
+):
+    """Recognize a burst of images; results are returned in input order.
+
+    Detection runs as one pool job, all probes are matched in a single
+    matrix operation and every log row is written in one transaction. The
+    door gets a single command: open if any image was granted.
+    """
+    images = await _read_batch(files)
+    if not images:
+        raise HTTPException(status_code=400, detail="No images uploaded")
+
+    detections = await encoding_cache.detect_and_encode_batch(images, BATCH_DETECTOR)
+
+    gallery.ensure_loaded(db)
+    probes = [probe_encoding(encodings) for _, encodings in detections]
+    valid = [i for i, probe in enumerate(probes) if probe is not None]
+    matches = dict(zip(valid, gallery.match_many([probes[i] for i in valid]))) if valid else {}
+    decisions = [decide_access(locations, encodings, probes[i], matches.get(i))
+                 for i, (locations, encodings) in enumerate(detections)]
+
+    urls = await asyncio.gather(*[
+        save_capture_async(contents, location=largest_face(locations))
+        for contents, (locations, _) in zip(images, detections) if locations
+    ])
+    urls = iter(urls)
+    entries = [
+        dict(entry, face_image_url=next(urls) if locations else None)
+        for (locations, _), (entry, _, _, _) in zip(detections, decisions)
+    ]
+    logs = await log_writer.log_many_async(entries, db)
+    send_command('O' if any(entry["status"] == "granted" for entry in entries) else 'X')
+
+    return [recognition_result(log, user_name, message)
+            for log, (_, _, user_name, message) in zip(logs, decisions)]
 
 @router.get("/status")
 def camera_status():
     """Check camera status"""
     try:
-        cap = get_camera()
-        ret, frame = cap.read()
-        if ret:
+        frame = frame_hub.latest() if frame_hub.running else None
+        if frame is None:
+            frame = frame_hub.wait_for(0)
+        if frame is not None and frame_hub.error is None:
             return {
                 "status": "available", 
-                "camera_index": _camera_index,
-                "frame_size": f"{frame.shape[1]}x{frame.shape[0]}"
+                "camera_index": frame_hub.camera_index,
+                "frame_size": f"{frame.image.shape[1]}x{frame.image.shape[0]}"
             }
         else:
-            return {"status": "error", "message": "Cannot read from camera"}
+            return {"status": "error", "message": frame_hub.error or "Cannot read from camera"}
     except Exception as e:
         return {"status": "unavailable", "error": str(e)}
 
 @router.post("/restart")
 def restart_camera():
     """Restart camera connection"""
-    global _camera
     try:
-        if _camera:
-            _camera.release()
-        _camera = None
-        
-        #reinitialize
-        cap = get_camera()
+        frame_hub.restart()
+        #wait for the capture thread to come back
+        frame = frame_hub.wait_for(0)
+        if frame is None:
+            return {"status": "failed", "error": frame_hub.error or "Camera did not restart"}
         return {
             "status": "restarted", 
-            "camera_index": _camera_index,
+            "camera_index": frame_hub.camera_index,
             "message": "Camera restarted successfully"
         }
     except Exception as e:
         return {"status": "failed", "error": str(e)}
 
+@router.post("/recognition/start")
+def start_recognition():
+    """Start unattended recognition on the live camera"""
+    started = recognition_service.start()
+    return {"status": "started" if started else "already_running", **recognition_service.status()}
+
+@router.post("/recognition/stop")
+def stop_recognition():
+    """Stop unattended recognition"""
+    stopped = recognition_service.stop()
+    return {"status": "stopped" if stopped else "not_running", **recognition_service.status()}
+
+@router.get("/recognize/stats")
+def recognize_stats():
+    """Recognition pool load and encoding cache hit rates"""
+    return {"pool": recognition_pool.stats(), "encoding_cache": encoding_cache.stats()}
+
+@router.get("/door/status")
+def door_status():
+    """Connection, queue and acknowledgement counters of the door controller"""
+    return door.stats()
+
+@router.get("/recognition/status")
+def recognition_status():
+    """Counters and last decision of the recognition loop"""
+    return recognition_service.status()
+
 def cleanup_camera():
     """Clean up camera resources"""
-    global _camera
-    if _camera:
-        _camera.release()
-        _camera = None
-        print("Camera resources cleaned up")
+    recognition_service.stop()
+    frame_hub.stop()
@@ -0,0 +1,59 @@
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse
+from typing import Optional
+import os
+from ..media import FACES_DIR, MEDIA_THUMB_SIZES, content_key, ensure_thumbnail
+
+router = APIRouter()
+
+# Content-addressed files never change, so clients may keep them for good
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Legacy face_*.jpg names can be reused; clients revalidate with the ETag
+REVALIDATE = "no-cache"
+
+
+def _etag(relative_path: str, path: str, size: Optional[int]) -> str:
+    suffix = f"-{size}" if size else ""
+    key = content_key(relative_path)
+    if key:
+        return f'"{key}{suffix}"'
+    stat = os.stat(path)
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}{suffix}"'
+
+
+def _not_modified(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or etag in [tag[2:] if tag.startswith("W/") else tag for tag in tags]
+
+
+@router.api_route("/{path:path}", methods=["GET", "HEAD"])
+async def get_face_image(path: str, request: Request, size: Optional[int] = None):
+    """A stored face image, or with ?size= a thumbnail whose longest side
+    is at most that many pixels (made on first request and kept on disk)"""
+    relative_path = os.path.normpath(path)
+    if relative_path.startswith("..") or os.path.isabs(relative_path):
+        raise HTTPException(status_code=404, detail="Image not found")
+    if size is not None and size not in MEDIA_THUMB_SIZES:
+        raise HTTPException(status_code=400, detail=f"size must be one of {MEDIA_THUMB_SIZES}")
+
+    source = os.path.join(FACES_DIR, relative_path)
+    if not os.path.isfile(source):
+        raise HTTPException(status_code=404, detail="Image not found")
+    etag = _etag(relative_path, source, size)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": IMMUTABLE if content_key(relative_path) else REVALIDATE,
+    }
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    file_path = source
+    if size is not None:
+        file_path = await run_in_threadpool(ensure_thumbnail, relative_path, size)
+        if file_path is None:
+            raise HTTPException(status_code=404, detail="Image not found")
+    return FileResponse(file_path, media_type="image/jpeg", headers=headers)
@@ -1,60 +1,208 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List, Optional
-from ..database import get_db
-from .. import crud, schemas
+from datetime import datetime, timedelta
+from typing import List, Literal, Optional
+import csv
+import io
+import json
+import os
+from ..database import get_db, get_session_factory
+from .. import crud, rollup, schemas
+from ..archive import log_archive
+from ..events import LOG_STREAM_HEARTBEAT, log_bus
 
 router = APIRouter()
 
-@router.get("/", response_model=List[schemas.LogOut])
-def read_logs(skip: int = 0, limit: int = 100, status: Optional[str] = None,
+# Rows fetched per round trip and per chunk written to the client
+EXPORT_BATCH_SIZE = int(os.getenv("LOG_EXPORT_BATCH_SIZE", "1000"))
+EXPORT_COLUMNS = ["id", "timestamp", "status", "user_id", "user_name", "face_image_url"]
+
+
+def _archived_rows(rows, limit: int, status: Optional[str], cursor: Optional[str]):
+    """Archive rows following a short page of database rows.
+
+    Only continues from a row or a cursor: a `skip` past the end of the
+    database would need a count of the table and a scan of the archive.
+    """
+    if rows:
+        last = rows[-1][0]
+        return log_archive.read(limit - len(rows), status=status, before=(last.timestamp, last.id))
+    if cursor:
+        return log_archive.read(limit, status=status, before=crud.decode_log_cursor(cursor))
+    return []
+
+
+def _export_rows(session_factory, since, until, status, user_id):
+    """Archived then database rows, oldest first, read in batches.
+
+    Uses its own session, open for the whole stream: the request's session
+    is closed before the body is sent.
+    """
+    db = session_factory()
+    try:
+        archived_before = log_archive.archived_before()
+        if archived_before is not None and (since is None or since < archived_before):
+            for log, user_name in log_archive.iter_rows(since, until):
+                if (status and log.status != status) or (user_id is not None and log.user_id != user_id):
+                    continue
+                yield log, user_name
+
+        yield from crud.iter_logs(db, since=since, until=until, status=status, user_id=user_id,
+                                  batch_size=EXPORT_BATCH_SIZE)
+    finally:
+        db.close()
+
+
+def _export_record(log, user_name) -> dict:
+    return {
+        "id": log.id,
+        "timestamp": log.timestamp.isoformat(),
+        "status": log.status,
+        "user_id": log.user_id,
+        "user_name": user_name,
+        "face_image_url": log.face_image_url,
+    }
+
+
+def _stream_export(rows, fmt: str):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS) if fmt == "csv" else None
+    if writer is not None:
+        writer.writeheader()
+    pending = 0
+    for log, user_name in rows:
+        record = _export_record(log, user_name)
+        if writer is not None:
+            writer.writerow(record)
+        else:
+            buffer.write(json.dumps(record) + "\n")
+        pending += 1
+        if pending >= EXPORT_BATCH_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+@router.get("/export")
+def export_logs(format: Literal["csv", "ndjson"] = "csv", since: Optional[datetime] = None,
+                until: Optional[datetime] = None, status: Optional[str] = None,
+                user_id: Optional[int] = None, session_factory=Depends(get_session_factory)):
+    """Stream the full access history (archive included), oldest first.
+
+    Rows are fetched and written in batches, so memory stays flat however
+    many logs match.
+    """
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    filename = f"access_logs.{format}"
+    return StreamingResponse(
+        _stream_export(_export_rows(session_factory, since, until, status, user_id), format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+async def _live_events(sub, after_id: Optional[int], session_factory):
+    """Replayed events after after_id, then live ones; {} marks an idle heartbeat"""
+    while after_id is not None:
+        events, after_id = await run_in_threadpool(log_bus.replay, sub, after_id, session_factory)
+        for event in events:
+            yield event
+    while True:
+        event = await sub.next(LOG_STREAM_HEARTBEAT)
+        if event is None:
+            return
+        yield event
+
+
+@router.get("/stream")
+async def stream_logs(request: Request, status: Optional[List[str]] = Query(None),
+                      last_id: Optional[int] = None,
+                      last_event_id: Optional[int] = Header(None, alias="Last-Event-ID"),
+                      session_factory=Depends(get_session_factory)):
+    """Server-sent events for new logs, optionally filtered by status.
+
+    Pass last_id (or let the browser send Last-Event-ID) to receive the
+    logs missed while disconnected.
+    """
+    sub = log_bus.subscribe(status)
+    after_id = last_id if last_id is not None else last_event_id
+
+    async def events():
+        try:
+            async for event in _live_events(sub, after_id, session_factory):
+                if await request.is_disconnected():
+                    return
+                if not event:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"id: {event['id']}\nevent: log\ndata: {json.dumps(event)}\n\n"
+        finally:
+            log_bus.unsubscribe(sub)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.websocket("/ws")
+async def logs_websocket(websocket: WebSocket, status: Optional[List[str]] = Query(None),
+                         last_id: Optional[int] = None, session_factory=Depends(get_session_factory)):
+    """WebSocket flavour of /logs/stream: one JSON log per message"""
+    await websocket.accept()
+    sub = log_bus.subscribe(status)
+    try:
+        async for event in _live_events(sub, last_id, session_factory):
+            if event:
+                await websocket.send_json(event)
+        # Too slow to keep up; the client reconnects with last_id
+        await websocket.close(code=1013)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        log_bus.unsubscribe(sub)
+
+
+@router.get("/stats", response_model=schemas.LogStatsOut)
+def log_stats(since: Optional[datetime] = None, until: Optional[datetime] = None,
+              granularity: Literal["hour", "day"] = "day", top: int = 5,
               db: Session = Depends(get_db)):
-    logs = crud.get_logs(db, skip=skip, limit=limit, status=status)
+    """Counts per status over time and the most frequent users, from the
+    hourly rollup (default: the last 7 days)"""
+    until = until or datetime.utcnow()
+    since = since or until - timedelta(days=7)
+    return rollup.stats(db, since, until, granularity, top)
+
+
+@router.get("/", response_model=List[schemas.LogOut])
+def read_logs(response: Response, skip: int = 0, limit: int = 100, status: Optional[str] = None,
+              cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    """Newest-first logs. Pass the X-Next-Cursor header of one page as
+    `cursor` to fetch the next; `skip` is kept for older clients.
+
+    Pages that run past the oldest row in the database continue into the
+    log archive. With `skip`, only the page where the database ends does:
+    later skip-based pages are empty, follow the cursor from there instead.
+    """
+    try:
+        rows = crud.get_logs(db, skip=skip, limit=limit, status=status, cursor=cursor)
+        if len(rows) < limit and log_archive.has_data():
+            rows += _archived_rows(rows, limit, status, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if rows and len(rows) == limit:
+        response.headers["X-Next-Cursor"] = crud.encode_log_cursor(rows[-1][0])
     result = []
-    import os
-    from datetime import datetime, timedelta
-    import glob
-    faces_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "../media/faces"))
-    pattern = os.path.join(faces_dir, f"face_*.jpg")
-    face_files = sorted(glob.glob(pattern), key=os.path.getmtime, reverse=False)
-
-    def find_face_for_log(log):
-        if getattr(log, "face_image_url", None):
-            return log.face_image_url
-        log_time = getattr(log, "timestamp", None)
-        if not log_time or not face_files:
-            return None
-        try:
-            log_dt = log_time if isinstance(log_time, datetime) else datetime.fromisoformat(str(log_time))
-        except Exception:
-            return None
-
-        best_file = None
-        best_delta = timedelta.max
-        for f in face_files:
-            try:
-                mtime = datetime.fromtimestamp(os.path.getmtime(f))
-                delta = log_dt - mtime
-                if delta.total_seconds() >= 0 and delta < best_delta:
-                    best_delta = delta
-                    best_file = f
-            except Exception:
-                continue
-        if best_file:
-            return f"/media/faces/{os.path.basename(best_file)}"
-        return None
-
-    for log in logs:
-        log_dict = log.__dict__.copy()
-
-        # Attach user_name
-        if getattr(log, 'user_id', None) is not None:
-            user = db.query(crud.models.User).filter(crud.models.User.id == log.user_id).first()
-            log_dict["user_name"] = user.name if user else None
-        else:
-            log_dict["user_name"] = None
-            
-        # Attach face_image_url for this log only
-        log_dict["face_image_url"] = find_face_for_log(log)
-        result.append(schemas.LogOut(**log_dict))
+    for log, user_name in rows:
+        result.append(schemas.LogOut(
+            id=log.id,
+            user_id=log.user_id,
+            user_name=user_name,
+            status=log.status,
+            timestamp=log.timestamp,
+            face_image_url=log.face_image_url,
+        ))
     return result
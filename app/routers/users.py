@@ -1,16 +1,19 @@
 from fastapi import APIRouter, Depends, HTTPException, File, UploadFile, status
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-import io
-import face_recognition
-import numpy as np
 from ..database import get_db
-from .. import crud, schemas
+from .. import crud, enrollment, schemas
+from ..detection import detector_settings
+from ..encoding_cache import encoding_cache
 from typing import List
+import zipfile
 
 router = APIRouter()
 
 router = APIRouter()
 
+UPLOAD_DETECTOR = detector_settings("upload")
+
 @router.get("/", response_model=List[schemas.UserOut])
 def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     return crud.get_users(db, skip=skip, limit=limit)
@@ -22,6 +25,28 @@ def create_new_user(user_in: schemas.UserCreate, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail="User already exists")
     return crud.create_user(db, user=user_in)
 
+@router.post("/import", response_model=schemas.EnrollmentReport)
+def import_users(
+    file: UploadFile = File(...),
+    replace: bool = False,
+    db: Session = Depends(get_db),
+):
+    """Enroll everyone in a zip of name/*.jpg photos, creating users as
+    needed. Photos without exactly one face are skipped and reported.
+
+    For very large imports prefer `python -m app.enrollment`, which does not
+    hold a request open.
+    """
+    if not zipfile.is_zipfile(file.file):
+        raise HTTPException(status_code=400, detail="Upload a zip of name/*.jpg photos")
+    file.file.seek(0)
+    skipped = []
+    try:
+        photos = enrollment.zip_photos(file.file, skipped)
+    except ValueError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    return enrollment.enroll(db, photos, skipped, replace=replace)
+
 @router.put("/{user_id}", response_model=schemas.UserOut)
 def update_existing_user(
     user_id: int,
@@ -54,30 +79,49 @@ def delete_user(
 async def upload_face(
     user_id: int,
     file: UploadFile = File(...),
+    replace: bool = False,
     db: Session = Depends(get_db),
 ):
+    """Enroll a photo as another sample of the user's face; replace=true
+    discards the samples enrolled before.
+
+    Database and gallery work runs on the threadpool; only the upload and
+    the pool job are awaited on the event loop.
+    """
     # 1. Fetch user
-    db_user = crud.get_user(db, user_id)
+    db_user = await run_in_threadpool(crud.get_user, db, user_id)
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
 
     # 2. Read image & compute encoding
     contents = await file.read()
-    image = face_recognition.load_image_file(io.BytesIO(contents))
-    locs = face_recognition.face_locations(image)
+    locs, encodings = await encoding_cache.detect_and_encode(contents, UPLOAD_DETECTOR)
     if not locs:
         raise HTTPException(status_code=400, detail="No face detected in image")
-    encodings = face_recognition.face_encodings(image, locs)
-    encoding_blob = encodings[0].tobytes().hex()
+    encoding = encodings[0]
 
-    # 3. Save to Face table (overwriting if exists)
-    existing = crud.get_face_by_user(db, user_id=user_id)
-    if existing:
-        # update
-        existing.encoding = encoding_blob
-        db.commit()
-    else:
-        crud.create_face(db, user_id=user_id, encoding=encoding_blob)
-
-    # 4. Return the user
-    return db_user
\ No newline at end of file
+    # 3. Add to the user's samples, 4. return the user
+    return await run_in_threadpool(_add_face, db, db_user, encoding, replace)
+
+
+def _add_face(db: Session, db_user, encoding, replace: bool):
+    crud.create_face(db, user_id=db_user.id, encoding=encoding, replace=replace)
+    # Reload the attributes the commit expired, so the response is built without a query
+    db.refresh(db_user)
+    return db_user
+
+
+@router.get("/{user_id}/faces", response_model=List[schemas.FaceOut])
+def read_faces(user_id: int, db: Session = Depends(get_db)):
+    if not crud.get_user(db, user_id):
+        raise HTTPException(status_code=404, detail="User not found")
+    return crud.get_faces(db, user_id)
+
+
+@router.delete("/{user_id}/faces/{face_id}", status_code=status.HTTP_204_NO_CONTENT)
+def delete_face(user_id: int, face_id: int, db: Session = Depends(get_db)):
+    face = crud.get_face(db, user_id, face_id)
+    if not face:
+        raise HTTPException(status_code=404, detail="Face not found")
+    crud.delete_face(db, face)
+    return None
@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 from datetime import datetime
-from typing import Optional
+from typing import Dict, List, Optional
 
 class Token(BaseModel):
     access_token: str
@@ -28,6 +28,22 @@ class UserOut(UserBase):
     class Config:
         orm_mode = True
 
+class FaceOut(BaseModel):
+    id: int
+    user_id: int
+    class Config:
+        orm_mode = True
+
+class EnrollmentSkip(BaseModel):
+    file: str
+    reason: str
+
+class EnrollmentReport(BaseModel):
+    users_created: int
+    users_updated: int
+    faces_added: int
+    skipped: List[EnrollmentSkip]
+
 class LogOut(BaseModel):
     id: int
     user_id: Optional[int]
@@ -38,5 +54,25 @@ class LogOut(BaseModel):
     class Config:
         from_attributes = True
 
+class RecognitionOut(LogOut):
+    message: Optional[str] = None
+
+class LogStatsBucket(BaseModel):
+    period: datetime
+    counts: Dict[str, int]
+
+class TopUser(BaseModel):
+    user_id: int
+    user_name: Optional[str] = None
+    count: int
+
+class LogStatsOut(BaseModel):
+    since: datetime
+    until: datetime
+    granularity: str
+    totals: Dict[str, int]
+    series: List[LogStatsBucket]
+    top_users: List[TopUser]
+
 class TokenData(BaseModel):
     username: Optional[str] = None
\ No newline at end of file
@@ -1,18 +1,288 @@
-import serial
+"""Client for the door Arduino (smart_door.ino).
+
+The sketch handles one single-character command at a time and blocks while
+a sequence runs (5 s for O, 1 s for X, 10 s for B), printing
+``Received command: <c>`` when it reads one and a line ending in
+``complete.`` when it is done. DoorController keeps a queue on this side
+instead of in the board's buffer: a writer thread sends the next command
+only after the previous one completed, and a reader thread turns the
+sketch's output into acknowledgements.
+
+The port is opened by the writer thread once it is started (on the first
+command or at API startup) and reopened with backoff after errors, so
+importing this module never touches the hardware.
+"""
+import asyncio
+import os
 import threading
 import time
-import os
+from collections import deque
+from concurrent.futures import Future
+from typing import Optional
 
 SERIAL_PORT = os.getenv("SERIAL_PORT", "/dev/ttyACM0")
 BAUD_RATE = int(os.getenv("BAUD_RATE", "9600"))
+# Opening the port resets the board; longest wait for its ready banner
+DOOR_RESET_SECONDS = float(os.getenv("DOOR_RESET_SECONDS", "2"))
+# Upper bound for the delay between reconnection attempts
+DOOR_RECONNECT_MAX_SECONDS = float(os.getenv("DOOR_RECONNECT_MAX_SECONDS", "30"))
+# Commands still queued after this long are dropped (nobody is at the door any more)
+DOOR_COMMAND_TTL = float(os.getenv("DOOR_COMMAND_TTL", "10"))
+
+# Commands the sketch finishes with a "... complete." line, and how long to wait for it
+SEQUENCE_TIMEOUTS = {"O": 8.0, "X": 4.0, "B": 13.0}
+# Other commands are done once the sketch echoes them
+ECHO_TIMEOUT = 2.0
+READY_BANNER = "Arduino is ready."
+
+
+class DoorCommand:
+    def __init__(self, code: str):
+        self.code = code
+        self.future = Future()
+        self.created = time.monotonic()
+
+
+class DoorController:
+    """Queue of door commands with coalescing and acknowledgements.
+
+    A command identical to one that is queued or running shares its future
+    instead of being sent again, except that an O is only merged with a
+    queued O, never with one already running; a queued X is dropped once an
+    O is queued after it. Each future resolves to the outcome: "complete" or
+    "received" on success, otherwise "superseded", "expired", "timeout",
+    "disconnected" or "cancelled".
+    """
+
+    def __init__(self, port: str = SERIAL_PORT, baud_rate: int = BAUD_RATE, serial_factory=None):
+        self.port = port
+        self.baud_rate = baud_rate
+        self._serial_factory = serial_factory
+        self._cond = threading.Condition()
+        self._pending = deque()
+        self._current: Optional[DoorCommand] = None
+        self._serial = None
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._reader = None
+        self.sent = 0
+        self.completed = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.timeouts = 0
+        self.connects = 0
+        self.last_error = None
+
+    # Public API
+
+    def send(self, code: str) -> Future:
+        """Queue a command and return at once"""
+        with self._cond:
+            # A grant arriving while the door is already opening is queued:
+            # merged, the door would close on the person just recognized
+            candidates = self._pending if code == "O" else (self._current, *self._pending)
+            for command in candidates:
+                if command is not None and command.code == code and not command.future.done():
+                    self.coalesced += 1
+                    return command.future
+            if code == "O":
+                for stale in [c for c in self._pending if c.code == "X"]:
+                    self._pending.remove(stale)
+                    self._finish(stale, "superseded")
+            command = DoorCommand(code)
+            self._pending.append(command)
+            self._cond.notify_all()
+        self.start()
+        return command.future
+
+    async def send_async(self, code: str, wait: bool = True, timeout: Optional[float] = None) -> Optional[str]:
+        """send from a coroutine; with wait, the outcome once the sketch
+        reports back"""
+        future = self.send(code)
+        if not wait:
+            return None
+        # Shielded so a caller timing out doesn't cancel a shared command
+        return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="door-controller", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self._disconnect(None)
+        if self._reader is not None:
+            self._reader.join(timeout=5)
+            self._reader = None
+        with self._cond:
+            while self._pending:
+                self._finish(self._pending.popleft(), "cancelled")
+
+    @property
+    def connected(self) -> bool:
+        return self._serial is not None
+
+    def stats(self):
+        with self._cond:
+            return {
+                "port": self.port,
+                "connected": self.connected,
+                "current": self._current.code if self._current else None,
+                "pending": [c.code for c in self._pending],
+                "sent": self.sent,
+                "completed": self.completed,
+                "coalesced": self.coalesced,
+                "dropped": self.dropped,
+                "timeouts": self.timeouts,
+                "connects": self.connects,
+                "last_error": self.last_error,
+            }
+
+    # Connection
+
+    def _open(self):
+        if self._serial_factory is not None:
+            return self._serial_factory(self.port, self.baud_rate, timeout=1)
+        import serial
+        return serial.Serial(self.port, self.baud_rate, timeout=1)
+
+    def _connect(self) -> bool:
+        try:
+            port = self._open()
+        except Exception as e:
+            if self.last_error != str(e):
+                print(f"[WARNING] Door controller unavailable on {self.port}: {e}")
+            self.last_error = str(e)
+            return False
+        self._ready.clear()
+        with self._cond:
+            self._serial = port
+        self._reader = threading.Thread(target=self._read, args=(port,), name="door-reader", daemon=True)
+        self._reader.start()
+        self._ready.wait(DOOR_RESET_SECONDS)
+        self.connects += 1
+        self.last_error = None
+        print(f"[INFO] Door controller connected on {self.port}")
+        return True
+
+    def _disconnect(self, error: Optional[Exception], port=None):
+        with self._cond:
+            if self._serial is None or (port is not None and port is not self._serial):
+                return
+            port, self._serial = self._serial, None
+            if error is not None:
+                self.last_error = str(error)
+                print(f"[WARNING] Door controller disconnected: {error}")
+            self._cond.notify_all()
+        try:
+            port.close()
+        except Exception:
+            pass
+
+    # Threads
+
+    def _finish(self, command: DoorCommand, outcome: str):
+        """Resolve a command's future; call with the condition held"""
+        if command.future.done():
+            return
+        if outcome in ("complete", "received"):
+            self.completed += 1
+        elif outcome == "timeout":
+            self.timeouts += 1
+        else:
+            self.dropped += 1
+        command.future.set_result(outcome)
+
+    def _expire(self):
+        now = time.monotonic()
+        for command in [c for c in self._pending if now - c.created > DOOR_COMMAND_TTL]:
+            self._pending.remove(command)
+            self._finish(command, "expired")
+
+    def _run(self):
+        backoff = 1.0
+        while not self._stop.is_set():
+            if self._serial is None:
+                if not self._connect():
+                    self._stop.wait(backoff)
+                    backoff = min(backoff * 2, DOOR_RECONNECT_MAX_SECONDS)
+                    with self._cond:
+                        self._expire()
+                    continue
+                backoff = 1.0
+
+            with self._cond:
+                while not self._pending and self._serial is not None and not self._stop.is_set():
+                    self._cond.wait()
+                self._expire()
+                if not self._pending or self._serial is None or self._stop.is_set():
+                    continue
+                command = self._current = self._pending.popleft()
+                port = self._serial
+            try:
+                port.write(command.code.encode())
+                self.sent += 1
+            except Exception as e:
+                self._disconnect(e, port)
+                with self._cond:
+                    self._current = None
+                    self._pending.appendleft(command)
+                continue
+
+            deadline = time.monotonic() + SEQUENCE_TIMEOUTS.get(command.code, ECHO_TIMEOUT)
+            with self._cond:
+                while not command.future.done() and self._serial is port and not self._stop.is_set():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                self._finish(command, "timeout" if self._serial is port else "disconnected")
+                self._current = None
+        with self._cond:
+            if self._current is not None:
+                self._finish(self._current, "cancelled")
+                self._current = None
+
+    def _read(self, port):
+        while not self._stop.is_set() and self._serial is port:
+            try:
+                raw = port.readline()
+            except Exception as e:
+                self._disconnect(e, port)
+                return
+            if raw:
+                self._on_line(raw.decode("utf-8", errors="replace").strip())
+
+    def _on_line(self, line: str):
+        if line == READY_BANNER:
+            self._ready.set()
+            return
+        with self._cond:
+            command = self._current
+            if command is None:
+                return
+            if line.startswith("Received command:"):
+                if command.code not in SEQUENCE_TIMEOUTS and line.rsplit(":", 1)[1].strip() == command.code:
+                    self._finish(command, "received")
+            elif line.endswith("complete."):
+                self._finish(command, "complete")
+            self._cond.notify_all()
 
-ser = serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=1)
 
-time.sleep(2)
+door = DoorController()
 
-lock = threading.Lock()
 
-def send_command(cmd: str):
-    """Send single-character command to Arduino in a thread-safe way"""
-    with lock:
-        ser.write(cmd.encode())
\ No newline at end of file
+def send_command(cmd: str) -> Future:
+    """Queue a single-character command for the Arduino without blocking;
+    the returned future resolves once the sketch reports back"""
+    return door.send(cmd)
@@ -0,0 +1,133 @@
+import os
+from typing import List, Optional
+
+from .gallery import MATCH_THRESHOLD
+
+# Minimum IoU for a detection to continue an existing track
+TRACK_IOU_MATCH = float(os.getenv("TRACK_IOU_MATCH", "0.3"))
+# Re-encode a track once its box has moved this far (IoU with the box it was encoded at)
+TRACK_DRIFT_IOU = float(os.getenv("TRACK_DRIFT_IOU", "0.5"))
+# Ages below count processed frames, not seconds: frames skipped during a
+# decision's cooldown or by the motion gate don't age a track, so someone
+# standing still at the door keeps their decision instead of being
+# re-identified (and re-logged) after every pause.
+# Re-encode a track whose identity decision is this many processed frames old
+TRACK_MAX_AGE_FRAMES = int(os.getenv("TRACK_MAX_AGE_FRAMES", "6"))
+# Re-encode while the match distance is this close to the threshold
+TRACK_UNCERTAIN_MARGIN = float(os.getenv("TRACK_UNCERTAIN_MARGIN", "0.05"))
+# Forget tracks missing from more processed frames in a row than this; kept short
+# so someone stepping into the spot another person just left is identified afresh
+TRACK_LOST_FRAMES = int(os.getenv("TRACK_LOST_FRAMES", "2"))
+
+
+def iou(a, b) -> float:
+    """Intersection over union of two (top, right, bottom, left) boxes"""
+    top, bottom = max(a[0], b[0]), min(a[2], b[2])
+    left, right = max(a[3], b[3]), min(a[1], b[1])
+    inter = max(0, bottom - top) * max(0, right - left)
+    area_a = (a[2] - a[0]) * (a[1] - a[3])
+    area_b = (b[2] - b[0]) * (b[1] - b[3])
+    union = area_a + area_b - inter
+    return inter / union if union > 0 else 0.0
+
+
+class Track:
+    def __init__(self, track_id: int, box, frame: int):
+        self.id = track_id
+        self.box = box
+        self.last_seen = frame
+        self.encoded_box = None
+        self.encoded_at = None
+        self.decision = None           # decide_access() result for this face
+        self.distance: Optional[float] = None
+        self.changed = False           # decision differs from the previous one
+
+    @property
+    def key(self):
+        if self.decision is None:
+            return None
+        entry = self.decision[0]
+        return entry["status"], entry.get("user_id")
+
+
+class FaceTracker:
+    """Associates face boxes across frames so a face already identified is
+    not pushed through the encoder again on every frame.
+
+    Every update() is one processed frame; ages are counted in those.
+    """
+
+    def __init__(self, iou_match: float = TRACK_IOU_MATCH, drift_iou: float = TRACK_DRIFT_IOU,
+                 max_age: int = TRACK_MAX_AGE_FRAMES, uncertain_margin: float = TRACK_UNCERTAIN_MARGIN,
+                 lost_after: int = TRACK_LOST_FRAMES, threshold: float = MATCH_THRESHOLD):
+        self.iou_match = iou_match
+        self.drift_iou = drift_iou
+        self.max_age = max_age
+        self.uncertain_margin = uncertain_margin
+        self.lost_after = lost_after
+        self.threshold = threshold
+        self.reset()
+
+    def reset(self):
+        self.tracks: List[Track] = []
+        self._next_id = 1
+        self.frame = 0
+        self.encodes = 0
+        self.reuses = 0
+
+    def update(self, locations) -> List[Track]:
+        """Associate the next frame's boxes with tracks; returns the tracks seen"""
+        self.frame += 1
+        # Frames missed since each track was last seen
+        self.tracks = [t for t in self.tracks if self.frame - t.last_seen - 1 <= self.lost_after]
+        pairs = sorted(
+            ((iou(track.box, box), ti, bi)
+             for ti, track in enumerate(self.tracks) for bi, box in enumerate(locations)),
+            reverse=True,
+        )
+        assigned = {}
+        used_tracks = set()
+        for score, ti, bi in pairs:
+            if score < self.iou_match:
+                break
+            if ti in used_tracks or bi in assigned:
+                continue
+            assigned[bi] = self.tracks[ti]
+            used_tracks.add(ti)
+
+        seen = []
+        for bi, box in enumerate(locations):
+            track = assigned.get(bi)
+            if track is None:
+                track = Track(self._next_id, box, self.frame)
+                self._next_id += 1
+                self.tracks.append(track)
+            track.box = box
+            track.last_seen = self.frame
+            track.changed = False
+            seen.append(track)
+        return seen
+
+    def needs_encoding(self, track: Track) -> bool:
+        if track.decision is None or track.encoded_at is None:
+            return True
+        if self.frame - track.encoded_at > self.max_age:
+            return True
+        if iou(track.box, track.encoded_box) < self.drift_iou:
+            return True
+        return track.distance is not None and abs(track.distance - self.threshold) < self.uncertain_margin
+
+    def record(self, track: Track, decision, distance: Optional[float]):
+        previous = track.key
+        track.decision = decision
+        track.distance = distance
+        track.encoded_box = track.box
+        track.encoded_at = self.frame
+        track.changed = track.key != previous
+
+    def stats(self):
+        return {
+            "active_tracks": len(self.tracks),
+            "encodes": self.encodes,
+            "reuses": self.reuses,
+        }
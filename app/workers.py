@@ -0,0 +1,179 @@
+import asyncio
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+from .detection import DetectorSettings, detect_faces, detect_faces_batch
+
+# 0 runs recognition in a single background thread instead of processes
+RECOGNITION_WORKERS = int(os.getenv("RECOGNITION_WORKERS", str(os.cpu_count() or 1)))
+# Jobs allowed to wait for a free worker before requests are turned away
+RECOGNITION_QUEUE_SIZE = int(os.getenv("RECOGNITION_QUEUE_SIZE", "16"))
+# Images per dlib call when batched CNN detection applies
+BATCH_DETECTION_SIZE = int(os.getenv("BATCH_DETECTION_SIZE", "8"))
+
+
+class PoolBusy(HTTPException):
+    def __init__(self):
+        super().__init__(
+            status_code=503,
+            detail="Recognition workers are busy, retry shortly",
+            headers={"Retry-After": "1"},
+        )
+
+
+def _warm_up():
+    """Load the dlib models once per worker so the first job doesn't pay for it"""
+    import face_recognition
+    import numpy as np
+    blank = np.zeros((64, 64, 3), dtype=np.uint8)
+    face_recognition.face_locations(blank)
+    face_recognition.face_encodings(blank, [(8, 56, 56, 8)])
+
+
+def _ping():
+    return os.getpid()
+
+
+def detect_and_encode(contents: bytes, settings: DetectorSettings = DetectorSettings()):
+    """Decode an uploaded image and return (face locations, encodings)"""
+    import face_recognition
+    image = face_recognition.load_image_file(io.BytesIO(contents))
+    locations = detect_faces(image, settings)
+    encodings = face_recognition.face_encodings(image, locations) if locations else []
+    return locations, encodings
+
+
+def _decode_and_detect(images, settings: DetectorSettings):
+    """Decoded images (None if unreadable) and their face locations"""
+    import face_recognition
+    decoded = []
+    for contents in images:
+        try:
+            decoded.append(face_recognition.load_image_file(io.BytesIO(contents)))
+        except Exception as e:
+            print(f"[WARNING] Could not decode image in batch: {e}")
+            decoded.append(None)
+
+    readable = [image for image in decoded if image is not None]
+    found = iter(detect_faces_batch(readable, settings, batch_size=BATCH_DETECTION_SIZE))
+    return decoded, [next(found) if image is not None else [] for image in decoded]
+
+
+def detect_and_encode_batch(images, settings: DetectorSettings = DetectorSettings()):
+    """detect_and_encode for a list of images, results in input order"""
+    import face_recognition
+    decoded, all_locations = _decode_and_detect(images, settings)
+    results = []
+    for image, locations in zip(decoded, all_locations):
+        encodings = face_recognition.face_encodings(image, locations) if locations else []
+        results.append((locations, encodings))
+    return results
+
+
+def encode_for_enrollment(images, settings: DetectorSettings = DetectorSettings()):
+    """(faces found, encoding) per image, in input order. Only images with
+    exactly one face are encoded; unreadable images report -1 faces."""
+    import face_recognition
+    decoded, all_locations = _decode_and_detect(images, settings)
+    results = []
+    for image, locations in zip(decoded, all_locations):
+        if image is None:
+            results.append((-1, None))
+        elif len(locations) == 1:
+            results.append((1, face_recognition.face_encodings(image, locations)[0]))
+        else:
+            results.append((len(locations), None))
+    return results
+
+
+def detect_frame(image, settings: DetectorSettings = DetectorSettings()):
+    """Face locations in a BGR camera frame"""
+    import cv2
+    return detect_faces(cv2.cvtColor(image, cv2.COLOR_BGR2RGB), settings)
+
+
+def encode_frame(image, locations):
+    """Encodings for the given face locations in a BGR camera frame"""
+    import cv2
+    import face_recognition
+    return face_recognition.face_encodings(cv2.cvtColor(image, cv2.COLOR_BGR2RGB), locations)
+
+
+class RecognitionPool:
+    """Process pool for CPU-heavy dlib calls with a bounded backlog"""
+
+    def __init__(self, workers: int = RECOGNITION_WORKERS, queue_size: int = RECOGNITION_QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max(workers, 1) + queue_size)
+        self.in_flight = 0
+        self.rejected = 0
+
+    def start(self):
+        with self._lock:
+            if self._executor is not None:
+                return
+            if self.workers > 0:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_warm_up,
+                )
+                # Spawn and warm every worker now rather than on the first request
+                for _ in range(self.workers):
+                    self._executor.submit(_ping)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=1, initializer=_warm_up)
+            print(f"[INFO] Recognition pool started with {self.workers} worker(s)")
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        # Outside the lock: finishing and cancelled jobs release their slots through it
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _release(self, _future=None):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def submit(self, fn, *args) -> Future:
+        """Queue a job, raising PoolBusy when the backlog is full"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise PoolBusy()
+        # Counted before submitting: a fast job's callback may run before submit returns
+        with self._lock:
+            self.in_flight += 1
+        try:
+            self.start()
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    async def run(self, fn, *args):
+        """Run a job in the pool without blocking the event loop"""
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "in_flight": self.in_flight,
+            "rejected": self.rejected,
+        }
+
+
+recognition_pool = RecognitionPool()
@@ -0,0 +1,136 @@
+"""Concurrent access-log write/read throughput with and without the storage profile.
+
+Each run gets a fresh SQLite file seeded with --rows logs. Writer threads
+insert one log per transaction (the API's synchronous path) while reader
+threads page through GET /logs' query; "baseline" is a bare engine without
+the log indexes, "tuned" applies the pragmas and indexes from app.database
+and app.models.
+
+Usage: python benchmarks/bench_db.py [--rows 200000] [--seconds 5] [--writers 2] [--readers 4]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+from sqlalchemy import insert
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from app import crud, models
+from app.database import Base, create_db_engine
+
+STATUSES = ["granted", "denied", "no_face", "error"]
+
+
+def seed(engine, rows, users=50):
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), [{"id": i, "name": f"user{i}", "active": True}
+                                           for i in range(1, users + 1)])
+        start = datetime(2024, 1, 1)
+        batch = []
+        for i in range(rows):
+            batch.append({
+                "user_id": random.randint(1, users) if i % 3 else None,
+                "status": random.choice(STATUSES),
+                "timestamp": start + timedelta(seconds=30 * i),
+            })
+            if len(batch) == 10000:
+                conn.execute(insert(models.AccessLog), batch)
+                batch = []
+        if batch:
+            conn.execute(insert(models.AccessLog), batch)
+
+
+def make_engine(path, tuned):
+    engine = create_db_engine(f"sqlite:///{path}", tuned=tuned)
+    if tuned:
+        Base.metadata.create_all(engine)
+    else:
+        # Same schema without the access_logs indexes
+        indexes = set(models.AccessLog.__table__.indexes)
+        models.AccessLog.__table__.indexes.clear()
+        try:
+            Base.metadata.create_all(engine)
+        finally:
+            models.AccessLog.__table__.indexes.update(indexes)
+    return engine
+
+
+def run(engine, seconds, writers, readers):
+    stop = threading.Event()
+    writes = []
+    reads = []
+    errors = []
+
+    def writer():
+        count = 0
+        while not stop.is_set():
+            try:
+                with Session(engine) as db:
+                    crud.log_access(db, user_id=random.randint(1, 50), status=random.choice(STATUSES))
+                count += 1
+            except OperationalError as e:  # "database is locked"
+                errors.append(e)
+        writes.append(count)
+
+    def reader():
+        latencies = []
+        while not stop.is_set():
+            start = time.perf_counter()
+            with Session(engine) as db:
+                rows = crud.get_logs(db, limit=50, status=random.choice(STATUSES))
+                if rows:
+                    # Next page through the keyset cursor, like a scrolling client
+                    crud.get_logs(db, limit=50, cursor=crud.encode_log_cursor(rows[-1][0]))
+            latencies.append(time.perf_counter() - start)
+        reads.append(latencies)
+
+    threads = [threading.Thread(target=writer) for _ in range(writers)]
+    threads += [threading.Thread(target=reader) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    latencies = np.concatenate([np.array(r) for r in reads]) if reads else np.zeros(1)
+    return {
+        "writes_per_s": sum(writes) / seconds,
+        "reads_per_s": len(latencies) / seconds,
+        "read_p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "read_p99_ms": float(np.percentile(latencies, 99) * 1000),
+        "lock_errors": len(errors),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--readers", type=int, default=4)
+    args = parser.parse_args()
+
+    print(f"{'profile':<10}{'writes/s':>10}{'reads/s':>10}{'read p50 ms':>13}{'read p99 ms':>13}{'locked':>8}")
+    for profile in ("baseline", "tuned"):
+        random.seed(0)
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = make_engine(os.path.join(tmp, "bench.db"), tuned=profile == "tuned")
+            seed(engine, args.rows)
+            result = run(engine, args.seconds, args.writers, args.readers)
+            engine.dispose()
+        print(f"{profile:<10}{result['writes_per_s']:>10.0f}{result['reads_per_s']:>10.0f}"
+              f"{result['read_p50_ms']:>13.2f}{result['read_p99_ms']:>13.2f}{result['lock_errors']:>8}")
+
+
+if __name__ == "__main__":
+    main()
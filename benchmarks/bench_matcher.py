@@ -0,0 +1,76 @@
+"""Recall and latency of the approximate matcher against the exact scan.
+
+Usage: python benchmarks/bench_matcher.py [--sizes 1000 10000 100000] [--probes 500]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import numpy as np
+
+from app.matching import ExactMatcher, IVFMatcher
+
+
+def synthetic_gallery(n, dim=128, seed=0):
+    """Identities drawn around a few hundred cluster centres, roughly the
+    spread of dlib encodings (unrelated people ~0.8-1.0 apart)."""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(scale=0.05, size=(256, dim))
+    owners = rng.integers(0, len(centres), n)
+    return (centres[owners] + rng.normal(scale=0.045, size=(n, dim))).astype(np.float32)
+
+
+def make_probes(gallery, count, noise=0.025, seed=1):
+    rng = np.random.default_rng(seed)
+    targets = rng.integers(0, len(gallery), count)
+    return gallery[targets] + rng.normal(scale=noise, size=(count, gallery.shape[1])).astype(np.float32)
+
+
+def timed_search(matcher, probes):
+    latencies = np.empty(len(probes))
+    found = np.empty(len(probes), dtype=np.int64)
+    for i, probe in enumerate(probes):
+        start = time.perf_counter()
+        idx, _ = matcher.search_one(probe, 1)
+        latencies[i] = time.perf_counter() - start
+        found[i] = idx[0]
+    return found, latencies
+
+
+def report(label, found, truth, latencies, build_time=None):
+    recall = float(np.mean(found == truth))
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+    build = f"  build {build_time:6.2f}s" if build_time is not None else ""
+    print(f"  {label:<18} recall@1 {recall:6.3f}  p50 {p50:7.3f} ms  p99 {p99:7.3f} ms{build}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--probes", type=int, default=500)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    for n in args.sizes:
+        gallery = synthetic_gallery(n)
+        probes = make_probes(gallery, args.probes)
+        print(f"N = {n}")
+        exact = ExactMatcher(gallery)
+        truth, latencies = timed_search(exact, probes)
+        report("exact", truth, truth, latencies)
+
+        start = time.perf_counter()
+        ivf = IVFMatcher(gallery)
+        build_time = time.perf_counter() - start
+        for nprobe in args.nprobe:
+            ivf.n_probe = min(nprobe, len(ivf.centroids))
+            found, latencies = timed_search(ivf, probes)
+            report(f"ivf nprobe={ivf.n_probe}", found, truth, latencies,
+                   build_time if nprobe == args.nprobe[0] else None)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,23 @@
+# Keypress-driven recognition for local debugging. The API runs the same
+# loop unattended (POST /camera/recognition/start); don't run both at once,
+# they would compete for the camera and the serial port.
 import cv2
 import face_recognition
 import numpy as np
-import serial
 import time
 from sqlalchemy.orm import Session
 
+from app import crud
 from app.database import SessionLocal
-from app.models import User, Face, AccessLog
+from app.models import User
+from app.detection import detect_faces, detector_settings
+from app.encoding import unpack
+from app.gallery import gallery
+from app.log_writer import log_writer
+from app.serial_bridge import door
 
 
 
-# Initialize Serial for Arduino
-try:
-    arduino = serial.Serial("/dev/ttyACM0", 9600, timeout=1)
-    time.sleep(2)
-except serial.SerialException as e:
-    print(f"Error initializing serial port: {e}")
-    arduino = None
 
 def find_available_camera():
     """Find the first available camera index"""
@@ -33,16 +34,17 @@ def find_available_camera():
 
 cap, camera_index = find_available_camera()
 failed_attempts = 0
+REGISTER_DETECTOR = detector_settings("register")
+LIVE_DETECTOR = detector_settings("live")
 
 def clear_invalid_encodings():
     print("[INFO] clear_invalid_encodings() not implemented. No action taken.")
 
-# validate encoding (hex format)
+# validate encoding (stored blob or computed vector)
 def validate_encoding(encoding_data, expected_dim=128):
     try:
-        if isinstance(encoding_data, str):
-            encoding_bytes = bytes.fromhex(encoding_data)
-            encoding = np.frombuffer(encoding_bytes, dtype=np.float64)
+        if isinstance(encoding_data, (str, bytes)):
+            encoding = unpack(encoding_data).astype(np.float64)
         else:
             encoding = np.array(encoding_data, dtype=np.float64)
         if encoding.shape[0] == expected_dim:
@@ -59,55 +61,45 @@ def validate_encoding(encoding_data, expected_dim=128):
         print(f"[ERROR] Failed to validate encoding: {e}")
         return None
 
-# log access (API-compatible)
+# User ids by name, so logging doesn't query the users table per event
+user_ids = {}
+
+def user_id_for(name):
+    if name in ["Unknown", "None"]:
+        return None
+    if name not in user_ids:
+        db: Session = SessionLocal()
+        try:
+            user = db.query(User).filter(User.name == name).first()
+            if not user:
+                user = User(name=name, active=True)
+                db.add(user)
+                db.commit()
+                db.refresh(user)
+            user_ids[name] = user.id
+        finally:
+            db.close()
+    return user_ids[name]
+
+# log access (API-compatible); rows are written in batches by log_writer
 def log_access(name, status, face_encoding=None):
-    db: Session = SessionLocal()
-    try:
-        user = db.query(User).filter(User.name == name).first()
-        if not user and name not in ["Unknown", "None"]:
-            user = User(name=name, active=True)
-            db.add(user)
-            db.commit()
-            db.refresh(user)
-        log = AccessLog(user_id=user.id if user else None, status=status, face_encoding=face_encoding)
-        db.add(log)
-        db.commit()
-    finally:
-        db.close()
+    log_writer.log(user_id=user_id_for(name), status=status, face_encoding=face_encoding)
 
 def load_faces():
+    """Load the gallery: memory-mapped from the snapshot the API writes when
+    it matches the database, otherwise in one joined query"""
     db: Session = SessionLocal()
     try:
-        faces = db.query(Face).all()
-        names = []
-        encodings = []
-        print(f"[DEBUG] Found {len(faces)} faces in database")
-        for face in faces:
-            try:
-                if face.user is None:
-                    print(f"[WARNING] Skipping face id={face.id} with missing user (orphaned face record)")
-                    continue
-                encoding = validate_encoding(face.encoding)
-                if encoding is not None:
-                    names.append(face.user.name)
-                    encodings.append(encoding)
-                    print(f"[DEBUG] Loaded face for {face.user.name}")
-                else:
-                    print(f"[WARNING] Skipping invalid encoding for {face.user.name}")
-            except Exception as e:
-                user_name = face.user.name if face.user else f"<no user, face id={face.id}>"
-                print(f"[ERROR] Failed to load face for {user_name}: {e}")
-        return names, encodings
+        gallery.load(db)
+        print(f"[DEBUG] Loaded {gallery.sample_count} faces for {len(gallery)} users")
     finally:
         db.close()
 
-# Initialize known_names and known_faces
-known_names, known_faces = load_faces()
+load_faces()
 
 
 # Register a New Face with proper encoding
 def register_new_face(name):
-    global known_names, known_faces
     if cap is None:
         print("[ERROR] No camera available. Cannot register new face.")
         return False
@@ -118,23 +110,23 @@ def register_new_face(name):
             print(f"Failed to read frame on attempt {attempt + 1}")
             continue
         rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        face_locations = face_recognition.face_locations(rgb_frame)
+        face_locations = detect_faces(rgb_frame, REGISTER_DETECTOR)
         face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
         if face_encodings:
             encoding = face_encodings[0]
             print(f"[DEBUG] New encoding shape: {encoding.shape}")
             encoding = np.array(encoding, dtype=np.float64)
-            encoding_hex = encoding.tobytes().hex()
             db: Session = SessionLocal()
             try:
-                user = User(name=name, active=True)
-                db.add(user)
-                db.commit()
-                db.refresh(user)
-                face = Face(user_id=user.id, encoding=encoding_hex)
-                db.add(face)
-                db.commit()
-                known_names, known_faces = load_faces()
+                # Registering an existing name adds another sample for that user
+                user = db.query(User).filter(User.name == name).first()
+                if user is None:
+                    user = User(name=name, active=True)
+                    db.add(user)
+                    db.commit()
+                    db.refresh(user)
+                # Also updates the gallery and its snapshot for the API
+                crud.create_face(db, user_id=user.id, encoding=encoding)
                 print(f"✅ Face registered successfully for {name}!")
                 return True
             except Exception as e:
@@ -152,64 +144,50 @@ def register_new_face(name):
     return False
 
 def process_detection(frame):
-    global failed_attempts, known_names, known_faces
+    global failed_attempts
     if cap is None:
         print("[ERROR] No camera available. Cannot process detection.")
         return
     print("Processing detection...")
     rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-    face_locations = face_recognition.face_locations(rgb_frame)
+    face_locations = detect_faces(rgb_frame, LIVE_DETECTOR)
     face_encodings = face_recognition.face_encodings(rgb_frame, face_locations)
     print(f"[DEBUG] Detected {len(face_locations)} face(s)")
     if len(face_locations) == 0:
         print("No face detected")
-        if arduino:
-            arduino.write(b'X')
+        door.send('X')
         log_access("None", "No Object Detected")
         failed_attempts += 1
         print(f"Failed attempts: {failed_attempts}")
         if failed_attempts >= 3:
             print("3 consecutive failed attempts detected. Sending buzzer alert command.")
-            if arduino:
-                arduino.write(b'B')
+            door.send('B')
             failed_attempts = 0
         return
     known_face_found = False
+    # Pick up faces enrolled through the API since the last detection
+    gallery.refresh()
     # Process each detected face
     for face_encoding, (top, right, bottom, left) in zip(face_encodings, face_locations):
         print(f"[DEBUG] Current face encoding shape: {face_encoding.shape}")
-        if known_faces:
+        if len(gallery):
             try:
                 # Ensure all encodings have the same shape
                 face_encoding = validate_encoding(face_encoding)
                 if face_encoding is None:
                     print("[ERROR] Invalid face encoding detected")
                     continue
-                # Validate known faces shapes
-                valid_known_faces = []
-                valid_known_names = []
-                for i, known_encoding in enumerate(known_faces):
-                    validated = validate_encoding(known_encoding)
-                    if validated is not None and validated.shape == face_encoding.shape:
-                        valid_known_faces.append(validated)
-                        valid_known_names.append(known_names[i])
-                if not valid_known_faces:
-                    print("[WARNING] No valid known faces to compare against")
+                match = gallery.match(face_encoding)
+                if match is not None:
+                    print(f"[DEBUG] Best face distance: {match.distance:.3f}")
+                    name = match.name
+                    status = "Granted"
+                    known_face_found = True
+                    print(f"✅ Access Granted: {name}")
+                else:
                     name = "Unknown"
                     status = "Denied"
-                else:
-                    distances = face_recognition.face_distance(valid_known_faces, face_encoding)
-                    print(f"[DEBUG] Face distances: {distances}")
-                    best_match_index = np.argmin(distances)
-                    if distances[best_match_index] < 0.4:
-                        name = valid_known_names[best_match_index]
-                        status = "Granted"
-                        known_face_found = True
-                        print(f"✅ Access Granted: {name}")
-                    else:
-                        name = "Unknown"
-                        status = "Denied"
-                        print("❌ Access Denied!")
+                    print("❌ Access Denied!")
                 log_access(name, status)
             except Exception as e:
                 print(f"[ERROR] Face comparison failed: {e}")
@@ -228,19 +206,16 @@ def process_detection(frame):
     if known_face_found:
         failed_attempts = 0
         print("Sending unlock command to Arduino.")
-        if arduino:
-            arduino.write(b'O')
+        door.send('O')
         time.sleep(6)
     else:
         failed_attempts += 1
         print("Sending access denied command to Arduino.")
-        if arduino:
-            arduino.write(b'X')
+        door.send('X')
         print(f"Failed attempts: {failed_attempts}")
         if failed_attempts >= 3:
             print("3 consecutive failed attempts detected. Sending buzzer alert command.")
-            if arduino:
-                arduino.write(b'B')
+            door.send('B')
             failed_attempts = 0
     cv2.imshow("Face Recognition Door", frame)
 
@@ -255,6 +230,7 @@ if cap is None:
     print("[ERROR] No camera found. Exiting.")
     exit(1)
 
+log_writer.start()
 try:
     while True:
         ret, frame = cap.read()
@@ -274,13 +250,13 @@ try:
         elif key == ord('c'):
             print("Clearing invalid encodings...")
             clear_invalid_encodings()
-            known_names, known_faces = load_faces()
+            load_faces()
 except KeyboardInterrupt:
     print("\nShutting down...")
 finally:
     if cap is not None:
         cap.release()
     cv2.destroyAllWindows()
-    if arduino:
-        arduino.close()
+    log_writer.stop()
+    door.stop()
     print("Cleanup completed.")
@@ -1,17 +1,31 @@
-import sys, os
+import sys, os, atexit, shutil, tempfile
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+# Keep the app away from the repo's face_access.db and data directories: the
+# settings are read when app modules are first imported, which is below
+_scratch = tempfile.mkdtemp(prefix="faser-tests-")
+atexit.register(shutil.rmtree, _scratch, ignore_errors=True)
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_scratch, 'face_access.db')}"
+os.environ["GALLERY_SNAPSHOT_DIR"] = os.path.join(_scratch, "gallery_snapshot")
+os.environ["LOG_ARCHIVE_DIR"] = os.path.join(_scratch, "log_archive")
+os.environ["LOG_SPILL_PATH"] = os.path.join(_scratch, "log_spill.ndjson")
+os.environ["MEDIA_ROOT"] = os.path.join(_scratch, "media")
+
 
 
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from app.database import Base, get_db
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import StaticPool
+from app.database import Base, get_db, get_session_factory
+from app.events import log_bus
 from app.main import app
 
 # Use an in-memory SQLite database for testing
-test_engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False})
+# StaticPool: one shared connection, so the TestClient's threads see the same database
+test_engine = create_engine("sqlite:///:memory:", connect_args={"check_same_thread": False},
+                            poolclass=StaticPool)
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=test_engine)
 
 @ pytest.fixture(scope="session", autouse=True)
@@ -20,6 +34,16 @@ def initialize_db():
     yield
     Base.metadata.drop_all(bind=test_engine)
 
+@ pytest.fixture(autouse=True)
+def empty_tables():
+    """Each test starts from empty tables in the API's test database, and
+    a log bus that remembers none of the previous test's events"""
+    yield
+    with test_engine.begin() as conn:
+        for table in reversed(Base.metadata.sorted_tables):
+            conn.execute(table.delete())
+    log_bus.clear()
+
 @ pytest.fixture()
 def db_override():
     try:
@@ -36,5 +60,21 @@ def override_get_db():
     finally:
         db.close()
 
+@ pytest.fixture()
+def db_engine(tmp_path):
+    """A database file with every table, for tests that drive the data layer
+    directly rather than through the API"""
+    # A short busy timeout, so a locked database fails fast
+    engine = create_engine(f"sqlite:///{tmp_path / 'app.db'}", connect_args={"timeout": 0.1})
+    Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+@ pytest.fixture()
+def db_session(db_engine):
+    with Session(db_engine) as db:
+        yield db
+
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_session_factory] = lambda: TestingSessionLocal
 client = TestClient(app)
\ No newline at end of file
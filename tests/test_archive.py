@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import archive as archive_module
+from app import models
+from app.archive import LogArchive
+
+
+def test_archive_moves_old_rows_and_reads_them_back_newest_first(tmp_path, db_session):
+    start = datetime(2024, 1, 20)
+    db = db_session
+    db.add(models.User(id=1, name="alice"))
+    db.add_all([models.AccessLog(id=i + 1, user_id=1 if i % 2 else None,
+                                 status="granted" if i % 2 else "denied",
+                                 timestamp=start + timedelta(days=3 * i))
+                for i in range(10)])
+    db.commit()
+
+    archive = LogArchive(str(tmp_path / "archive"))
+    cutoff = start + timedelta(days=15)
+    assert archive.archive(db, cutoff) == 5
+    assert db.query(models.AccessLog).count() == 5
+    assert archive.archived_before() == cutoff
+    assert sorted(archive.manifest()["partitions"]) == ["2024-01", "2024-02"]
+    assert archive.archive(db, cutoff) == 0
+
+    rows = archive.read(limit=10)
+    assert [log.id for log, _ in rows] == [5, 4, 3, 2, 1]
+    assert [name for _, name in archive.read(limit=10, status="granted")] == ["alice", "alice"]
+    before = (rows[1][0].timestamp, rows[1][0].id)
+    assert [log.id for log, _ in archive.read(limit=2, before=before)] == [3, 2]
+
+
+def test_interrupted_run_is_resumed_without_duplicates(tmp_path, monkeypatch, db_session):
+    start = datetime(2024, 1, 20)
+    db = db_session
+    db.add_all([models.AccessLog(id=i + 1, status="denied", timestamp=start + timedelta(days=3 * i))
+                for i in range(10)])
+    db.commit()
+
+    archive = LogArchive(str(tmp_path / "archive"))
+    cutoff = start + timedelta(days=15)
+    written = []
+
+    def crash_on_fourth(log, user_name):
+        if len(written) == 3:
+            raise RuntimeError("power cut")
+        written.append(log.id)
+        return archive_module_to_record(log, user_name)
+
+    archive_module_to_record = archive_module._to_record
+    monkeypatch.setattr(archive_module, "_to_record", crash_on_fourth)
+    with pytest.raises(RuntimeError):
+        archive.archive(db, cutoff)
+    monkeypatch.undo()
+    assert archive.manifest()["pending_cutoff"] == cutoff.isoformat()
+
+    # The crash also tore the end of the file being written
+    path = tmp_path / "archive" / "access_logs-2024-01.ndjson.gz"
+    path.write_bytes(path.read_bytes()[:-10])
+
+    assert 2 <= archive.archive(db, cutoff) <= 5
+    assert db.query(models.AccessLog).count() == 5
+
+    assert [log.id for log, _ in archive.read(limit=10)] == [5, 4, 3, 2, 1]
+    partitions = archive.manifest()["partitions"]
+    assert {month: info["rows"] for month, info in partitions.items()} == {"2024-01": 4, "2024-02": 1}
+    assert archive.manifest()["pending_cutoff"] is None
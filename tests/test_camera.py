@@ -9,3 +9,65 @@ def test_stream_endpoint():
     response = client.get("/camera/stream")
     assert response.status_code == 200
     assert response.headers["content-type"].startswith("multipart/x-mixed-replace")
+
+
+def test_recognize_returns_503_with_retry_after_when_pool_is_busy(monkeypatch):
+    from app.workers import PoolBusy, recognition_pool
+
+    def busy(*args):
+        raise PoolBusy()
+
+    monkeypatch.setattr(recognition_pool, "submit", busy)
+    response = client.post("/camera/recognize", files={"file": ("busy.jpg", b"not cached yet: pool busy", "image/jpeg")})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+
+def _zip(members):
+    import io
+    import zipfile
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def test_recognize_batch_expands_zips_in_name_order(monkeypatch):
+    from app.routers import camera
+    seen, commands = [], []
+
+    async def no_faces(images, settings):
+        seen.extend(images)
+        return [([], []) for _ in images]
+
+    monkeypatch.setattr(camera.encoding_cache, "detect_and_encode_batch", no_faces)
+    monkeypatch.setattr(camera, "send_command", commands.append)
+    archive = _zip({"b.jpg": b"second", "a.jpg": b"first", "dir/": b""})
+    response = client.post("/camera/recognize/batch", files=[
+        ("files", ("burst.zip", archive, "application/zip")),
+        ("files", ("c.jpg", b"third", "image/jpeg")),
+    ])
+    assert response.status_code == 200
+    assert seen == [b"first", b"second", b"third"]
+    assert [result["status"] for result in response.json()] == ["no_face"] * 3
+    assert commands == ["X"]
+
+
+def test_recognize_batch_rejects_oversized_zips_before_reading_them(monkeypatch):
+    import zipfile
+    from app.routers import camera
+
+    def never(*args, **kwargs):
+        raise AssertionError("zip member decompressed")
+
+    monkeypatch.setattr(zipfile.ZipFile, "read", never)
+    monkeypatch.setattr(camera, "RECOGNIZE_BATCH_MAX", 2)
+    too_many = _zip({f"{i}.jpg": b"x" for i in range(3)})
+    response = client.post("/camera/recognize/batch", files=[("files", ("many.zip", too_many, "application/zip"))])
+    assert response.status_code == 413
+
+    monkeypatch.setattr(camera, "RECOGNIZE_IMAGE_MAX_BYTES", 1024)
+    bomb = _zip({"bomb.jpg": b"\0" * 4096})
+    response = client.post("/camera/recognize/batch", files=[("files", ("bomb.zip", bomb, "application/zip"))])
+    assert response.status_code == 413
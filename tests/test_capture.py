@@ -0,0 +1,52 @@
+import time
+
+import numpy as np
+
+from app.capture import FrameHub
+
+
+class FakeCamera:
+    def __init__(self):
+        self.opened = 0
+        self.released = 0
+
+    def open(self):
+        self.opened += 1
+        return self, 0
+
+    def read(self):
+        time.sleep(0.01)
+        return True, np.zeros((48, 64, 3), dtype=np.uint8)
+
+    def release(self):
+        self.released += 1
+
+
+def _wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_capture_stops_when_the_last_consumer_leaves():
+    camera = FakeCamera()
+    hub = FrameHub(idle_seconds=0.1, open_camera=camera.open)
+    try:
+        with hub.consumer(), hub.viewer():
+            first = hub.wait_for(0)
+            assert first is not None
+            time.sleep(0.3)  # consumers keep it running past the idle timeout
+            assert hub.running and camera.released == 0
+            assert hub.wait_for(first.seq).jpeg is not None
+
+        assert _wait_until(lambda: not hub.running)
+        assert camera.released == 1
+
+        # A one-off read reopens the camera and lets it go again
+        assert hub.wait_for(0) is not None
+        assert camera.opened == 2
+        assert _wait_until(lambda: not hub.running)
+        assert camera.released == 2
+    finally:
+        hub.stop()
@@ -0,0 +1,17 @@
+from sqlalchemy import text
+
+from app.database import create_db_engine
+
+
+def test_sqlite_profile_applies_pragmas(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'profile.db'}", tuned=True)
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1  # NORMAL
+        assert conn.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+
+
+def test_bare_engine_keeps_driver_defaults(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'plain.db'}", tuned=False)
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "delete"
@@ -0,0 +1,11 @@
+from app.detection import DetectorSettings, detection_factor, rescale_locations
+
+
+def test_boxes_are_mapped_back_to_full_resolution():
+    settings = DetectorSettings(max_edge=1000)
+    shape = (3000, 4000, 3)
+    factor = detection_factor(shape, settings)
+    assert factor == 0.25
+    assert rescale_locations([(100, 300, 200, 50)], factor, shape) == [(400, 1200, 800, 200)]
+    # small images are left alone
+    assert detection_factor((480, 640, 3), settings) == 1.0
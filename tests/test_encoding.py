@@ -0,0 +1,12 @@
+import numpy as np
+from app.encoding import pack, unpack
+
+
+def test_pack_roundtrip_and_legacy_hex():
+    vector = np.linspace(-1, 1, 128)
+    blob = pack(vector)
+    assert len(blob) == 4 + 128 * 4
+    assert np.allclose(unpack(blob), vector, atol=1e-6)
+
+    legacy = vector.tobytes().hex()
+    assert np.array_equal(unpack(legacy), vector)
@@ -0,0 +1,73 @@
+import asyncio
+
+import numpy as np
+
+from app.detection import DetectorSettings
+from app.encoding_cache import EncodingCache
+
+
+class CountingPool:
+    def __init__(self):
+        self.calls = 0
+
+    async def run(self, fn, contents, settings):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        if isinstance(contents, list):
+            return [([(0, 10, 10, 0)], [np.full(128, len(c), dtype=np.float64)]) for c in contents]
+        return [(0, 10, 10, 0)], [np.full(128, len(contents), dtype=np.float64)]
+
+
+def test_repeated_images_skip_the_pool(tmp_path):
+    pool = CountingPool()
+    cache = EncodingCache(size=2, directory=str(tmp_path))
+    settings = DetectorSettings()
+
+    async def scenario():
+        # Concurrent retries of one upload share a single job
+        first = await asyncio.gather(*[cache.detect_and_encode(b"photo", settings, pool) for _ in range(3)])
+        again = await cache.detect_and_encode(b"photo", settings, pool)
+        other = await cache.detect_and_encode(b"photo", settings._replace(model="cnn"), pool)
+        return first, again, other
+
+    first, again, other = asyncio.run(scenario())
+    assert pool.calls == 2
+    assert again[0] == first[0][0] and np.array_equal(again[1][0], first[2][1][0])
+    assert cache.stats()["hits"] >= 1 and cache.stats()["misses"] == 4
+
+    # A fresh process finds the result on disk
+    restarted = EncodingCache(size=2, directory=str(tmp_path))
+    locations, encodings = asyncio.run(restarted.detect_and_encode(b"photo", settings, pool))
+    assert pool.calls == 2 and locations == [(0, 10, 10, 0)] and encodings[0][0] == 5
+    assert restarted.stats()["disk_hits"] == 1
+
+    results = asyncio.run(restarted.detect_and_encode_batch([b"photo", b"new!!!"], settings, pool))
+    assert pool.calls == 3 and [r[1][0][0] for r in results] == [5, 6]
+
+
+def test_disk_tier_drops_least_recently_used_files_over_budget(tmp_path):
+    pool = CountingPool()
+    settings = DetectorSettings()
+    probe = EncodingCache(size=1, directory=str(tmp_path / "probe"))
+    asyncio.run(probe.detect_and_encode(b"a", settings, pool))
+    file_size = sum(size for _, size, _ in probe._files())
+
+    # Room for three files; the memory tier holds one entry
+    cache = EncodingCache(size=1, directory=str(tmp_path / "cache"), disk_bytes=file_size * 3)
+
+    async def scenario():
+        for name in [b"a", b"b", b"c"]:
+            await cache.detect_and_encode(name, settings, pool)
+            await asyncio.sleep(0.01)  # distinct modification times
+        await cache.detect_and_encode(b"a", settings, pool)  # disk hit renews a
+        await cache.detect_and_encode(b"d", settings, pool)
+
+    asyncio.run(scenario())
+    assert cache.stats()["disk_hits"] == 1 and cache.stats()["disk_evictions"] >= 1
+    restarted = EncodingCache(size=1, directory=str(tmp_path / "cache"))
+    calls = pool.calls
+    asyncio.run(restarted.detect_and_encode(b"a", settings, pool))
+    asyncio.run(restarted.detect_and_encode(b"d", settings, pool))
+    assert pool.calls == calls
+    asyncio.run(restarted.detect_and_encode(b"b", settings, pool))
+    assert pool.calls == calls + 1
@@ -0,0 +1,84 @@
+import io
+import zipfile
+from concurrent.futures import Future
+
+import numpy as np
+import pytest
+from app import enrollment, models
+from app.gallery import Gallery
+
+
+class FakePool:
+    """Stands in for the recognition pool: b"faces:N:seed" has N faces"""
+    workers = 2
+
+    def submit(self, fn, images, settings):
+        results = []
+        for contents in images:
+            _, faces, seed = contents.decode().split(":")
+            encoding = np.random.default_rng(int(seed)).normal(scale=0.1, size=128)
+            results.append((int(faces), encoding if faces == "1" else None))
+        future = Future()
+        future.set_result(results)
+        return future
+
+
+def test_enroll_zip_in_batches(db_session, monkeypatch):
+    db = db_session
+    monkeypatch.setattr(enrollment, "gallery", Gallery(snapshot_dir=None))
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for person in range(5):
+            archive.writestr(f"people/user{person}/a.jpg", f"faces:1:{person}")
+            archive.writestr(f"people/user{person}/b.jpg", f"faces:1:{person + 100}")
+        archive.writestr("user0/group.jpg", "faces:2:0")
+        archive.writestr("user1/blank.jpg", "faces:0:0")
+        archive.writestr("loose.jpg", "faces:1:7")
+    buffer.seek(0)
+
+    skipped = []
+    report = enrollment.enroll(db, enrollment.zip_photos(buffer, skipped), skipped,
+                               commit_size=2, chunk_size=3, pool=FakePool())
+    assert report["users_created"] == 5 and report["faces_added"] == 10
+    assert sorted(item["reason"] for item in report["skipped"]) == ["2 faces", "no face", "not in a name/ folder"]
+    assert db.query(models.Face).count() == 10
+    assert db.query(models.FaceTemplate).filter(models.FaceTemplate.samples == 2).count() == 5
+    assert len(enrollment.gallery) == 5 and enrollment.gallery.sample_count == 10
+
+    photos = [enrollment.Photo("user0", "user0/c.jpg", b"faces:1:42")]
+    report = enrollment.enroll(db, photos, replace=True, pool=FakePool())
+    assert report["users_updated"] == 1
+    assert db.query(models.Face).join(models.User).filter(models.User.name == "user0").count() == 1
+    assert enrollment.gallery.sample_count == 9
+
+
+def test_batches_committed_before_a_failure_reach_the_gallery(db_session, monkeypatch):
+    monkeypatch.setattr(enrollment, "gallery", Gallery(snapshot_dir=None))
+    photos = [enrollment.Photo(f"user{i}", f"user{i}/a.jpg", f"faces:1:{i}".encode()) for i in range(4)]
+    photos.append(enrollment.Photo("broken", "broken/a.jpg", b"faces:?:0"))
+
+    with pytest.raises(ValueError):
+        enrollment.enroll(db_session, photos, commit_size=1, chunk_size=1, pool=FakePool())
+    stored = db_session.query(models.User).count()
+    assert stored > 0
+    assert len(enrollment.gallery) == stored
+
+
+def test_zip_limits_are_checked_before_reading(monkeypatch):
+    monkeypatch.setattr(enrollment, "ENROLL_IMAGE_MAX_BYTES", 20)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("alice/a.jpg", "faces:1:0")
+        archive.writestr("bob/bomb.jpg", b"\0" * 10_000)
+    buffer.seek(0)
+
+    skipped = []
+    photos = list(enrollment.zip_photos(buffer, skipped))
+    assert [photo.path for photo in photos] == ["alice/a.jpg"]
+    assert skipped == [{"file": "bob/bomb.jpg", "reason": "larger than 20 bytes"}]
+
+    monkeypatch.setattr(enrollment, "ENROLL_ZIP_MAX_FILES", 1)
+    buffer.seek(0)
+    with pytest.raises(ValueError):
+        enrollment.zip_photos(buffer, [])
@@ -0,0 +1,145 @@
+import numpy as np
+from app.gallery import Gallery
+
+
+def test_gallery_match_and_update():
+    gallery = Gallery(snapshot_dir=None)
+    rng = np.random.default_rng(0)
+    encodings = rng.normal(scale=0.1, size=(3, 128))
+    for user_id, encoding in enumerate(encodings, start=1):
+        gallery.upsert(user_id, f"user{user_id}", True, encoding)
+    assert len(gallery) == 3
+
+    match = gallery.match(encodings[1])
+    assert match.user_id == 2
+    assert match.active
+
+    gallery.update_user(2, "user2", False)
+    assert gallery.match(encodings[1]).active is False
+
+    gallery.remove(2)
+    assert len(gallery) == 2
+    assert gallery.match(encodings[1]) is None
+
+
+def test_gallery_matches_any_of_several_samples():
+    gallery = Gallery(snapshot_dir=None)
+    rng = np.random.default_rng(1)
+    base = rng.normal(scale=0.1, size=128)
+    # Two lighting conditions of one person, plus a stranger
+    samples = [base + rng.normal(scale=0.02, size=128), base + 0.3 * np.eye(128)[0]]
+    gallery.upsert(1, "alice", True, samples)
+    gallery.upsert(2, "bob", True, rng.normal(scale=0.1, size=128))
+    assert len(gallery) == 2 and gallery.sample_count == 3
+
+    assert gallery.match(samples[1] + 0.01).user_id == 1
+    assert gallery.match(samples[0]).distance < 0.4
+    assert gallery.match(base + np.eye(128)[1]) is None
+
+    gallery.upsert(1, "alice", True, samples[:1])
+    assert gallery.sample_count == 2
+
+
+def test_crud_keeps_templates_in_step(db_session, monkeypatch):
+    from app import crud, models
+
+    db = db_session
+    monkeypatch.setattr(crud, "gallery", Gallery(snapshot_dir=None))
+    monkeypatch.setattr(crud, "FACE_MAX_SAMPLES", 2)
+    user = models.User(name="carol")
+    db.add(user)
+    db.commit()
+
+    rng = np.random.default_rng(2)
+    encodings = rng.normal(scale=0.1, size=(3, 128)).astype(np.float32)
+    for encoding in encodings:
+        crud.create_face(db, user.id, encoding)
+    assert len(crud.get_faces(db, user.id)) == 2
+    template = db.get(models.FaceTemplate, user.id)
+    assert template.samples == 2
+    assert np.allclose(template.centroid, encodings[1:].mean(axis=0), atol=1e-6)
+    assert crud.gallery.sample_count == 2
+
+    crud.delete_face(db, crud.get_faces(db, user.id)[0])
+    assert db.get(models.FaceTemplate, user.id).spread == 0.0
+    crud.delete_face(db, crud.get_faces(db, user.id)[0])
+    assert db.get(models.FaceTemplate, user.id) is None and len(crud.gallery) == 0
+
+
+def test_processes_share_a_mapped_snapshot(tmp_path, db_session):
+    from app import models
+
+    db = db_session
+    rng = np.random.default_rng(3)
+    encodings = rng.normal(scale=0.1, size=(3, 128)).astype(np.float32)
+    user = models.User(name="dave")
+    db.add(user)
+    db.commit()
+    db.add(models.Face(user_id=user.id, encoding=encodings[0]))
+    db.commit()
+
+    writer = Gallery(snapshot_dir=str(tmp_path / "snapshot"))
+    writer.load(db)
+    reader = Gallery(snapshot_dir=str(tmp_path / "snapshot"))
+    reader.load(db)
+    assert reader.generation == writer.generation
+    assert isinstance(reader._snapshot.samples, np.memmap)
+    assert reader.match(encodings[0]).name == "dave"
+
+    # Enrolled through another process: picked up on the next request
+    writer.upsert(99, "erin", True, encodings[1:])
+    writer.flush()
+    reader.ensure_loaded(db)
+    assert reader.match(encodings[2]).name == "erin" and reader.sample_count == 3
+
+    # Changed behind the snapshot's back: rebuilt from the database
+    db.add(models.Face(user_id=user.id, encoding=encodings[2]))
+    db.commit()
+    fresh = Gallery(snapshot_dir=str(tmp_path / "snapshot"))
+    fresh.load(db)
+    assert len(fresh) == 1 and fresh.sample_count == 2
+
+
+def test_snapshot_is_rebuilt_after_any_change_it_did_not_see(tmp_path, db_session, monkeypatch):
+    from app import crud, models, schemas
+
+    db = db_session
+    snapshot_dir = str(tmp_path / "snapshot")
+    api = Gallery(snapshot_dir=snapshot_dir)
+    monkeypatch.setattr(crud, "gallery", api)
+    api.load(db)
+    encoding = np.random.default_rng(4).normal(scale=0.1, size=128).astype(np.float32)
+    user = crud.create_user(db, schemas.UserCreate(name="frank", active=True))
+    crud.create_face(db, user.id, encoding)
+    crud.update_user(db, user, schemas.UserUpdate(name="franklin", active=True))
+    api.flush()
+
+    # Every change went through the gallery, so the snapshot is trusted
+    worker = Gallery(snapshot_dir=snapshot_dir)
+    worker.load(db)
+    assert isinstance(worker._snapshot.samples, np.memmap)
+    assert worker.match(encoding).name == "franklin"
+
+    # Same counts, different flag: the old (users, samples) check missed this
+    user.active = False
+    db.commit()
+    worker = Gallery(snapshot_dir=snapshot_dir)
+    worker.load(db)
+    assert not isinstance(worker._snapshot.samples, np.memmap)
+    assert worker.match(encoding).active is False
+
+
+def test_changes_in_a_burst_are_written_once(tmp_path, db_session):
+    snapshot_dir = str(tmp_path / "snapshot")
+    writer = Gallery(snapshot_dir=snapshot_dir, snapshot_seconds=60)
+    writer.load(db_session)
+    loaded = writer.generation
+    rng = np.random.default_rng(5)
+    for user_id in range(3):
+        writer.upsert(user_id + 1, f"user{user_id}", True, rng.normal(scale=0.1, size=128))
+    assert writer.generation == loaded and len(writer) == 3
+
+    writer.flush()
+    assert writer.generation != loaded
+    reader = Gallery(snapshot_dir=snapshot_dir)
+    assert reader.refresh() and len(reader) == 3
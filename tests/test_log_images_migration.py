@@ -0,0 +1,28 @@
+import os
+from datetime import datetime
+
+from sqlalchemy import create_engine, text
+
+from app.migrations import log_images
+
+
+def test_backfill_picks_latest_image_before_each_log(tmp_path, monkeypatch):
+    faces = tmp_path / "faces"
+    faces.mkdir()
+    for name, ts in [("face_1_1.jpg", datetime(2024, 1, 1, 10)), ("face_2_2.jpg", datetime(2024, 1, 1, 12))]:
+        path = faces / name
+        path.write_bytes(b"jpg")
+        os.utime(path, (ts.timestamp(), ts.timestamp()))
+    monkeypatch.setattr(log_images, "FACES_DIR", str(faces))
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'db.sqlite'}")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE access_logs (id INTEGER PRIMARY KEY, status VARCHAR, timestamp DATETIME)"))
+        conn.execute(text("INSERT INTO access_logs VALUES (1, 'denied', '2024-01-01 09:00:00'),"
+                          " (2, 'granted', '2024-01-01 11:00:00'), (3, 'denied', '2024-01-01 13:00:00')"))
+    log_images.upgrade(engine)
+    log_images.upgrade(engine)  # idempotent
+
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT id, face_image_url FROM access_logs ORDER BY id")).fetchall()
+    assert rows == [(1, None), (2, "/media/faces/face_1_1.jpg"), (3, "/media/faces/face_2_2.jpg")]
@@ -0,0 +1,130 @@
+import asyncio
+import os
+import sqlite3
+
+import pytest
+from sqlalchemy import func, select
+
+from app import log_writer, models
+from app.log_writer import LogWriter
+
+
+@pytest.fixture()
+def engine(db_engine):
+    """The shared test database with one older log, id 7"""
+    with db_engine.begin() as conn:
+        conn.execute(models.AccessLog.__table__.insert(), [{"id": 7, "status": "granted"}])
+    return db_engine
+
+
+def _count(engine):
+    with engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(models.AccessLog)).scalar()
+
+
+def _lock(engine):
+    """Another connection holding the write lock, like a stuck writer elsewhere"""
+    conn = sqlite3.connect(engine.url.database, isolation_level=None)
+    conn.execute("BEGIN EXCLUSIVE")
+    return conn
+
+
+def test_logs_get_database_ids_when_their_batch_commits(tmp_path, engine):
+    writer = LogWriter(engine, batch_size=10, flush_seconds=60, spill_path=str(tmp_path / "spill.ndjson"))
+    writer.start()
+    logs = [writer.log(user_id=None, status="denied") for _ in range(25)]
+    assert all(log.id is None and log.timestamp is not None for log in logs)
+    assert writer.flush(timeout=5)
+    assert [log.id for log in logs] == list(range(8, 33))
+    assert _count(engine) == 26
+    assert writer.batches == 3
+
+    # A caller that needs the id waits for the commit instead of the timer
+    assert writer.log(user_id=None, status="error", wait=True).id == 33
+    writer.log(user_id=None, status="error")
+    writer.stop()  # flushes what is still queued
+    assert _count(engine) == 28
+
+
+def test_writers_sharing_a_database_never_collide(tmp_path, engine):
+    writers = [LogWriter(engine, batch_size=5, flush_seconds=60, spill_path=str(tmp_path / f"spill{i}.ndjson"))
+               for i in range(2)]
+    for writer in writers:
+        writer.start()
+    logs = []
+    for _ in range(4):
+        for writer in writers:
+            logs += writer.log_many([{"user_id": None, "status": "granted"} for _ in range(3)], wait=True)
+    for writer in writers:
+        writer.stop()
+    assert len({log.id for log in logs}) == 24
+    assert _count(engine) == 25
+
+
+def test_failed_batches_are_retried_then_spilled_at_shutdown(tmp_path, engine):
+    spill = str(tmp_path / "spill.ndjson")
+    writer = LogWriter(engine, batch_size=100, flush_seconds=0.05, spill_path=spill)
+    writer.start()
+    lock = _lock(engine)
+    writer.log_many([{"user_id": None, "status": "denied"} for _ in range(3)])
+    assert not writer.flush(timeout=1.5)
+    assert writer.retries >= 1 and writer.dropped == 0
+    lock.execute("ROLLBACK")
+    assert writer.flush(timeout=5)
+    assert _count(engine) == 4
+
+    # Still failing when the writer stops: the logs go to disk, not away
+    lock.execute("BEGIN EXCLUSIVE")
+    writer.log_many([{"user_id": None, "status": "granted", "face_image_url": "/media/faces/a.jpg"}
+                     for _ in range(2)])
+    writer.stop()
+    lock.execute("ROLLBACK")
+    lock.close()
+    assert writer.spilled == 2 and os.path.exists(spill)
+
+    restarted = LogWriter(engine, batch_size=100, flush_seconds=60, spill_path=spill)
+    restarted.start()
+    assert restarted.flush(timeout=5)
+    restarted.stop()
+    assert _count(engine) == 6
+    assert not os.path.exists(spill) and not os.path.exists(spill + ".replaying")
+
+
+def test_drop_newest_policy_discards_when_full(tmp_path, engine):
+    writer = LogWriter(engine, batch_size=100, flush_seconds=60, queue_size=3, overflow="drop_newest",
+                       spill_path=str(tmp_path / "spill.ndjson"))
+    writer.start()
+    writer.log_many([{"user_id": None, "status": "denied"} for _ in range(3)])
+    writer.log(user_id=None, status="denied")
+    assert writer.dropped == 1
+    writer.stop()
+    assert _count(engine) == 4
+
+
+def test_async_callers_wait_for_room_off_the_event_loop(tmp_path, engine, monkeypatch):
+    monkeypatch.setattr(log_writer, "LOG_BLOCK_SECONDS", 0.5)
+    writer = LogWriter(engine, batch_size=100, flush_seconds=60, queue_size=1,
+                       spill_path=str(tmp_path / "spill.ndjson"))
+    writer.start()
+    writer.log(user_id=None, status="denied")  # fills the queue
+
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.02)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        log = await writer.log_async(user_id=None, status="granted")
+        task.cancel()
+        return log, ticks
+
+    log, ticks = asyncio.run(main())
+    # Blocked for LOG_BLOCK_SECONDS then written directly, while the loop kept running
+    assert log.id is not None
+    assert ticks >= 10
+    writer.stop()
+    assert _count(engine) == 3
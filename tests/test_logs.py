@@ -8,3 +8,112 @@ def test_logs_empty():
     response = client.get("/logs/")
     assert response.status_code == 200
     assert response.json() == []
+
+def test_logs_cursor_pages(db_override):
+    from datetime import datetime, timedelta
+    from app import models
+    db = db_override
+    user = models.User(name="cursor_user")
+    db.add(user)
+    db.commit()
+    base = datetime(2024, 1, 1)
+    db.add_all([models.AccessLog(user_id=user.id, status="granted", timestamp=base + timedelta(minutes=i))
+                for i in range(5)])
+    db.commit()
+
+    first = client.get("/logs/?limit=3&status=granted")
+    assert [log["user_name"] for log in first.json()] == ["cursor_user"] * 3
+    cursor = first.headers["X-Next-Cursor"]
+    second = client.get(f"/logs/?limit=3&status=granted&cursor={cursor}")
+    assert len(second.json()) == 2
+    assert second.json()[0]["timestamp"] < first.json()[-1]["timestamp"]
+    assert "X-Next-Cursor" not in second.headers
+
+    assert client.get("/logs/?cursor=not-a-cursor").status_code == 400
+
+
+def test_skip_pages_stop_where_the_database_ends(db_override, tmp_path, monkeypatch):
+    from datetime import datetime, timedelta
+    from app import models
+    from app.archive import LogArchive
+    from app.routers import logs
+    db = db_override
+    base = datetime(2024, 1, 1)
+    db.add_all([models.AccessLog(id=i + 1, status="granted", timestamp=base + timedelta(days=i)) for i in range(5)])
+    db.commit()
+    archive = LogArchive(str(tmp_path / "archive"))
+    assert archive.archive(db, base + timedelta(days=3)) == 3
+    monkeypatch.setattr(logs, "log_archive", archive)
+
+    first = client.get("/logs/?limit=3&skip=0")
+    assert [log["id"] for log in first.json()] == [5, 4, 3]
+    # Past the database, skip no longer reaches the archive; the cursor does
+    assert client.get("/logs/?limit=3&skip=3").json() == []
+    rest = client.get(f"/logs/?limit=3&cursor={first.headers['X-Next-Cursor']}")
+    assert [log["id"] for log in rest.json()] == [2, 1]
+
+
+def test_export_streams_filtered_csv(db_override):
+    from datetime import datetime
+    from app import models
+    db = db_override
+    db.add_all([models.AccessLog(status="denied", timestamp=datetime(2023, 5, day)) for day in range(1, 4)])
+    db.commit()
+
+    response = client.get("/logs/export?status=denied&since=2023-05-02T00:00:00&until=2023-06-01T00:00:00")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    lines = response.text.splitlines()
+    assert lines[0] == "id,timestamp,status,user_id,user_name,face_image_url"
+    assert [line.split(",")[1] for line in lines[1:]] == ["2023-05-02T00:00:00", "2023-05-03T00:00:00"]
+
+
+def test_websocket_replays_then_streams_new_logs(db_override):
+    from app import crud
+    first = crud.log_access(db_override, user_id=None, status="denied")
+    crud.log_access(db_override, user_id=None, status="denied")
+    with client.websocket_connect(f"/logs/ws?status=denied&last_id={first.id}") as ws:
+        assert ws.receive_json()["id"] == first.id + 1
+        crud.log_access(db_override, user_id=None, status="granted")
+        latest = crud.log_access(db_override, user_id=None, status="denied")
+        assert ws.receive_json()["id"] == latest.id
+
+
+def test_replay_pages_through_a_gap_larger_than_the_buffer(db_override, monkeypatch):
+    from app import crud, events
+    from app.events import LogBus, Subscription
+    from sqlalchemy.orm import sessionmaker
+    logs = crud.log_access_many(db_override, [{"user_id": None, "status": "denied"} for _ in range(9)])
+    monkeypatch.setattr(events, "LOG_STREAM_REPLAY", 3)
+    bus = LogBus(replay=3)
+    bus.publish(logs[-3:])
+    sub = Subscription(None, None, queue_size=10)
+    session_factory = sessionmaker(bind=db_override.get_bind())
+
+    pages = []
+    after_id = logs[0].id
+    while after_id is not None:
+        page, after_id = bus.replay(sub, after_id, session_factory)
+        pages.append([event["id"] for event in page])
+    ids = [log.id for log in logs]
+    # The second page reaches the buffer, which supplies the rest
+    assert pages == [ids[1:4], ids[4:]]
+    assert sub.replayed_through == ids[-1]
+
+
+def test_live_events_arrive_even_out_of_id_order():
+    import asyncio
+    from datetime import datetime
+    from app import models
+    from app.events import LogBus
+
+    async def main():
+        bus = LogBus()
+        sub = bus.subscribe()
+        sub.replayed_through = 3
+        for log_id in (3, 5, 4):
+            bus.publish([models.AccessLog(id=log_id, status="granted", timestamp=datetime(2024, 1, 1))])
+        return [(await sub.next(1))["id"] for _ in range(2)]
+
+    # 3 was sent during the replay; 4, committed after 5, still gets through
+    assert asyncio.run(main()) == [5, 4]
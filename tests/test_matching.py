@@ -0,0 +1,16 @@
+import numpy as np
+from app.matching import ExactMatcher, IVFMatcher
+
+
+def test_ivf_matches_exact_when_scanning_all_lists():
+    rng = np.random.default_rng(0)
+    gallery = rng.normal(scale=0.1, size=(500, 128)).astype(np.float32)
+    probes = gallery[:20] + rng.normal(scale=0.01, size=(20, 128)).astype(np.float32)
+
+    exact_idx, exact_dist = ExactMatcher(gallery).search(probes, k=3)
+    ivf = IVFMatcher(gallery, n_lists=10, n_probe=10)
+    ivf_idx, ivf_dist = ivf.search(probes, k=3)
+
+    assert np.array_equal(exact_idx[:, 0], np.arange(20))
+    assert np.array_equal(ivf_idx, exact_idx)
+    assert np.allclose(ivf_dist, exact_dist, atol=1e-5)
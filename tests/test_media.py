@@ -0,0 +1,62 @@
+import os
+
+import cv2
+import numpy as np
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app import media
+from app.routers import faces
+
+
+def test_capture_is_content_addressed_sharded_and_cropped(tmp_path, monkeypatch):
+    monkeypatch.setattr(media, "FACES_DIR", str(tmp_path))
+    monkeypatch.setattr(media, "THUMBS_DIR", str(tmp_path / "thumbs"))
+    monkeypatch.setattr(media, "MEDIA_PREGENERATE_SIZES", [])
+    image = np.random.default_rng(0).integers(0, 255, (480, 640, 3), dtype=np.uint8)
+    ok, jpeg = cv2.imencode(".jpg", image)
+    contents = jpeg.tobytes()
+
+    url = media.save_capture(contents, location=(100, 300, 200, 200))
+    assert url == media.save_capture(contents, location=(100, 300, 200, 200))
+    relative = url[len(media.FACES_URL) + 1:]
+    shard_a, shard_b, filename = relative.split("/")
+    assert filename.startswith(shard_a + shard_b) and filename.endswith(".jpg")
+
+    crop = cv2.imread(os.path.join(tmp_path, relative))
+    assert crop.shape[:2] == (160, 160)  # 100 px box plus 30% margin each side
+    files = [f for _, _, names in os.walk(tmp_path) for f in names]
+    assert len(files) == 2 and sum(f.endswith(".full.jpg") for f in files) == 1
+
+    other = media.save_capture(contents, location=(10, 60, 60, 10))
+    assert other != url
+
+
+def test_thumbnails_are_cached_with_strong_etags(tmp_path, monkeypatch):
+    faces_dir = tmp_path / "faces"
+    monkeypatch.setattr(media, "FACES_DIR", str(faces_dir))
+    monkeypatch.setattr(faces, "FACES_DIR", str(faces_dir))
+    monkeypatch.setattr(media, "THUMBS_DIR", str(tmp_path / "thumbs"))
+    monkeypatch.setattr(media, "MEDIA_PREGENERATE_SIZES", [64])
+    app = FastAPI()
+    app.include_router(faces.router, prefix=media.FACES_URL)
+    client = TestClient(app)
+
+    image = np.random.default_rng(1).integers(0, 255, (480, 640, 3), dtype=np.uint8)
+    url = media.save_capture(image=image, location=(100, 300, 300, 100))
+    assert os.path.exists(tmp_path / "thumbs" / "64" / url[len(media.FACES_URL) + 1:])
+
+    response = client.get(url, params={"size": 256})
+    assert response.status_code == 200
+    assert "immutable" in response.headers["cache-control"]
+    etag = response.headers["etag"]
+    assert cv2.imdecode(np.frombuffer(response.content, np.uint8), cv2.IMREAD_COLOR).shape[:2] == (256, 256)
+    assert client.get(url, params={"size": 256}, headers={"If-None-Match": etag}).status_code == 304
+    assert client.get(url, headers={"If-None-Match": etag}).status_code == 200
+    assert client.get(url, params={"size": 100}).status_code == 400
+    assert client.get(media.FACES_URL + "/../secret.jpg").status_code == 404
+
+    (faces_dir / "face_1.jpg").write_bytes(response.content)
+    legacy = client.get(media.FACES_URL + "/face_1.jpg")
+    assert legacy.headers["cache-control"] == "no-cache"
+    assert client.get(media.FACES_URL + "/face_1.jpg", headers={"If-None-Match": legacy.headers["etag"]}).status_code == 304
@@ -0,0 +1,25 @@
+import numpy as np
+from app.motion import MotionGate
+
+
+def test_static_scene_is_skipped_and_motion_is_processed():
+    gate = MotionGate(threshold=0.01, hold_seconds=0)
+    empty = np.zeros((240, 320, 3), dtype=np.uint8)
+    gate.check(empty, now=0.0)  # first frame seeds the background
+    assert not gate.check(empty, now=1.0)
+    assert not gate.check(empty, now=2.0)
+
+    person = empty.copy()
+    person[60:200, 120:220] = 200
+    assert gate.check(person, now=3.0)
+    assert gate.frames_skipped == 2
+    assert gate.frames_processed == 2
+
+
+def test_roi_ignores_changes_outside_the_door():
+    gate = MotionGate(threshold=0.01, hold_seconds=0, roi=(0.5, 0.0, 0.5, 1.0))
+    empty = np.zeros((240, 320, 3), dtype=np.uint8)
+    gate.check(empty, now=0.0)
+    left_only = empty.copy()
+    left_only[:, :100] = 255
+    assert not gate.check(left_only, now=1.0)
@@ -0,0 +1,129 @@
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+import numpy as np
+
+from app import access, recognition_service as service_module
+from app.capture import Frame
+from app.gallery import Gallery
+from app.recognition_service import RecognitionService
+from app.workers import detect_frame
+
+ALICE = np.full(128, 0.05)
+STRANGER = np.full(128, -0.05)
+
+
+class StubFrames:
+    """Serves scripted frames, each a list of (box, encoding) faces, then
+    reports the camera as gone"""
+
+    error = None
+
+    def __init__(self, script):
+        self.script = script
+        self.requested = []
+        self.done = threading.Event()
+
+    @contextmanager
+    def consumer(self):
+        yield
+
+    def wait_for(self, after_seq=0):
+        self.requested.append(time.monotonic())
+        if after_seq >= len(self.script):
+            self.done.set()
+            return None
+        image = np.zeros((8, 8, 3), dtype=np.uint8)
+        image.flags.writeable = False
+        return Frame(after_seq + 1, time.time(), image, None)
+
+
+class StubPool:
+    def __init__(self, frames):
+        self.frames = frames
+        self.current = None
+
+    def submit(self, fn, image, arg):
+        future = Future()
+        if fn is detect_frame:
+            self.current = self.frames.script[len(self.frames.requested) - 1]
+            future.set_result([box for box, _ in self.current])
+        else:
+            faces = dict(self.current)
+            future.set_result([faces[box] for box in arg])
+        return future
+
+
+class StubDoor:
+    def __init__(self):
+        self.commands = []
+
+    def send(self, code):
+        self.commands.append(code)
+
+
+class StubLogs:
+    def __init__(self):
+        self.entries = []
+
+    def log_many(self, entries):
+        self.entries += entries
+
+
+def run_service(monkeypatch, script, granted_cooldown=0.2, denied_cooldown=0.05):
+    gallery = Gallery(snapshot_dir=None)
+    gallery.upsert(1, "alice", True, ALICE)
+    gallery.loaded = True
+    logs = StubLogs()
+    monkeypatch.setattr(service_module, "gallery", gallery)
+    monkeypatch.setattr(access, "gallery", gallery)
+    monkeypatch.setattr(service_module, "log_writer", logs)
+    monkeypatch.setattr(service_module, "save_capture", lambda image, location: "/media/faces/stub.jpg")
+    monkeypatch.setattr(service_module, "GRANTED_COOLDOWN", granted_cooldown)
+    monkeypatch.setattr(service_module, "DENIED_COOLDOWN", denied_cooldown)
+
+    frames = StubFrames(script)
+    door = StubDoor()
+    service = RecognitionService(sample_fps=100, motion_gate=False, frames=frames, door=door,
+                                 pool=StubPool(frames))
+    service.start()
+    try:
+        assert frames.done.wait(5)
+    finally:
+        service.stop()
+    return service, frames, door, logs
+
+
+def test_grant_opens_the_door_logs_and_pauses_for_the_cooldown(monkeypatch):
+    box = (10, 60, 60, 10)
+    service, frames, door, logs = run_service(monkeypatch, [[], [(box, ALICE)], []])
+
+    assert door.commands == ["O"]
+    assert [(entry["status"], entry["user_id"], entry["face_image_url"]) for entry in logs.entries] == \
+        [("granted", 1, "/media/faces/stub.jpg")]
+    assert service.granted == 1 and service.last_result["granted"] == ["alice"]
+    # The frame after the grant is only sampled once the cooldown is over
+    assert frames.requested[2] - frames.requested[1] >= 0.2
+    assert frames.requested[1] - frames.requested[0] < 0.2
+
+
+def test_repeated_denials_sound_the_buzzer(monkeypatch):
+    strangers = [[((10, 60 + 100 * i, 60, 10 + 100 * i), STRANGER)] for i in range(3)]
+    service, _, door, logs = run_service(monkeypatch, strangers)
+
+    assert door.commands == ["X", "X", "X", "B"]
+    assert [entry["status"] for entry in logs.entries] == ["denied"] * 3
+    assert service.denied == 3 and service.failed_attempts == 0
+
+
+def test_still_face_keeps_its_decision_across_the_cooldown(monkeypatch):
+    # Longer than a track would survive if tracks aged by wall-clock time
+    box = (10, 60, 60, 10)
+    service, _, door, logs = run_service(monkeypatch, [[(box, ALICE)]] * 5, granted_cooldown=1.5)
+
+    assert door.commands == ["O"]
+    assert len(logs.entries) == 1
+    assert service.tracker.stats()["encodes"] == 1
+    assert service.tracker.stats()["reuses"] == 4
@@ -0,0 +1,87 @@
+import queue
+import threading
+import time
+
+from app.serial_bridge import DoorController
+
+
+class FakeBoard:
+    """Behaves like smart_door.ino, with sequences shortened to 0.1 s"""
+
+    def __init__(self, port, baud_rate, timeout=1):
+        self.lines = queue.Queue()
+        self.written = []
+        self.lines.put(b"Arduino is ready.\r\n")
+
+    def write(self, data):
+        command = data.decode()
+        self.written.append(command)
+
+        def run():
+            self.lines.put(f"Received command: {command}\r\n".encode())
+            if command in "OXB":
+                time.sleep(0.1)
+                self.lines.put(b"Sequence complete.\r\n")
+        threading.Thread(target=run, daemon=True).start()
+
+    def readline(self):
+        try:
+            return self.lines.get(timeout=0.05)
+        except queue.Empty:
+            return b""
+
+    def close(self):
+        pass
+
+
+def test_commands_are_acknowledged_and_coalesced():
+    boards = []
+    attempts = []
+
+    def factory(port, baud_rate, timeout=1):
+        attempts.append(port)
+        if len(attempts) == 1:
+            raise OSError("no such device")
+        boards.append(FakeBoard(port, baud_rate, timeout))
+        return boards[-1]
+
+    door = DoorController("fake", serial_factory=factory)
+    try:
+        first = door.send("X")
+        assert door.send("X") is first
+        assert first.result(timeout=5) == "complete"
+        assert len(attempts) == 2 and boards[0].written == ["X"]
+
+        # While the buzzer runs, a queued denial is dropped by a later grant
+        alarm = door.send("B")
+        denied = door.send("X")
+        no_face = door.send("N")
+        opened = door.send("O")
+        assert [f.result(timeout=5) for f in (alarm, denied, no_face, opened)] == \
+            ["complete", "superseded", "received", "complete"]
+        assert boards[0].written == ["X", "B", "N", "O"]
+        assert door.stats()["coalesced"] == 1
+    finally:
+        door.stop()
+
+
+def test_grant_during_an_open_sequence_opens_again():
+    boards = []
+
+    def factory(port, baud_rate, timeout=1):
+        boards.append(FakeBoard(port, baud_rate, timeout))
+        return boards[-1]
+
+    door = DoorController("fake", serial_factory=factory)
+    try:
+        first = door.send("O")
+        deadline = time.monotonic() + 5
+        while door.stats()["current"] != "O" and time.monotonic() < deadline:
+            time.sleep(0.01)
+        again = door.send("O")
+        assert again is not first
+        assert door.send("O") is again  # queued grants still merge
+        assert [f.result(timeout=5) for f in (first, again)] == ["complete", "complete"]
+        assert boards[0].written == ["O", "O"]
+    finally:
+        door.stop()
@@ -0,0 +1,54 @@
+from app.tracking import FaceTracker
+
+
+def test_track_is_reused_until_it_drifts_or_ages():
+    tracker = FaceTracker(max_age=3, drift_iou=0.5, uncertain_margin=0.05, threshold=0.4)
+    box = (100, 200, 200, 100)
+
+    (track,) = tracker.update([box])
+    assert tracker.needs_encoding(track)
+    tracker.record(track, ({"status": "granted", "user_id": 1}, 'O', "alice", ""), 0.2)
+    assert track.changed
+
+    (same,) = tracker.update([(102, 202, 202, 102)])
+    assert same is track
+    assert not tracker.needs_encoding(same)
+
+    tracker.update([(130, 230, 230, 130)])
+    assert tracker.needs_encoding(track)  # drifted
+
+    tracker.update([box])
+    tracker.record(track, track.decision, 0.2)
+    assert not track.changed
+    for _ in range(3):
+        tracker.update([box])
+    assert not tracker.needs_encoding(track)
+    tracker.update([box])
+    assert tracker.needs_encoding(track)  # aged out
+
+
+def test_borderline_match_is_re_encoded_and_new_faces_get_new_tracks():
+    tracker = FaceTracker(uncertain_margin=0.05, threshold=0.4)
+    (track,) = tracker.update([(0, 50, 50, 0)])
+    tracker.record(track, ({"status": "granted", "user_id": 1}, 'O', "alice", ""), 0.38)
+    tracker.update([(0, 50, 50, 0)])
+    assert tracker.needs_encoding(track)
+
+    first, second = tracker.update([(0, 50, 50, 0), (0, 300, 50, 250)])
+    assert first is track
+    assert second.id != track.id
+
+
+def test_tracks_are_lost_after_missing_processed_frames():
+    tracker = FaceTracker(lost_after=2)
+    (track,) = tracker.update([(0, 50, 50, 0)])
+    tracker.update([])
+    tracker.update([])
+    (same,) = tracker.update([(0, 50, 50, 0)])
+    assert same is track
+
+    tracker.update([])
+    tracker.update([])
+    tracker.update([])
+    (fresh,) = tracker.update([(0, 50, 50, 0)])
+    assert fresh is not track
@@ -16,3 +16,30 @@ def test_create_and_read_user():
     assert response.status_code == 200
     users = response.json()
     assert any(u["name"] == "Alice" for u in users)
+
+
+def test_upload_face_runs_database_work_off_the_event_loop(monkeypatch):
+    import threading
+    import numpy as np
+    from app import crud
+    from app.encoding_cache import encoding_cache
+
+    user = client.post("/users/", json={"name": "photo_user", "active": True}).json()
+    loop_threads = []
+
+    async def detect(contents, settings):
+        loop_threads.append(threading.get_ident())
+        return [(0, 10, 10, 0)], [np.zeros(128, dtype=np.float32)]
+
+    crud_threads = []
+    create_face = crud.create_face
+
+    def recording_create_face(*args, **kwargs):
+        crud_threads.append(threading.get_ident())
+        return create_face(*args, **kwargs)
+
+    monkeypatch.setattr(encoding_cache, "detect_and_encode", detect)
+    monkeypatch.setattr(crud, "create_face", recording_create_face)
+    response = client.post(f"/users/{user['id']}/photo", files={"file": ("a.jpg", b"jpeg")})
+    assert response.status_code == 200 and response.json()["name"] == "photo_user"
+    assert crud_threads and crud_threads[0] != loop_threads[0]
@@ -0,0 +1,42 @@
+import threading
+
+import pytest
+
+from app import workers
+from app.workers import PoolBusy, RecognitionPool
+
+
+def test_pool_turns_jobs_away_when_backlog_is_full(monkeypatch):
+    monkeypatch.setattr(workers, "_warm_up", lambda: None)
+    pool = RecognitionPool(workers=0, queue_size=1)
+    release = threading.Event()
+    try:
+        running = [pool.submit(release.wait, 5) for _ in range(2)]
+        assert pool.stats()["in_flight"] == 2
+        with pytest.raises(PoolBusy):
+            pool.submit(release.wait, 5)
+        assert pool.rejected == 1
+
+        release.set()
+        assert all(future.result(timeout=5) for future in running)
+        assert pool.submit(sum, [1, 2]).result(timeout=5) == 3
+        pool.shutdown()
+        assert pool.in_flight == 0
+    finally:
+        release.set()
+        pool.shutdown()
+
+
+def test_fast_jobs_never_leave_a_negative_count(monkeypatch):
+    monkeypatch.setattr(workers, "_warm_up", lambda: None)
+    pool = RecognitionPool(workers=0, queue_size=4)
+    seen = []
+    try:
+        for _ in range(200):
+            future = pool.submit(int)
+            future.add_done_callback(lambda _f: seen.append(pool.in_flight))
+            future.result(timeout=5)
+        pool.shutdown()
+        assert min(seen) >= 0 and pool.in_flight == 0
+    finally:
+        pool.shutdown()